@@ -1,24 +1,30 @@
 import pandas as pd
 import numpy as np
-from google.cloud import bigquery
 import json
 
+import indicators
+import market_store
+
 # -------------------
 # CALCULS STANDARDS (FIDÉLITÉ 100% GOLD GAS)
 # -------------------
 
-def get_gold_pivots(df_slice, window=3):
-    """Trouve les pivots High/Low comme GOLD_FIND_PIVOTS"""
-    highs = df_slice['High'].values
-    lows = df_slice['Low'].values
-    p_h, p_l = [], []
-    for i in range(window, len(df_slice) - window):
+def get_gold_pivots(df_slice, window=3, pivots=None):
+    """Trouve les pivots High/Low comme GOLD_FIND_PIVOTS
+    pivots : pivots GOLD déjà calculés sur la série complète dont df_slice est
+    un préfixe ; on garde ceux dont la fenêtre tient dans df_slice."""
+    if pivots is None:
         # Logique stricte GAS : supérieur/inférieur aux voisins
-        if all(highs[i] > highs[j] for j in range(i-window, i+window+1) if i != j): p_h.append(highs[i])
-        if all(lows[i] < lows[j] for j in range(i-window, i+window+1) if i != j): p_l.append(lows[i])
+        pivots = indicators.pivot_arrays(
+            df_slice['High'].to_numpy(dtype=float), df_slice['Low'].to_numpy(dtype=float), w=window, gold=True
+        )
+    idx, typ, val = pivots
+    keep = idx < len(df_slice) - window
+    p_h = list(val[keep & (typ == indicators.PIVOT_H)])
+    p_l = list(val[keep & (typ == indicators.PIVOT_L)])
     return p_h, p_l
 
-def get_full_vlab_score(sub_df, df_idx):
+def get_full_vlab_score(sub_df, df_idx, pivots=None):
     """Miroir exact de GOLD_CALCULATE_SCORE"""
     curr_idx = len(sub_df) - 1
     cls = sub_df['Close']
@@ -49,7 +55,7 @@ def get_full_vlab_score(sub_df, df_idx):
     dist_mm20 = abs(cls.iloc[-1] - mm20) / mm20
     
     # 4. STRUCTURE (15 derniers pivots)
-    p_h, p_l = get_gold_pivots(sub_df, window=3)
+    p_h, p_l = get_gold_pivots(sub_df, window=3, pivots=pivots)
     p_h, p_l = p_h[-15:], p_l[-15:]
     hh = len(p_h) >= 2 and p_h[-1] > p_h[-2]
     hl = len(p_l) >= 2 and p_l[-1] > p_l[-2]
@@ -84,44 +90,196 @@ def get_full_vlab_score(sub_df, df_idx):
     return float(score), "/".join(reasons)
 
 # -------------------
-# BACKTESTER GOLD STANDARD
+# FENÊTRES GLISSANTES (sémantique pandas exacte : tail(p).mean() / np.std)
+# -------------------
+
+def _tail_windows(x, p):
+    """Fenêtre des p dernières valeurs pour chaque barre i >= p-1 (copie contiguë, lignes = barres)."""
+    x = np.asarray(x, dtype=float)
+    if len(x) < p:
+        return np.empty((0, p))
+    return np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(x, p))
+
+
+def _pad(values, p, n):
+    out = np.full(n, np.nan)
+    out[p - 1:] = values
+    return out
+
+
+def _head_count(x, p):
+    """Barres i < p-1 (fenêtre partielle x[:i+1], comme tail(p) sur un historique court)."""
+    return min(p - 1, len(x))
+
+
+def _tail_mean(x, p):
+    """Série.tail(p).mean() à chaque barre (NaN ignorés) ; fenêtre partielle avant p barres."""
+    x = np.asarray(x, dtype=float)
+    win = _tail_windows(x, p)
+    mask = np.isnan(win)
+    count = p - mask.sum(axis=1).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(mask, 0.0, win).sum(axis=1) / count
+    mean[count == 0] = np.nan
+    out = _pad(mean, p, len(x))
+
+    m = _head_count(x, p)
+    for i in range(m):
+        head = x[:i + 1]
+        head = head[~np.isnan(head)]
+        out[i] = head.sum() / len(head) if len(head) else np.nan
+    return out
+
+
+def _tail_std_pop(x, p):
+    """np.std(Série.tail(p)) (écart-type population, deux passes, NaN ignorés) à chaque barre."""
+    x = np.asarray(x, dtype=float)
+    win = _tail_windows(x, p)
+    mask = np.isnan(win)
+    count = p - mask.sum(axis=1).astype(float)
+    count[count <= 0] = np.nan
+    values = np.where(mask, 0.0, win)
+    avg = values.sum(axis=1) / count
+    sqr = (avg[:, None] - values) ** 2
+    sqr[mask] = 0.0
+    out = _pad(np.sqrt(sqr.sum(axis=1) / count), p, len(x))
+
+    m = _head_count(x, p)
+    for i in range(m):
+        head = x[:i + 1]
+        head = head[~np.isnan(head)]
+        out[i] = np.sqrt(((head.sum() / len(head) - head) ** 2).sum() / len(head)) if len(head) else np.nan
+    return out
+
+
+def _last_at_or_before(dates, targets):
+    """Position de la dernière date <= target (-1 si aucune)."""
+    return np.searchsorted(dates, targets, side='right') - 1
+
+
 # -------------------
+# MOTEUR VLAB SUR TABLEAUX
+# -------------------
+
+# Force relative GOLD : J vs J-62 (63 bougies), indépendant de VLAB_GLOBAL_SAMPLES
+VLAB_RS_BARS = 63
 
-def run_vlab_backtest_full():
-    p = {
-        'PROJECT_ID': 'project-16c606d0-6527-4644-907',
-        'DATASET_ID': 'Trading',
-        'TABLE_HISTO': 'CC_Historique_Cours',
-        'INDEX_TICKER': '^FCHI',
-        'VLAB_USE_MARKET_FILTER': True,
-        'VLAB_MARKET_SMA_PERIOD': 100,
-        'VLAB_GLOBAL_SCORE': 86,
-        'VLAB_GLOBAL_SAMPLES': 63,
-        'VLAB_TP_TREND': 0.13,
-        'VLAB_TP_RANGE': 0.10,
-        'VLAB_TREND_THRESHOLD': -0.003,
-        'VLAB_ATR_PERIOD': 50,
-        'VLAB_BE_FAST': 0.06,
-        'VLAB_BE_SLOW': 0.0495,
-        'VLAB_VOLAT_LIMIT': 0.025,
-        'VLAB_SL': 0.10,
-        'VLAB_FEES': 0.0056,
-        'VLAB_POS_SIZE': 4000
+def _vlab_features(df_t, df_idx, p):
+    """
+    Composantes de get_full_vlab_score précalculées pour toutes les barres
+    du titre (tableaux alignés sur df_t), en une passe par indicateur.
+    """
+    n = len(df_t)
+    dates = df_t['Date'].to_numpy(dtype='datetime64[ns]')
+    high = df_t['High'].to_numpy(dtype=float)
+    low = df_t['Low'].to_numpy(dtype=float)
+    close = df_t['Close'].to_numpy(dtype=float)
+    volume = df_t['Volume'].to_numpy()
+
+    i_dates = df_idx['Date'].to_numpy(dtype='datetime64[ns]')
+    i_close = df_idx['Close'].to_numpy(dtype=float)
+
+    # --- Filtre marché : ligne indice à la même date (première occurrence) ---
+    pos = np.searchsorted(i_dates, dates, side='left')
+    safe = np.minimum(pos, max(len(i_dates) - 1, 0))
+    has_idx = (pos < len(i_dates)) & (i_dates[safe] == dates) if len(i_dates) else np.zeros(n, dtype=bool)
+
+    # --- Force relative (VLAB_RS_BARS bougies, indice à la dernière date <= date) ---
+    back = VLAB_RS_BARS - 1
+    rs_val = np.full(n, np.nan)
+    idx_missing = np.ones(n, dtype=bool)
+    if n > back and len(i_dates):
+        now = _last_at_or_before(i_dates, dates[back:])
+        past = _last_at_or_before(i_dates, dates[:-back] if back else dates)
+        idx_missing[back:] = (now < 0) | (past < 0)
+        stock_perf = (close[back:] - close[:n - back]) / close[:n - back]
+        index_perf = (i_close[now] - i_close[past]) / i_close[past]
+        rs_val[back:] = (stock_perf - index_perf) * 100
+
+    # --- Volume & MM20 ---
+    vol_mean_20 = _tail_mean(volume.astype(float), 20)
+    v_ratio = volume / np.where(vol_mean_20 == 0, 1, vol_mean_20)
+    mm20 = _tail_mean(close, 20)
+    dist_mm20 = np.abs(close - mm20) / mm20
+
+    # --- Structure : pivots GOLD dont la fenêtre tient dans le préfixe (idx < i - 2) ---
+    idx, typ, val = indicators.pivot_arrays(high, low, w=3, gold=True)
+    limit = np.arange(n) - 2
+
+    def _rising(kind):
+        p_idx = idx[typ == kind]
+        p_val = val[typ == kind]
+        count = np.searchsorted(p_idx, limit, side='left')
+        ok = count >= 2
+        last = p_val[np.maximum(count - 1, 0)] if len(p_val) else np.zeros(n)
+        prev = p_val[np.maximum(count - 2, 0)] if len(p_val) else np.zeros(n)
+        return ok & (last > prev)
+
+    structure = _rising(indicators.PIVOT_H) & _rising(indicators.PIVOT_L)
+
+    # --- Squeeze ---
+    std20 = _tail_std_pop(close, 20)
+    atr20_sqz = _tail_mean(high - low, 20)
+    is_sqz = (mm20 + 2 * std20 < mm20 + 1.5 * atr20_sqz) & (mm20 - 2 * std20 > mm20 - 1.5 * atr20_sqz)
+
+    return {
+        'dates': dates, 'high': high, 'low': low, 'close': close,
+        'has_idx': has_idx, 'idx_row': safe,
+        'rs_val': rs_val, 'idx_missing': idx_missing,
+        'v_ratio': v_ratio, 'mm20': mm20, 'dist_mm20': dist_mm20,
+        'structure': structure, 'is_sqz': is_sqz,
+        'atr': _tail_mean(indicators.true_range(high, low, close), p['VLAB_ATR_PERIOD']),
     }
 
-    client = bigquery.Client(project=p['PROJECT_ID'])
-    query = f"SELECT * FROM `{p['DATASET_ID']}.{p['TABLE_HISTO']}` WHERE Ticker IN ('ORA.PA','{p['INDEX_TICKER']}') ORDER BY Date ASC"
-    df_raw = client.query(query).to_dataframe()
-    
-    for col in ['Close','High','Low','Volume']: df_raw[col] = df_raw[col].astype(float)
-    df_raw['Date'] = pd.to_datetime(df_raw['Date']).dt.tz_localize(None)
 
-    df_ora = df_raw[df_raw['Ticker']=='ORA.PA'].sort_values('Date').reset_index(drop=True)
-    df_idx = df_raw[df_raw['Ticker']==p['INDEX_TICKER']].sort_values('Date').reset_index(drop=True)
+def _vlab_score_at(f, i):
+    """get_full_vlab_score(df.loc[:i], df_idx) à partir des tableaux de _vlab_features."""
+    if f['idx_missing'][i]:
+        raise IndexError(f"Historique indice insuffisant pour la force relative au {pd.Timestamp(f['dates'][i]).date()}")
+    if f['rs_val'][i] <= 0:
+        return 0.0, "RS_NEG"
 
-    # Calculs Index
-    df_idx['SMA'] = df_idx['Close'].rolling(p['VLAB_MARKET_SMA_PERIOD']).mean()
-    df_idx['SLOPE'] = (df_idx['SMA'] - df_idx['SMA'].shift(4)) / df_idx['SMA'].shift(4)
+    # RSI GOLD : somme simple des 14 dernières variations
+    diff = np.diff(f['close'][i - 14:i + 1])
+    diff = diff[~np.isnan(diff)]
+    gains = diff[diff > 0].sum()
+    losses = -diff[diff < 0].sum()
+    rsi = 100 if losses == 0 else 100 - (100 / (1 + (gains / losses)))
+
+    score = 0
+    reasons = []
+    if 50 <= rsi <= 70:
+        score += 15
+        reasons.append("RSI")
+    v_ratio = f['v_ratio'][i]
+    if v_ratio > 1.5:
+        score += 25
+        reasons.append("VOL_B")
+    elif v_ratio > 1.1:
+        score += 12.5
+        reasons.append("VOL_M")
+    if f['dist_mm20'][i] <= 0.01:
+        score += 20 if f['close'][i] >= f['mm20'][i] else -10
+        reasons.append("MM20")
+    if f['structure'][i]:
+        score += 30
+        reasons.append("STRUCT")
+    if f['is_sqz'][i]:
+        score += 10
+        reasons.append("SQZ")
+
+    return float(score), "/".join(reasons)
+
+
+def _vlab_backtest_ticker(df_t, df_idx, p):
+    """Backtest VLAB d'un titre ; df_idx doit porter SMA / SLOPE. Retourne (trades, debug_logs)."""
+    f = _vlab_features(df_t, df_idx, p)
+    dates = pd.DatetimeIndex(f['dates'])
+    high, low, close = f['high'], f['low'], f['close']
+
+    idx_close = df_idx['Close'].to_numpy(dtype=float)
+    idx_sma = df_idx['SMA'].to_numpy(dtype=float)
+    idx_slope = df_idx['SLOPE'].to_numpy(dtype=float)
 
     trades = []
     debug_logs = []
@@ -129,14 +287,12 @@ def run_vlab_backtest_full():
     ePrice, entry_date, reached_be = 0, None, False
     active_tp, active_be_trig = 0, 0
 
-    for i in range(p['VLAB_GLOBAL_SAMPLES'], len(df_ora)):
-        curr = df_ora.loc[i]
-        
+    for i in range(p['VLAB_GLOBAL_SAMPLES'], len(close)):
         if in_pos:
-            perf_h = (curr['High'] - ePrice) / ePrice
-            perf_l = (curr['Low'] - ePrice) / ePrice
+            perf_h = (high[i] - ePrice) / ePrice
+            perf_l = (low[i] - ePrice) / ePrice
             if not reached_be and perf_h >= active_be_trig: reached_be = True
-            
+
             sl_price = p['VLAB_FEES'] if reached_be else -p['VLAB_SL']
             hit_tp = perf_h >= active_tp
             hit_sl = perf_l <= sl_price
@@ -145,7 +301,7 @@ def run_vlab_backtest_full():
                 final = active_tp if (hit_tp and not (hit_sl and perf_l < sl_price)) else sl_price
                 trades.append({
                     "Achat": entry_date.strftime('%Y-%m-%d'),
-                    "Vente": curr['Date'].strftime('%Y-%m-%d'),
+                    "Vente": dates[i].strftime('%Y-%m-%d'),
                     "Gain": float((final - p['VLAB_FEES']) * p['VLAB_POS_SIZE']),
                     "BE_Reached": reached_be
                 })
@@ -153,30 +309,34 @@ def run_vlab_backtest_full():
             continue
 
         # Filtre Marché SMA 100
-        idx_row = df_idx[df_idx['Date'] == curr['Date']]
-        if idx_row.empty: continue
-        fchi_c, fchi_sma, fchi_slope = idx_row['Close'].iloc[0], idx_row['SMA'].iloc[0], idx_row['SLOPE'].iloc[0]
+        if not f['has_idx'][i]: continue
+        r = f['idx_row'][i]
+        fchi_c, fchi_sma, fchi_slope = idx_close[r], idx_sma[r], idx_slope[r]
 
         if p['VLAB_USE_MARKET_FILTER'] and fchi_c < fchi_sma: continue
 
-        # Calcul Score (Passage de df_idx pour la Force Relative)
-        score, reasons = get_full_vlab_score(df_ora.loc[:i], df_idx)
-        
+        score, reasons = _vlab_score_at(f, i)
+
         if score >= p['VLAB_GLOBAL_SCORE']:
             # ATR pour Volatilité BE
-            high_low = df_ora['High'] - df_ora['Low']
-            high_close = (df_ora['High'] - df_ora['Close'].shift()).abs()
-            low_close = (df_ora['Low'] - df_ora['Close'].shift()).abs()
-            tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-            atr_val = tr.loc[:i].tail(p['VLAB_ATR_PERIOD']).mean()
-            
-            vol_pct = atr_val / curr['Close']
+            vol_pct = f['atr'][i] / close[i]
             active_tp = p['VLAB_TP_TREND'] if fchi_slope >= p['VLAB_TREND_THRESHOLD'] else p['VLAB_TP_RANGE']
             active_be_trig = p['VLAB_BE_FAST'] if (fchi_slope >= 0.004 and vol_pct < p['VLAB_VOLAT_LIMIT']) else p['VLAB_BE_SLOW']
-            
-            in_pos, ePrice, entry_date, reached_be = True, curr['Close'], curr['Date'], False
+
+            in_pos, ePrice, entry_date, reached_be = True, close[i], dates[i], False
             debug_logs.append({"date": entry_date.strftime('%Y-%m-%d'), "score": score, "reasons": reasons})
 
+    return trades, debug_logs
+
+
+def _vlab_index_frame(df_raw, p):
+    df_idx = df_raw[df_raw['Ticker'] == p['INDEX_TICKER']].sort_values('Date').reset_index(drop=True)
+    df_idx['SMA'] = df_idx['Close'].rolling(p['VLAB_MARKET_SMA_PERIOD']).mean()
+    df_idx['SLOPE'] = (df_idx['SMA'] - df_idx['SMA'].shift(4)) / df_idx['SMA'].shift(4)
+    return df_idx
+
+
+def _vlab_result(trades, debug_logs):
     return {
         "gain_total": float(pd.DataFrame(trades)['Gain'].sum()) if trades else 0.0,
         "nb_trades": len(trades),
@@ -184,5 +344,77 @@ def run_vlab_backtest_full():
         "debug_buys": debug_logs
     }
 
+
+# -------------------
+# BACKTESTER GOLD STANDARD
+# -------------------
+
+VLAB_CFG = {
+    'PROJECT_ID': 'project-16c606d0-6527-4644-907',
+    'DATASET_ID': 'Trading',
+    'TABLE_HISTO': 'CC_Historique_Cours',
+    'INDEX_TICKER': '^FCHI',
+    'TICKER': 'ORA.PA',
+    'VLAB_USE_MARKET_FILTER': True,
+    'VLAB_MARKET_SMA_PERIOD': 100,
+    'VLAB_GLOBAL_SCORE': 86,
+    'VLAB_GLOBAL_SAMPLES': 63,
+    'VLAB_TP_TREND': 0.13,
+    'VLAB_TP_RANGE': 0.10,
+    'VLAB_TREND_THRESHOLD': -0.003,
+    'VLAB_ATR_PERIOD': 50,
+    'VLAB_BE_FAST': 0.06,
+    'VLAB_BE_SLOW': 0.0495,
+    'VLAB_VOLAT_LIMIT': 0.025,
+    'VLAB_SL': 0.10,
+    'VLAB_FEES': 0.0056,
+    'VLAB_POS_SIZE': 4000,
+    'USE_LOCAL_STORE': True
+}
+
+
+def run_vlab_backtest_full(ticker=None, cfg=None):
+    """Backtest VLAB d'un titre (VLAB_CFG['TICKER'] par défaut) contre INDEX_TICKER."""
+    p = dict(VLAB_CFG, **(cfg or {}))
+    ticker = ticker or p['TICKER']
+
+    df_raw = market_store.load_history(
+        p['PROJECT_ID'],
+        p['DATASET_ID'],
+        p['TABLE_HISTO'],
+        tickers=[ticker, p['INDEX_TICKER']],
+        use_store=p['USE_LOCAL_STORE']
+    )
+
+    df_t = df_raw[df_raw['Ticker'] == ticker].sort_values('Date').reset_index(drop=True)
+    df_idx = _vlab_index_frame(df_raw, p)
+
+    return _vlab_result(*_vlab_backtest_ticker(df_t, df_idx, p))
+
+
+def run_vlab_backtest_universe(tickers=None, cfg=None):
+    """
+    Backtest VLAB de chaque titre (tickers=None : toute la table), une seule
+    lecture de l'historique. Retourne {ticker: résultat run_vlab_backtest_full}.
+    """
+    p = dict(VLAB_CFG, **(cfg or {}))
+
+    df_raw = market_store.load_history(
+        p['PROJECT_ID'],
+        p['DATASET_ID'],
+        p['TABLE_HISTO'],
+        tickers=sorted(set(tickers) | {p['INDEX_TICKER']}) if tickers else None,
+        use_store=p['USE_LOCAL_STORE']
+    )
+    df_idx = _vlab_index_frame(df_raw, p)
+
+    out = {}
+    for t, df_t in df_raw.groupby('Ticker', sort=True):
+        if t == p['INDEX_TICKER'] or (tickers and t not in tickers):
+            continue
+        df_t = df_t.sort_values('Date').reset_index(drop=True)
+        out[t] = _vlab_result(*_vlab_backtest_ticker(df_t, df_idx, p))
+    return out
+
 if __name__ == "__main__":
     print(json.dumps(run_vlab_backtest_full(), indent=2))
@@ -0,0 +1,163 @@
+# ==== START bars.py
+"""
+Conteneur de barres validé une seule fois.
+
+Bars.from_frame fait en une passe ce que chaque indicateur refaisait de son
+côté (pd.to_numeric, sort_index, copy) : coercition float64, dates tz-naive
+triées et uniques, tableaux contigus en lecture seule. Les indicateurs
+(indicators.py) peuvent ensuite travailler directement sur les tableaux.
+"""
+
+import numpy as np
+import pandas as pd
+
+BAR_FIELDS = ('High', 'Low', 'Close', 'Volume')
+
+
+def _as_float_array(values):
+    arr = np.ascontiguousarray(values, dtype=np.float64).view()
+    arr.setflags(write=False)
+    return arr
+
+
+class Bars:
+    """
+    Barres journalières d'un ticker (immutable).
+
+    dates  : datetime64[ns] tz-naive, strictement croissantes
+    days   : ordinaux jour int64 (jours depuis 1970-01-01)
+    high / low / close / volume : float64 contigus, lecture seule
+    quality: rapport qualité calculé à l'ingestion
+    """
+
+    __slots__ = ('ticker', 'dates', 'days', 'high', 'low', 'close', 'volume', 'quality', '_index')
+
+    def __init__(self, dates, high, low, close, volume, ticker=None, quality=None):
+        set_ = object.__setattr__
+        dates = np.asarray(dates, dtype='datetime64[ns]').view()
+        dates.setflags(write=False)
+        days = dates.astype('datetime64[D]').astype(np.int64)
+        days.setflags(write=False)
+
+        set_(self, 'ticker', ticker)
+        set_(self, 'dates', dates)
+        set_(self, 'days', days)
+        set_(self, 'high', _as_float_array(high))
+        set_(self, 'low', _as_float_array(low))
+        set_(self, 'close', _as_float_array(close))
+        set_(self, 'volume', _as_float_array(volume))
+        set_(self, 'quality', quality)
+        set_(self, '_index', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Bars est immuable")
+
+    def __len__(self):
+        return len(self.dates)
+
+    # ---------------------------
+    # Ingestion
+    # ---------------------------
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, ticker=None):
+        """
+        Ingestion unique : coercition numérique, dates tz-naive, tri,
+        dédoublonnage (dernière ligne gardée) et rapport qualité.
+        Si le frame est déjà propre (cas du panel), aucun tri ni copie inutile.
+        df.attrs['duplicate_dates'] : doublons déjà écartés en amont
+        (market_store), ajoutés au rapport qualité.
+        """
+        if isinstance(df, Bars):
+            return df
+
+        if ticker is None:
+            ticker = df.attrs.get('Ticker')
+
+        idx = df.index
+        if isinstance(idx, pd.DatetimeIndex) and idx.tz is not None:
+            idx = idx.tz_localize(None)
+        elif not isinstance(idx, pd.DatetimeIndex):
+            idx = pd.DatetimeIndex(pd.to_datetime(idx))
+
+        dates = idx.to_numpy(dtype='datetime64[ns]')
+        cols = {}
+        for f in BAR_FIELDS:
+            col = df[f] if f in df.columns else pd.Series(np.nan, index=df.index)
+            if col.dtype != np.float64:
+                col = pd.to_numeric(col, errors='coerce')
+            cols[f] = col.to_numpy(dtype=np.float64)
+
+        n_raw = len(dates)
+        steps = np.diff(dates.view(np.int64)) if n_raw > 1 else np.empty(0, dtype=np.int64)
+        is_sorted = bool((steps >= 0).all())
+        n_dup = 0
+
+        if not is_sorted or (steps == 0).any():
+            order = np.argsort(dates, kind='stable')
+            dates = dates[order]
+            cols = {f: v[order] for f, v in cols.items()}
+            # doublons : on garde la dernière occurrence
+            keep = np.ones(len(dates), dtype=bool)
+            keep[:-1] = dates[1:] != dates[:-1]
+            n_dup = int((~keep).sum())
+            dates = dates[keep]
+            cols = {f: v[keep] for f, v in cols.items()}
+
+        n_dup += int(df.attrs.get('duplicate_dates') or 0)
+        quality = cls._quality_report(cols, n_dup, not is_sorted)
+        return cls(dates, cols['High'], cols['Low'], cols['Close'], cols['Volume'], ticker=ticker, quality=quality)
+
+    @classmethod
+    def from_arrays(cls, dates, high, low, close, volume, ticker=None, duplicates=0):
+        """
+        Barres déjà triées et dédoublonnées (vues du MarketPanel) : pas de revalidation.
+        duplicates : doublons écartés à l'ingestion (MarketPanel.dup_counts).
+        """
+        cols = {'High': high, 'Low': low, 'Close': close, 'Volume': volume}
+        return cls(dates, high, low, close, volume, ticker=ticker,
+                   quality=cls._quality_report(cols, duplicates, False))
+
+    @staticmethod
+    def _quality_report(cols, n_dup, unsorted):
+        high, low, close, volume = cols['High'], cols['Low'], cols['Close'], cols['Volume']
+        with np.errstate(invalid='ignore'):
+            return {
+                'n_bars': int(len(close)),
+                'nan_close': int(np.isnan(close).sum()),
+                'nan_high_low': int((np.isnan(high) | np.isnan(low)).sum()),
+                'nan_volume': int(np.isnan(volume).sum()),
+                'zero_volume': int((volume == 0).sum()),
+                'non_positive_close': int((close <= 0).sum()),
+                'high_below_low': int((high < low).sum()),
+                'duplicate_dates': int(n_dup),
+                'unsorted': bool(unsorted),
+            }
+
+    def has_quality_issues(self):
+        q = self.quality or {}
+        return any(v for k, v in q.items() if k != 'n_bars')
+
+    # ---------------------------
+    # Vues pandas (sans copie)
+    # ---------------------------
+
+    @property
+    def index(self) -> pd.DatetimeIndex:
+        if self._index is None:
+            object.__setattr__(self, '_index', pd.DatetimeIndex(self.dates, name='Date'))
+        return self._index
+
+    def series(self, field) -> pd.Series:
+        return pd.Series(getattr(self, field.lower()), index=self.index, name=field, copy=False)
+
+    def to_frame(self) -> pd.DataFrame:
+        d = pd.DataFrame(
+            {f: getattr(self, f.lower()) for f in BAR_FIELDS},
+            index=self.index,
+            copy=False
+        )
+        d.attrs['Ticker'] = self.ticker if self.ticker is not None else 'NA'
+        return d
+
+# ==== END bars.py
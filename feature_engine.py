@@ -0,0 +1,591 @@
+# ==== START feature_engine.py
+"""
+Moteur d'indicateurs alpha4 par blocs de tickers (matrices 2D).
+
+Les séries de chaque ticker sont « compactées » : la k-ième barre du titre
+j est rangée en ligne k, colonne j (les trous de l'axe global des dates
+disparaissent, le bourrage NaN n'existe qu'après la dernière barre). Les
+fenêtres glissantes se comptent alors en barres du titre, exactement comme
+dans le calcul ticker par ticker, et chaque indicateur est une seule passe
+2D (rolling pandas colonne par colonne : mêmes noyaux, résultats
+bit-identiques à la version 1D).
+
+v4_feature_matrices retourne les cinq composantes du score, le score, les
+filtres et les valeurs loggées à l'entrée sous forme de matrices alignées ;
+la simulation par ticker se contente d'indexer ces tableaux.
+
+Élagage par borne du score (SCORE_PRUNING) : quand MIN_SCORE rend la
+structure indispensable, elle n'est calculée (fenêtres locales de pivots)
+qu'aux barres où le seuil reste atteignable une fois les filtres bon marché
+évalués (marché, prix/SMA, signe et momentum RS, score hors structure) ;
+un titre sans telle barre saute la structure. Ailleurs struct_code vaut ND,
+sans effet sur les entrées.
+"""
+
+import numpy as np
+import pandas as pd
+
+import indicator_cache
+import indicators
+from memo_cache import MemoCache
+
+FEATURE_BLOCK_TICKERS = 64
+
+
+# ===========================
+# Compactage panel -> (barre du titre, titre)
+# ===========================
+
+def compact_rows(panel, tickers):
+    """
+    rows[k, j] = ligne du panel de la k-ième barre de tickers[j] (-1 = bourrage).
+    Retourne (rows int64 (n_max, n_tickers), counts int64 (n_tickers,)).
+    """
+    counts = np.array([panel.bar_count(t) for t in tickers], dtype=np.int64)
+    n_max = int(counts.max()) if len(counts) else 0
+    rows = np.full((n_max, len(tickers)), -1, dtype=np.int64)
+
+    for j, t in enumerate(tickers):
+        r = panel.ticker_rows(t)
+        rows[:counts[j], j] = np.arange(r.start, r.stop) if isinstance(r, slice) else r
+
+    return rows, counts
+
+
+def take_compact(values, rows, cols=None):
+    """values (n_dates[, n_tickers]) -> matrice compacte (NaN sur le bourrage)."""
+    present = rows >= 0
+    safe = np.where(present, rows, 0)
+    if values.ndim == 1:
+        out = values[safe]
+    else:
+        out = values[safe, np.broadcast_to(cols, rows.shape)]
+    return np.where(present, out, np.nan)
+
+
+# ===========================
+# Indicateurs alpha4
+# ===========================
+
+def v4_indicator_params(cfg):
+    """
+    Paramètres dont dépend chaque indicateur de base (clé du cache) ;
+    les seuils et pondérations de stratégie n'y figurent pas.
+    """
+    rs = ('RS_LOOKBACK', indicators.RS_LOOKBACK)
+    return {
+        'rs_line': (rs,),
+        'rs_sma': (rs, ('RS_SMA_P', int(cfg.get('RS_SMA_P', 20)))),
+        'rsi': (('p', 14),),
+        'vratio': (('p', 20),),
+        'mm20': (('p', 20),),
+        'dist_m20': (('p', 20),),
+        'sqz_flag': (('p', 20),),
+        'struct_code': (('PIVOT_W', cfg['PIVOT_W']), ('STRUCT_LAST_PIVOTS', cfg['STRUCT_LAST_PIVOTS'])),
+        'price_sma': (('PRICE_SMA_P', int(cfg.get('PRICE_SMA_P', 200))),),
+        'atr_vec': (('ATR_P', cfg['ATR_P']),),
+    }
+
+
+# indicateurs qui dépendent aussi de l'indice (empreinte de l'indice dans la clé)
+_V4_INDEX_DEPENDENT = ('rs_line', 'rs_sma')
+
+
+def v4_base_matrices(high, low, close, volume, rs_line, counts, cfg, names=None, need=None):
+    """
+    Indicateurs de base (indépendants des seuils de stratégie) sur matrices
+    compactes. names limite le calcul à une partie des indicateurs
+    (None = tous) ; rs_line n'est lu que si 'rs_line' ou 'rs_sma' est demandé.
+    need (bool, forme de close) : struct_code évalué à ces barres seulement.
+    """
+    names = set(v4_indicator_params(cfg) if names is None else names)
+    out = {}
+
+    close_f = pd.DataFrame(close, copy=False)
+
+    if 'rs_line' in names:
+        out['rs_line'] = rs_line
+    if 'rs_sma' in names:
+        rs_sma_p = int(cfg.get('RS_SMA_P', 20))
+        out['rs_sma'] = pd.DataFrame(rs_line, copy=False).rolling(window=rs_sma_p).mean().to_numpy()
+
+    if 'rsi' in names:
+        out['rsi'] = indicators.rsi(close, p=14)
+    if 'vratio' in names:
+        volume_f = pd.DataFrame(volume, copy=False)
+        out['vratio'] = (volume_f / volume_f.rolling(20, min_periods=20).mean()).fillna(0.0).to_numpy()
+
+    if 'mm20' in names or 'dist_m20' in names:
+        mm20_f = close_f.rolling(20, min_periods=20).mean()
+        out['mm20'] = mm20_f.to_numpy()
+        out['dist_m20'] = ((close_f - mm20_f).abs() / mm20_f).fillna(1.0).to_numpy()
+
+    if 'sqz_flag' in names:
+        out['sqz_flag'] = indicators.squeeze_flag(high, low, close)
+
+    if 'struct_code' in names:
+        present = np.arange(close.shape[0])[:, None] < counts[None, :]
+        if need is None:
+            out['struct_code'] = indicators.structure_codes(
+                high, low, w=cfg['PIVOT_W'], last_pivots=cfg['STRUCT_LAST_PIVOTS'], valid=present,
+                backend=cfg.get('ENGINE_BACKEND')
+            )
+        else:
+            out['struct_code'] = indicators.structure_codes_at(
+                high, low, need, w=cfg['PIVOT_W'], last_pivots=cfg['STRUCT_LAST_PIVOTS'], valid=present,
+                backend=cfg.get('ENGINE_BACKEND')
+            )
+
+    if 'price_sma' in names:
+        price_sma_p = int(cfg.get('PRICE_SMA_P', 200))
+        out['price_sma'] = close_f.rolling(price_sma_p, min_periods=price_sma_p).mean().to_numpy()
+
+    # --- ATR (décalé d'une barre) ---
+    if 'atr_vec' in names:
+        tr = indicators.true_range(high, low, close)
+        out['atr_vec'] = (
+            pd.DataFrame(tr, copy=False)
+            .rolling(cfg['ATR_P'], min_periods=cfg['ATR_P']).mean()
+            .shift(1).fillna(0.0).to_numpy()
+        )
+
+    return out
+
+
+def _v4_rs_gate(rs_line, rs_momentum_ok, cfg):
+    # barres où le score n'est pas forcé à 0
+    if cfg.get('FORCE_RS_POSITIVE', True):
+        return (rs_line > 0) & rs_momentum_ok
+    return rs_momentum_ok
+
+
+def v4_combine(base, close, idx_close, idx_sma, idx_slope, cfg):
+    """
+    Filtres, composantes du score et score à partir des indicateurs de base
+    (opérations élément par élément : même résultat en 1D ou en 2D).
+    Sortie : dict nom -> tableau (mêmes formules et même ordre d'opérations
+    que la version ticker par ticker de _v4_run_ticker).
+    """
+    rs_line = base['rs_line']
+    rs_sma = base['rs_sma']
+    rsi = base['rsi']
+    vratio = base['vratio']
+    mm20 = base['mm20']
+    dist_m20 = base['dist_m20']
+    sqz_flag = base['sqz_flag']
+    struct_code = base['struct_code']
+    price_sma = base['price_sma']
+
+    struct_ok = struct_code == indicators.STRUCT_HH_HL
+
+    # --- Filtre prix vs SMA long terme ---
+    if cfg.get('USE_PRICE_SMA_FILTER', False):
+        with np.errstate(invalid='ignore'):
+            price_filter_ok = close >= price_sma
+    else:
+        price_filter_ok = np.ones(close.shape, dtype=bool)
+
+    # --- RS momentum ---
+    if cfg.get('USE_RS_SMA_FILTER', False):
+        with np.errstate(invalid='ignore'):
+            rs_momentum_ok = rs_line > rs_sma
+    else:
+        rs_momentum_ok = np.ones(close.shape, dtype=bool)
+
+    # --- Composantes du score ---
+    c_struct = np.where(struct_ok, cfg['W_STRUCT'], 0)
+    c_sqz = np.where(sqz_flag, cfg['W_SQZ'], 0)
+    c_vol = np.where(vratio > 1.5, cfg['W_VOL'], np.where(vratio > 1.1, cfg['W_VOL'] / 2, 0))
+    with np.errstate(invalid='ignore'):
+        c_rsi = np.where((rsi >= 50) & (rsi <= 70), cfg['W_RSI'], 0)
+        c_mm20 = np.where(
+            dist_m20 <= 0.01,
+            np.where(close >= mm20, cfg['W_DIST_M20'], cfg.get('PENALTY_MM20', -10)),
+            0
+        )
+
+    s_val = np.zeros(close.shape, dtype=float)
+    for comp in (c_struct, c_sqz, c_vol, c_rsi, c_mm20):
+        s_val += comp
+
+    with np.errstate(invalid='ignore'):
+        score = np.where(_v4_rs_gate(rs_line, rs_momentum_ok, cfg), s_val, 0).astype(float)
+
+    # --- Filtre marché ---
+    if cfg['MKT_FILTER']:
+        with np.errstate(invalid='ignore'):
+            mkt_ok = idx_close > idx_sma
+    else:
+        mkt_ok = np.ones(close.shape, dtype=bool)
+
+    return {
+        'c_struct': c_struct, 'c_sqz': c_sqz, 'c_vol': c_vol, 'c_rsi': c_rsi, 'c_mm20': c_mm20,
+        'score': score,
+        'mkt_ok': mkt_ok,
+        'price_filter_ok': price_filter_ok,
+        'rs_momentum_ok': rs_momentum_ok,
+        'rs_line': rs_line,
+        'rs_sma': rs_sma,
+        'rsi': rsi,
+        'vratio': vratio,
+        'dist_m20': dist_m20,
+        'sqz_flag': sqz_flag,
+        'struct_code': struct_code,
+        'struct_ok': struct_ok,
+        'price_sma': price_sma,
+        'atr_vec': base['atr_vec'],
+        'idx_close': idx_close,
+        'idx_sma': idx_sma,
+        'idx_slope': idx_slope,
+    }
+
+
+# ===========================
+# Élagage par borne du score
+# ===========================
+
+def v4_first_entry_bar(cfg):
+    """Première barre où une entrée est examinée (historique des SMA)."""
+    return max(
+        cfg['SMA_P'],
+        cfg.get('PRICE_SMA_P', 200) if cfg.get('USE_PRICE_SMA_FILTER', False) else 0
+    )
+
+
+def v4_score_bounds(cfg):
+    """Contribution maximale de chaque composante du score (0 si elle ne peut que retirer des points)."""
+    return {
+        'c_struct': max(cfg['W_STRUCT'], 0),
+        'c_sqz': max(cfg['W_SQZ'], 0),
+        'c_vol': max(cfg['W_VOL'], cfg['W_VOL'] / 2, 0),
+        'c_rsi': max(cfg['W_RSI'], 0),
+        'c_mm20': max(cfg['W_DIST_M20'], cfg.get('PENALTY_MM20', -10), 0),
+    }
+
+
+def v4_required_components(cfg):
+    """Composantes sans lesquelles MIN_SCORE est hors d'atteinte (ex. à 86 : toutes sauf c_sqz)."""
+    bounds = v4_score_bounds(cfg)
+    total = sum(bounds.values())
+    return tuple(name for name, b in bounds.items() if total - b < cfg['MIN_SCORE'])
+
+
+def v4_pruning_enabled(cfg):
+    """
+    Élagage utile seulement si la structure est indispensable au seuil :
+    les barres restantes sont alors rares. Features publiées (feature
+    store) ou cache d'indicateurs actif : struct_code complet, calculé une
+    fois et mis en cache (un run qui ne change que des seuils saute alors
+    toute la phase d'indicateurs, structure comprise).
+    """
+    return (
+        bool(cfg.get('SCORE_PRUNING', False))
+        and not cfg.get('FEATURE_STORE', False)
+        and not _V4BaseCache.cache_enabled(cfg)
+        and 'c_struct' in v4_required_components(cfg)
+    )
+
+
+# indicateurs lus par v4_struct_need
+_V4_NEED_INPUTS = ('rs_line', 'rs_sma', 'rsi', 'vratio', 'mm20', 'dist_m20', 'sqz_flag', 'price_sma')
+
+
+def v4_struct_need(base, close, idx_close, idx_sma, cfg):
+    """
+    Barres où struct_code peut intervenir : entrée examinée, filtres marché
+    et prix passés, et score hors structure + borne de c_struct >= MIN_SCORE
+    (score 0 si la porte RS est fermée). base : indicateurs sauf struct_code.
+    Borne supérieure (marge d'arrondi incluse) : les entrées restent exactes.
+    """
+    probe = v4_combine(
+        dict({name: base[name] for name in _V4_NEED_INPUTS}, struct_code=np.zeros(close.shape, dtype=np.int8), atr_vec=None),
+        close, idx_close, idx_sma, None, cfg
+    )
+    with np.errstate(invalid='ignore'):
+        gate = _v4_rs_gate(base['rs_line'], probe['rs_momentum_ok'], cfg)
+    bound = probe['score'] + np.where(gate, v4_score_bounds(cfg)['c_struct'], 0)
+
+    min_score = cfg['MIN_SCORE']
+    need = probe['mkt_ok'] & probe['price_filter_ok'] & (bound >= min_score - 1e-9 * max(1.0, abs(min_score)))
+    need[:v4_first_entry_bar(cfg)] = False
+    return need
+
+
+def v4_feature_matrices(high, low, close, volume, rs_line, idx_close, idx_sma, idx_slope, counts, cfg):
+    """
+    Entrées : matrices compactes (n_bars, n_tickers) ; idx_* déjà alignés sur
+    les dates de chaque titre ; counts = nombre de barres de chaque titre.
+    """
+    base = v4_base_matrices(high, low, close, volume, rs_line, counts, cfg)
+    return v4_combine(base, close, idx_close, idx_sma, idx_slope, cfg)
+
+
+# ===========================
+# Indice de référence (features partagées)
+# ===========================
+
+INDEX_FEATURE_CACHE = MemoCache(max_bytes=64 * 1024 * 1024, ttl_s=None, name='index_features')
+
+
+class IndexFeatures:
+    """
+    Close / SMA / pente d'un indice de référence pour un SMA_P, calculés une
+    fois (index_features) et partagés par tous les tickers qui s'y réfèrent.
+    on_axis aligne ces séries sur l'axe de dates d'un panel (seul le dernier
+    axe est mémorisé : la taille reste bornée dans un worker chaud qui voit
+    passer un nouvel axe chaque jour) : chaque lecture devient un simple
+    accès par ligne.
+    """
+
+    __slots__ = ('ticker', 'sma_p', 'dates', 'close', 'sma', 'slope', 'fingerprint', '_axis')
+
+    def __init__(self, idx_close, sma_p, ticker=None):
+        idx_sma = idx_close.rolling(sma_p, min_periods=sma_p).mean()
+        idx_slope = ((idx_sma - idx_sma.shift(4)) / idx_sma.shift(4)).fillna(0)
+
+        self.ticker = ticker
+        self.sma_p = int(sma_p)
+        self.dates = idx_close.index.to_numpy(dtype='datetime64[ns]')
+        self.close = idx_close.to_numpy(dtype=float)
+        self.sma = idx_sma.to_numpy(dtype=float)
+        self.slope = idx_slope.to_numpy(dtype=float)
+        self.fingerprint = indicator_cache.fingerprint(self.dates, self.close)
+        self._axis = None       # (empreinte de l'axe, séries alignées)
+
+    @property
+    def nbytes(self):
+        axis = self._axis
+        aligned = sum(a.nbytes for a in axis[1].values()) if axis is not None else 0
+        return int(self.dates.nbytes + self.close.nbytes + self.sma.nbytes + self.slope.nbytes + aligned)
+
+    def on_dates(self, dates):
+        """{'idx_close', 'idx_sma', 'idx_slope'} alignés sur `dates` (égalité exacte, NaN sinon, comme reindex)."""
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        pos = np.searchsorted(self.dates, dates)
+        safe = np.minimum(pos, max(len(self.dates) - 1, 0))
+        hit = (pos < len(self.dates)) & (self.dates[safe] == dates) if len(self.dates) else np.zeros(len(dates), dtype=bool)
+
+        def _take(values):
+            return np.where(hit, values[safe], np.nan) if len(values) else np.full(len(dates), np.nan)
+
+        return {'idx_close': _take(self.close), 'idx_sma': _take(self.sma), 'idx_slope': _take(self.slope)}
+
+    def on_axis(self, axis_dates):
+        """Comme on_dates, mémorisé pour le dernier axe global de panel vu."""
+        key = indicator_cache.fingerprint(axis_dates)
+        axis = self._axis
+        if axis is not None and axis[0] == key:
+            return axis[1]
+        out = self.on_dates(axis_dates)
+        self._axis = (key, out)     # une seule affectation : lecture sûre entre threads
+        return out
+
+
+def index_features(idx_close, sma_p, ticker=None):
+    """IndexFeatures en cache par (indice, SMA_P, contenu de la série)."""
+    key = (ticker, int(sma_p), indicator_cache.series_fingerprint(idx_close))
+    return INDEX_FEATURE_CACHE.get_or_load(key, lambda: IndexFeatures(idx_close, sma_p, ticker=ticker))
+
+
+# ===========================
+# Cache des indicateurs de base
+# ===========================
+
+class _V4BaseCache:
+    """Clés de cache des indicateurs de base d'un run (mêmes paramètres pour tous les tickers)."""
+
+    def __init__(self, cfg, bench):
+        self.enabled = self.cache_enabled(cfg)
+        self.params = v4_indicator_params(cfg)
+        self.idx_fp = bench.fingerprint
+
+    @staticmethod
+    def cache_enabled(cfg):
+        return bool(cfg.get('INDICATOR_CACHE', True)) and indicator_cache.INDICATOR_CACHE_CFG['ENABLED']
+
+    def _key(self, ticker, bars_fp, name):
+        params = self.params[name]
+        if name in _V4_INDEX_DEPENDENT:
+            params = params + (('IDX', self.idx_fp),)
+        return (ticker, bars_fp, name, params)
+
+    def lookup(self, bars):
+        """(bars_fp, {nom: tableau} trouvés en cache)."""
+        if not self.enabled:
+            return None, {}
+        bars_fp = indicator_cache.bars_fingerprint(bars)
+        found = {}
+        for name in self.params:
+            arr = indicator_cache.get(self._key(bars.ticker, bars_fp, name))
+            if arr is not None:
+                found[name] = arr
+        return bars_fp, found
+
+    def store(self, ticker, bars_fp, values):
+        if not self.enabled:
+            return values
+        return {
+            name: indicator_cache.put(self._key(ticker, bars_fp, name), arr)
+            for name, arr in values.items()
+        }
+
+
+def v4_ticker_features(bars, bench, cfg):
+    """
+    Même moteur pour un seul ticker (matrices à une colonne), vues 1D en sortie.
+    bench : IndexFeatures de l'indice de référence du ticker.
+    """
+    def col(x):
+        return np.asarray(x, dtype=float).reshape(-1, 1)
+
+    cache = _V4BaseCache(cfg, bench)
+    bars_fp, base = cache.lookup(bars)
+    missing = [name for name in cache.params if name not in base]
+    idx = bench.on_dates(bars.dates)
+
+    # struct_code élagué : calculé après les autres indicateurs, jamais mis en cache
+    pruned = 'struct_code' in missing and v4_pruning_enabled(cfg)
+    if pruned:
+        missing.remove('struct_code')
+
+    def _compute(names, need=None):
+        rs_line = None
+        if 'rs_line' in names or 'rs_sma' in names:
+            rs_line = base.get('rs_line')
+            if rs_line is None:
+                rs_line = indicators.rs_line(bars.dates, bars.close, bench.dates, bench.close)
+            rs_line = col(rs_line)
+        computed = v4_base_matrices(
+            col(bars.high), col(bars.low), col(bars.close), col(bars.volume), rs_line,
+            np.array([len(bars)], dtype=np.int64),
+            cfg,
+            names=names,
+            need=need
+        )
+        return {k: v[:, 0] for k, v in computed.items() if k in names}
+
+    if missing:
+        base.update(cache.store(bars.ticker, bars_fp, _compute(missing)))
+    if pruned:
+        need = v4_struct_need(base, bars.close, idx['idx_close'], idx['idx_sma'], cfg)
+        base.update(_compute(['struct_code'], need=need.reshape(-1, 1)))
+
+    return v4_combine(base, bars.close, idx['idx_close'], idx['idx_sma'], idx['idx_slope'], cfg)
+
+
+def iter_v4_panel_features(panel, tickers, cfg, benches, block=FEATURE_BLOCK_TICKERS):
+    """
+    Calcule les features par blocs de `block` tickers et produit
+    (ticker, Bars, features 1D) dans l'ordre de `tickers`.
+    benches : IndexFeatures commun, ou dict ticker -> IndexFeatures (indice
+    de référence propre à chaque titre ; chaque indice n'est aligné qu'une fois).
+    Mémoire bornée par un bloc de matrices. Les indicateurs de base déjà en
+    cache ne sont pas recalculés : un bloc entièrement en cache saute la
+    phase d'indicateurs, seuls filtres et score sont recombinés.
+    """
+    tickers = list(tickers)
+    if not tickers:
+        return
+
+    bench_of = benches.get if isinstance(benches, dict) else (lambda t: benches)
+    caches = {}
+
+    for b in range(0, len(tickers), max(1, int(block))):
+        chunk = tickers[b:b + block]
+        chunk_benches = [bench_of(t) for t in chunk]
+        for bench in chunk_benches:
+            if id(bench) not in caches:
+                caches[id(bench)] = _V4BaseCache(cfg, bench)
+
+        bars_list = [panel.ticker_bars(t) for t in chunk]
+        cached = [caches[id(bench)].lookup(bars) for bench, bars in zip(chunk_benches, bars_list)]
+        missing = sorted({name for _, found in cached for name in v4_indicator_params(cfg) if name not in found})
+
+        # struct_code élagué : calculé après les autres indicateurs, jamais mis en cache
+        pruned = 'struct_code' in missing and v4_pruning_enabled(cfg)
+        if pruned:
+            missing.remove('struct_code')
+
+        if missing or pruned:
+            cols = np.array([panel.col(t) for t in chunk], dtype=np.int64)
+            rows, counts = compact_rows(panel, chunk)
+            high = take_compact(panel.fields['High'], rows, cols)
+            low = take_compact(panel.fields['Low'], rows, cols)
+            close = take_compact(panel.fields['Close'], rows, cols)
+
+        if missing:
+            rs_compact = None
+            if 'rs_line' in missing or 'rs_sma' in missing:
+                # une passe 2D par indice de référence présent dans le bloc
+                rs_panel = np.zeros((len(panel.dates), len(chunk)), dtype=float)
+                groups = {}
+                for j, bench in enumerate(chunk_benches):
+                    groups.setdefault(id(bench), (bench, []))[1].append(j)
+                for bench, locs in groups.values():
+                    rs_panel[:, locs] = indicators.rs_line(
+                        panel.dates,
+                        panel.fields['Close'][:, cols[locs]],
+                        bench.dates,
+                        bench.close,
+                        valid=panel.valid[:, cols[locs]]
+                    )
+                rs_compact = take_compact(rs_panel, rows, np.arange(len(chunk)))
+
+            computed = v4_base_matrices(
+                high,
+                low,
+                close,
+                take_compact(panel.fields['Volume'], rows, cols),
+                rs_compact,
+                counts,
+                cfg,
+                names=missing
+            )
+
+            for j, (bars_fp, found) in enumerate(cached):
+                n = len(bars_list[j])
+                fresh = {k: v[:n, j] for k, v in computed.items() if k not in found}
+                found.update(caches[id(chunk_benches[j])].store(chunk[j], bars_fp, fresh))
+
+        if pruned:
+            # bornes du score sur les indicateurs bon marché (une passe 2D) -> barres où la structure compte
+            todo = [j for j, (_, found) in enumerate(cached) if 'struct_code' not in found]
+            probe = {}
+            for name in _V4_NEED_INPUTS:
+                if missing and name in computed:
+                    probe[name] = computed[name]
+                else:
+                    probe[name] = np.full(high.shape, np.nan)
+                    for j in todo:
+                        probe[name][:counts[j], j] = cached[j][1][name]
+
+            idx_close = np.full(high.shape, np.nan)
+            idx_sma = np.full(high.shape, np.nan)
+            for j in todo:
+                rows_t = panel.ticker_rows(chunk[j])
+                idx = chunk_benches[j].on_axis(panel.dates)
+                idx_close[:counts[j], j] = idx['idx_close'][rows_t]
+                idx_sma[:counts[j], j] = idx['idx_sma'][rows_t]
+
+            need = v4_struct_need(probe, close, idx_close, idx_sma, cfg)
+            need &= np.isin(np.arange(len(chunk)), todo)[None, :]
+
+            codes = v4_base_matrices(high, low, close, None, None, counts, cfg, names=['struct_code'], need=need)
+            for j, (_, found) in enumerate(cached):
+                if 'struct_code' not in found:
+                    found['struct_code'] = codes['struct_code'][:counts[j], j]
+
+        for j, t in enumerate(chunk):
+            bars = bars_list[j]
+            rows_t = panel.ticker_rows(t)
+            idx = chunk_benches[j].on_axis(panel.dates)
+            yield t, bars, v4_combine(
+                cached[j][1],
+                bars.close,
+                idx['idx_close'][rows_t],
+                idx['idx_sma'][rows_t],
+                idx['idx_slope'][rows_t],
+                cfg
+            )
+
+# ==== END feature_engine.py
@@ -0,0 +1,273 @@
+# ==== START feature_store.py
+"""
+Store local des features alpha4 (composantes du score), un Parquet par ticker :
+
+    <DIR>/<DB_SET>.<TBL>/<config_hash>/<snapshot>/<ticker>.parquet
+    <DIR>/<DB_SET>.<TBL>/<config_hash>/<snapshot>/_manifest.json
+
+  - config_hash : paramètres dont dépendent les features (périodes,
+                  filtres, pondérations) ; un seuil de sortie n'en fait pas partie
+  - snapshot    : version des données (dernière date + empreinte du panel,
+                  ou des statistiques du store en streaming)
+
+Chaque run écrit dans un répertoire de staging puis publie ses fichiers
+d'un coup (os.replace) et fusionne le manifest sous verrou : le snapshot
+est fixé par le coordinateur (FEATURE_SNAPSHOT dans la cfg des shards et
+des lots), plusieurs shards du même run alimentent donc le même snapshot. Les KEEP_SNAPSHOTS
+derniers snapshots sont gardés par config.
+
+read_features lit avec projection de colonnes et élagage par dates
+(row groups d'environ un an de barres).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import file_utils
+import indicator_cache
+import market_store
+
+FEATURE_STORE_CFG = {
+    'DIR': os.environ.get(
+        'STOCKS_FEATURE_STORE_DIR',
+        os.path.join(market_store.STORE_CFG['STORE_DIR'], '_features')
+    ),
+    'KEEP_SNAPSHOTS': int(os.environ.get('STOCKS_FEATURE_KEEP_SNAPSHOTS', 5)),
+    'ROW_GROUP_BARS': 256,
+}
+
+FEATURE_FORMAT_VERSION = 1
+
+FEATURE_COLUMNS = (
+    'rs_line', 'rs_sma', 'rsi', 'vratio', 'dist_m20', 'sqz_flag',
+    'struct_code', 'struct_ok', 'price_sma', 'atr_vec',
+    'price_filter_ok', 'rs_momentum_ok', 'mkt_ok',
+    'c_struct', 'c_sqz', 'c_vol', 'c_rsi', 'c_mm20', 'score',
+)
+
+# Paramètres alpha4 dont dépendent les features (clé de config_hash)
+FEATURE_CONFIG_KEYS = (
+    'IDX', 'BENCHMARK_MAP', 'SMA_P', 'MKT_FILTER',
+    'PIVOT_W', 'STRUCT_LAST_PIVOTS', 'ATR_P',
+    'USE_PRICE_SMA_FILTER', 'PRICE_SMA_P', 'USE_RS_SMA_FILTER', 'RS_SMA_P', 'FORCE_RS_POSITIVE',
+    'W_STRUCT', 'W_VOL', 'W_DIST_M20', 'W_RSI', 'W_SQZ', 'PENALTY_MM20',
+)
+
+_MANIFEST = '_manifest.json'
+
+
+# ===========================
+# Versions
+# ===========================
+
+def config_hash(cfg):
+    params = {k: cfg.get(k) for k in FEATURE_CONFIG_KEYS}
+    params['_format'] = FEATURE_FORMAT_VERSION
+    blob = json.dumps(params, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(blob, digest_size=6).hexdigest()
+
+
+def _snapshot_tag(last_date, digest):
+    day = pd.Timestamp(last_date).strftime('%Y%m%d') if last_date is not None else 'empty'
+    return f"{day}-{digest[:12]}"
+
+
+def panel_snapshot(panel):
+    """Tag de version d'un MarketPanel : identique pour tous les shards qui chargent les mêmes données."""
+    parts = [panel.dates, np.array(panel.tickers, dtype=object).astype(str), panel.valid]
+    parts += [panel.fields[f] for f in sorted(panel.fields)]
+    last = panel.dates[-1] if len(panel.dates) else None
+    return _snapshot_tag(last, indicator_cache.fingerprint(*parts))
+
+
+def history_snapshot(stats):
+    """Tag de version en streaming, depuis market_store.history_stats de tout l'univers requêté."""
+    blob = json.dumps(stats, sort_keys=True).encode('utf-8')
+    last = max((m['last_date'] for m in stats.values()), default=None)
+    return _snapshot_tag(last, hashlib.blake2b(blob, digest_size=16).hexdigest())
+
+
+# ===========================
+# Chemins
+# ===========================
+
+def _table_dir(dataset, table, store_dir=None):
+    return os.path.join(store_dir or FEATURE_STORE_CFG['DIR'], f"{dataset}.{table}")
+
+
+def _ticker_file(ticker):
+    return quote(str(ticker), safe='') + '.parquet'
+
+
+def _read_manifest(sdir):
+    path = os.path.join(sdir, _MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ===========================
+# Écriture
+# ===========================
+
+class FeatureWriter:
+    """
+    Écrit les features d'un run ticker par ticker (add), publie à close().
+    snapshot : tag de tout le run (panel_snapshot / history_snapshot), jamais
+    déduit des seuls tickers écrits par ce writer (shard ou lot).
+    """
+
+    def __init__(self, dataset, table, cfg, snapshot, store_dir=None):
+        if not snapshot:
+            raise ValueError("FeatureWriter : snapshot requis (version des données du run)")
+        self.cfg_hash = config_hash(cfg)
+        self.cfg_params = {k: cfg.get(k) for k in FEATURE_CONFIG_KEYS}
+        self.snapshot = snapshot
+        self.cdir = os.path.join(_table_dir(dataset, table, store_dir), self.cfg_hash)
+        self.staging = os.path.join(self.cdir, f".staging-{os.getpid()}-{threading.get_ident()}")
+        self.tickers = {}
+        os.makedirs(self.staging, exist_ok=True)
+
+    def add(self, ticker, bars, features):
+        data = {'Date': pd.DatetimeIndex(bars.dates)}
+        for c in FEATURE_COLUMNS:
+            data[c] = np.asarray(features[c])
+        frame = pd.DataFrame(data, copy=False)
+
+        path = os.path.join(self.staging, _ticker_file(ticker))
+        frame.to_parquet(path, index=False, row_group_size=FEATURE_STORE_CFG['ROW_GROUP_BARS'])
+
+        first = pd.Timestamp(bars.dates[0]) if len(bars) else None
+        last = pd.Timestamp(bars.dates[-1]) if len(bars) else None
+        self.tickers[str(ticker)] = {
+            'rows': int(len(bars)),
+            'first_date': first.strftime('%Y-%m-%d') if first is not None else None,
+            'last_date': last.strftime('%Y-%m-%d') if last is not None else None,
+            'bars_fingerprint': indicator_cache.bars_fingerprint(bars),
+        }
+
+    def close(self):
+        """Publie les fichiers dans le snapshot ; retourne son manifest."""
+        sdir = os.path.join(self.cdir, self.snapshot)
+        os.makedirs(sdir, exist_ok=True)
+
+        with file_utils.FileLock(os.path.join(self.cdir, '.lock')):
+            for t in self.tickers:
+                os.replace(os.path.join(self.staging, _ticker_file(t)), os.path.join(sdir, _ticker_file(t)))
+
+            manifest = _read_manifest(sdir) or {
+                'format_version': FEATURE_FORMAT_VERSION,
+                'snapshot': self.snapshot,
+                'config_hash': self.cfg_hash,
+                'config': self.cfg_params,
+                'created_at': time.time(),
+                'columns': list(FEATURE_COLUMNS),
+                'tickers': {},
+            }
+            manifest['tickers'].update(self.tickers)
+            manifest['updated_at'] = time.time()
+
+            def _dump(tmp):
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, indent=1, sort_keys=True, default=str)
+
+            file_utils.write_atomic(os.path.join(sdir, _MANIFEST), _dump)
+            self._prune_old_snapshots()
+
+        shutil.rmtree(self.staging, ignore_errors=True)
+        return manifest
+
+    def abort(self):
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def _prune_old_snapshots(self):
+        keep = FEATURE_STORE_CFG['KEEP_SNAPSHOTS']
+        snaps = _snapshots_in(self.cdir)
+        for m in snaps[:-keep] if keep > 0 else []:
+            if m['snapshot'] != self.snapshot:
+                shutil.rmtree(os.path.join(self.cdir, m['snapshot']), ignore_errors=True)
+
+
+# ===========================
+# Lecture
+# ===========================
+
+def _snapshots_in(cdir):
+    if not os.path.isdir(cdir):
+        return []
+    out = []
+    for name in os.listdir(cdir):
+        if name.startswith('.'):
+            continue
+        m = _read_manifest(os.path.join(cdir, name))
+        if m is not None:
+            out.append(m)
+    return sorted(out, key=lambda m: m.get('created_at', 0.0))
+
+
+def list_snapshots(dataset, table, config=None, store_dir=None):
+    """
+    Manifests des snapshots publiés (du plus ancien au plus récent), sans la
+    liste détaillée des tickers. config : dict alpha4, config_hash ou None (toutes).
+    """
+    tdir = _table_dir(dataset, table, store_dir)
+    if config is None:
+        hashes = sorted(h for h in os.listdir(tdir) if not h.startswith('.')) if os.path.isdir(tdir) else []
+    else:
+        hashes = [config if isinstance(config, str) else config_hash(config)]
+
+    out = []
+    for h in hashes:
+        for m in _snapshots_in(os.path.join(tdir, h)):
+            out.append(dict({k: v for k, v in m.items() if k != 'tickers'}, n_tickers=len(m['tickers'])))
+    return sorted(out, key=lambda m: m.get('created_at', 0.0))
+
+
+def read_features(dataset, table, tickers=None, columns=None, start_date=None, end_date=None,
+                  snapshot=None, config=None, store_dir=None) -> pd.DataFrame:
+    """
+    Features en format long (Date, Ticker, colonnes), trié par Ticker puis Date.
+    snapshot=None : dernier snapshot publié (pour config, ou toutes configs).
+    columns=None : toutes les colonnes ; start_date / end_date inclus.
+    """
+    snaps = list_snapshots(dataset, table, config=config, store_dir=store_dir)
+    if snapshot is not None:
+        snaps = [m for m in snaps if m['snapshot'] == snapshot]
+    if not snaps:
+        raise FileNotFoundError(f"Aucun snapshot de features pour {dataset}.{table} (config={config}, snapshot={snapshot})")
+
+    meta = snaps[-1]
+    sdir = os.path.join(_table_dir(dataset, table, store_dir), meta['config_hash'], meta['snapshot'])
+    manifest = _read_manifest(sdir)
+
+    names = sorted(manifest['tickers']) if tickers is None else [t for t in tickers if t in manifest['tickers']]
+    cols = list(FEATURE_COLUMNS) if columns is None else [c for c in columns if c in FEATURE_COLUMNS]
+
+    filters = []
+    if start_date is not None:
+        filters.append(('Date', '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(('Date', '<=', pd.Timestamp(end_date)))
+
+    frames = []
+    for t in names:
+        d = pd.read_parquet(os.path.join(sdir, _ticker_file(t)), columns=['Date'] + cols, filters=filters or None)
+        if len(d):
+            d.insert(1, 'Ticker', t)
+            frames.append(d)
+
+    if not frames:
+        empty = pd.DataFrame(columns=['Date', 'Ticker'] + cols)
+        return empty.astype({'Date': 'datetime64[ns]'})
+    return pd.concat(frames, ignore_index=True)
+
+# ==== END feature_store.py
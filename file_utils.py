@@ -0,0 +1,53 @@
+# ==== START file_utils.py
+"""
+Écritures de fichiers partagées par les stores (market_store, feature_store,
+indicator_cache) : remplacement atomique et verrou exclusif thread + fichier.
+
+Sans dépendance lourde : importable par les modules de calcul sans tirer
+BigQuery.
+"""
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - hors Linux
+    fcntl = None
+
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def write_atomic(path, write_fn):
+    """write_fn(tmp) écrit un fichier temporaire qui remplace ensuite path d'un seul coup."""
+    # nom temporaire par processus et par thread (gunicorn --threads)
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    write_fn(tmp)
+    os.replace(tmp, path)
+
+
+class FileLock:
+    """Verrou exclusif : thread (gunicorn --threads) + fichier (plusieurs workers)."""
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        with _LOCKS_GUARD:
+            self.thread_lock = _LOCKS.setdefault(lock_path, threading.Lock())
+        self._fh = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            self._fh = open(self.lock_path, 'a+')
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self.thread_lock.release()
+
+# ==== END file_utils.py
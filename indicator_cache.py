@@ -0,0 +1,218 @@
+# ==== START indicator_cache.py
+"""
+Cache des indicateurs par ticker (mémoire + disque optionnel).
+
+Clé : (ticker, empreinte du contenu des barres, nom de l'indicateur,
+paramètres de l'indicateur). Un appel qui ne change que des seuils de
+stratégie (MIN_SCORE, TP_*, BE_*, pondérations…) retrouve donc tous ses
+indicateurs et saute la phase de calcul ; une barre corrigée change
+l'empreinte et invalide naturellement les entrées du ticker.
+
+Deux niveaux :
+  - mémoire : MemoCache (LRU borné en octets, pas de TTL : la clé suffit)
+  - disque  : DISK_DIR (vide = désactivé), un .npy par entrée, écrit de
+              façon atomique ; partagé entre workers et redémarrages.
+              Élagué au plus toutes les DISK_PRUNE_INTERVAL_S : entrées non
+              lues depuis DISK_MAX_AGE_S, puis les plus anciennes jusqu'à
+              DISK_MAX_MB (chaque nouvelle barre change les empreintes, les
+              anciennes entrées ne servent plus)
+
+Les tableaux mis en cache sont en lecture seule : ne pas les modifier.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import file_utils
+from memo_cache import MemoCache
+
+INDICATOR_CACHE_CFG = {
+    'ENABLED': os.environ.get('STOCKS_INDICATOR_CACHE', '1') not in ('0', 'false', 'False', ''),
+    'MAX_MB': int(os.environ.get('STOCKS_INDICATOR_CACHE_MB', 256)),
+    'DISK_DIR': os.environ.get('STOCKS_INDICATOR_CACHE_DIR', ''),
+    'DISK_MAX_MB': int(os.environ.get('STOCKS_INDICATOR_CACHE_DISK_MB', 2048)),
+    'DISK_MAX_AGE_S': int(os.environ.get('STOCKS_INDICATOR_CACHE_DISK_AGE_S', 7 * 86400)),
+    'DISK_PRUNE_INTERVAL_S': 600,
+}
+
+_DISK_PRUNE = {'last': 0.0, 'removed': 0}
+_DISK_PRUNE_GUARD = threading.Lock()
+
+INDICATOR_CACHE = MemoCache(
+    max_bytes=INDICATOR_CACHE_CFG['MAX_MB'] * 1024 * 1024,
+    ttl_s=None,
+    name='indicators'
+)
+
+
+# ===========================
+# Empreintes
+# ===========================
+
+def fingerprint(*arrays):
+    """Empreinte (hex) du contenu d'un ou plusieurs tableaux numpy."""
+    h = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str(a.dtype).encode())
+        h.update(str(a.shape).encode())
+        h.update(a.view(np.uint8))
+    return h.hexdigest()
+
+
+def bars_fingerprint(bars):
+    return fingerprint(bars.dates, bars.high, bars.low, bars.close, bars.volume)
+
+
+def series_fingerprint(s):
+    return fingerprint(s.index.to_numpy(dtype='datetime64[ns]'), s.to_numpy(dtype=float))
+
+
+# ===========================
+# Accès
+# ===========================
+
+def _disk_path(key, disk_dir):
+    name = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(disk_dir, name[:2], name + '.npy')
+
+
+def _read_only(arr):
+    arr = np.asarray(arr).view()
+    arr.setflags(write=False)
+    return arr
+
+
+def get(key, disk_dir=None):
+    """Tableau en cache (mémoire puis disque) ou None."""
+    # hits / misses comptés sous le verrou du cache mémoire, une fois par
+    # appel (avec le niveau disque : après sa lecture)
+    disk_dir = INDICATOR_CACHE_CFG['DISK_DIR'] if disk_dir is None else disk_dir
+    arr = INDICATOR_CACHE.get(key, count=not disk_dir)
+    if not disk_dir:
+        return arr
+    if arr is not None:
+        INDICATOR_CACHE.count(hit=True)
+        return arr
+
+    path = _disk_path(key, disk_dir)
+    try:
+        arr = np.load(path, allow_pickle=False)
+    except (OSError, ValueError):
+        arr = None
+    INDICATOR_CACHE.count(hit=arr is not None)
+    if arr is None:
+        return None
+
+    try:
+        os.utime(path)      # âge = dernière lecture (élagage LRU)
+    except OSError:
+        pass
+    return INDICATOR_CACHE.put(key, _read_only(arr))
+
+
+def put(key, arr, disk_dir=None):
+    # copie : une vue garderait en vie toute la matrice du bloc
+    arr = _read_only(np.array(arr, copy=True))
+    INDICATOR_CACHE.put(key, arr)
+
+    disk_dir = INDICATOR_CACHE_CFG['DISK_DIR'] if disk_dir is None else disk_dir
+    if disk_dir:
+        path = _disk_path(key, disk_dir)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            def _save(tmp):
+                with open(tmp, 'wb') as f:
+                    np.save(f, arr, allow_pickle=False)
+
+            try:
+                file_utils.write_atomic(path, _save)
+            except OSError as e:
+                print(f"[indicator_cache] écriture disque impossible ({path}) : {e}")
+            _maybe_prune_disk(disk_dir)
+
+    return arr
+
+
+# ===========================
+# Élagage du niveau disque
+# ===========================
+
+def _maybe_prune_disk(disk_dir):
+    now = time.time()
+    with _DISK_PRUNE_GUARD:
+        if now - _DISK_PRUNE['last'] < INDICATOR_CACHE_CFG['DISK_PRUNE_INTERVAL_S']:
+            return
+        _DISK_PRUNE['last'] = now
+    prune_disk(disk_dir)
+
+
+def prune_disk(disk_dir=None, max_mb=None, max_age_s=None):
+    """
+    Supprime les entrées disque non lues depuis max_age_s (temporaires
+    abandonnés compris), puis les plus anciennes jusqu'à repasser sous
+    max_mb. Sans verrou : plusieurs workers peuvent élaguer en même temps.
+    Retourne le nombre de fichiers supprimés.
+    """
+    disk_dir = INDICATOR_CACHE_CFG['DISK_DIR'] if disk_dir is None else disk_dir
+    max_bytes = (INDICATOR_CACHE_CFG['DISK_MAX_MB'] if max_mb is None else max_mb) * 1024 * 1024
+    max_age_s = INDICATOR_CACHE_CFG['DISK_MAX_AGE_S'] if max_age_s is None else max_age_s
+    if not disk_dir or not os.path.isdir(disk_dir):
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for root, _, files in os.walk(disk_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime > max_age_s:
+                removed += _remove(path)
+            elif name.endswith('.npy'):
+                entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        removed += _remove(path)
+        total -= size
+
+    _DISK_PRUNE['removed'] += removed
+    return removed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+
+def clear(disk=False):
+    """Vide le niveau mémoire (et le niveau disque si disk=True)."""
+    INDICATOR_CACHE.invalidate()
+    disk_dir = INDICATOR_CACHE_CFG['DISK_DIR']
+    if disk and disk_dir and os.path.isdir(disk_dir):
+        shutil.rmtree(disk_dir, ignore_errors=True)
+
+
+def stats():
+    return dict(
+        INDICATOR_CACHE.stats(),
+        disk_dir=INDICATOR_CACHE_CFG['DISK_DIR'] or None,
+        disk_pruned_files=_DISK_PRUNE['removed']
+    )
+
+# ==== END indicator_cache.py
@@ -0,0 +1,414 @@
+# ==== START indicators.py
+"""
+Noyaux d'indicateurs (parité GAS) sur tableaux NumPy.
+
+Entrées supposées validées (Bars / MarketPanel) : float64, dates triées
+et uniques. Aucune coercition, aucun tri, aucune copie défensive ici.
+Les wrappers pandas de sigma.py (gas_*) et sigma2.py (v4_*) se contentent
+de valider leurs entrées puis d'appeler ces fonctions.
+"""
+
+import numpy as np
+import pandas as pd
+
+import kernels
+
+RS_LOOKBACK = 62
+
+
+def rs_line(s_dates, s_close, i_dates, i_close, lookback=RS_LOOKBACK, valid=None):
+    """
+    RS = (perf titre - perf indice) * 100 sur `lookback` barres.
+    Indice : dernier close <= date du titre, puis `lookback` barres plus tôt.
+    0 si historique insuffisant, valeur manquante ou base nulle.
+
+    s_close 1D : un titre (s_dates = ses dates).
+    s_close 2D : panel (n_dates, n_tickers) sur l'axe s_dates, `valid` = barres
+    présentes ; le décalage de `lookback` se compte en barres de chaque titre
+    (trous compris). Les cellules absentes valent 0.
+
+    Un seul searchsorted vectorisé pour tout l'axe des dates.
+    """
+    s_close = np.asarray(s_close, dtype=float)
+    i_close = np.asarray(i_close, dtype=float)
+    pos = np.searchsorted(i_dates, s_dates, side='right') - 1
+
+    if s_close.ndim == 2:
+        return _rs_line_panel(pos, s_close, i_close, lookback, valid)
+
+    out = np.zeros(len(s_close), dtype=float)
+    if len(s_close) <= lookback or len(i_close) <= lookback:
+        return out
+
+    out[lookback:] = _rs_values(
+        s_close[lookback:], s_close[:-lookback], pos[lookback:], i_close, lookback
+    )
+    return out
+
+
+def _rs_values(s_curr, s_prev, pos, i_close, lookback):
+    ok = pos >= lookback
+    p = np.where(ok, pos, lookback)
+    i_curr = i_close[p]
+    i_prev = i_close[p - lookback]
+
+    ok &= ~(np.isnan(s_curr) | np.isnan(s_prev) | np.isnan(i_curr) | np.isnan(i_prev))
+    ok &= (s_prev != 0) & (i_prev != 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stock_perf = (s_curr - s_prev) / s_prev
+        idx_perf = (i_curr - i_prev) / i_prev
+        return np.where(ok, (stock_perf - idx_perf) * 100.0, 0.0)
+
+
+def _rs_line_panel(pos, close, i_close, lookback, valid=None):
+    n_d, n_t = close.shape
+    out = np.zeros((n_d, n_t), dtype=float)
+    if len(i_close) <= lookback:
+        return out
+
+    if valid is None:
+        valid = np.ones((n_d, n_t), dtype=bool)
+
+    # barres présentes, colonne par colonne (ordre titre puis date)
+    cols, rows = np.nonzero(np.asarray(valid).T)
+    if not len(rows):
+        return out
+
+    k = np.arange(len(rows))
+    col_start = np.searchsorted(cols, cols, side='left')
+    has_prev = (k - col_start) >= lookback
+
+    cur = k[has_prev]
+    prev = cur - lookback
+
+    r_cur, c_cur = rows[cur], cols[cur]
+    out[r_cur, c_cur] = _rs_values(
+        close[r_cur, c_cur], close[rows[prev], cols[prev]], pos[r_cur], i_close, lookback
+    )
+    return out
+
+
+def _rolling_frame(x):
+    # 1D -> Series, 2D -> DataFrame (une colonne par titre, mêmes noyaux rolling)
+    x = np.asarray(x, dtype=float)
+    return pd.DataFrame(x, copy=False) if x.ndim == 2 else pd.Series(x, copy=False)
+
+
+def rsi(close, p=14):
+    """RSI façon GAS : sommes gains/pertes sur p barres ; pertes == 0 -> 100 ; sinon NaN -> 0."""
+    close = _rolling_frame(close)
+    diff = close.diff()
+    gains = diff.clip(lower=0).rolling(p, min_periods=p).sum().to_numpy()
+    losses = (-diff.clip(upper=0)).rolling(p, min_periods=p).sum().to_numpy()
+
+    out = np.zeros(close.shape, dtype=float)
+    zero_losses = losses == 0
+    normal = (~zero_losses) & ~np.isnan(losses)
+
+    out[zero_losses] = 100.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vals = 100.0 - (100.0 / (1.0 + (gains[normal] / losses[normal])))
+    out[normal] = np.where(np.isnan(vals), 0.0, vals)
+    return out
+
+
+PIVOT_H = 1
+PIVOT_L = -1
+
+
+def _strict_max_flags(x, w, gold=False):
+    """
+    True en i si x[i] domine strictement ses 2w voisins (axe 0), i dans [w, n-w).
+      gold=False (GAS)  : aucun voisin >= x[i]   (voisin NaN ignoré, centre NaN = pivot)
+      gold=True  (GOLD) : x[i] > chaque voisin   (tout NaN invalide le pivot)
+    Comparaisons vectorisées sur les 2w décalages de la fenêtre glissante.
+    """
+    n = x.shape[0]
+    flags = np.zeros(x.shape, dtype=bool)
+    if n < 2 * w + 1:
+        return flags
+
+    c = x[w:n - w]
+    ok = np.ones(c.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for d in range(-w, w + 1):
+            if d == 0:
+                continue
+            nb = x[w + d:n - w + d]
+            if gold:
+                ok &= c > nb
+            else:
+                ok &= ~(nb >= c)
+
+    flags[w:n - w] = ok
+    return flags
+
+
+def _pivot_flags(high, low, w, gold=False):
+    # low[j] <= low[i]  <=>  -low[j] >= -low[i] : même noyau que pour les hauts
+    return _strict_max_flags(high, w, gold), _strict_max_flags(-low, w, gold)
+
+
+def pivot_arrays(high, low, w=3, gold=False, valid=None):
+    """
+    Pivots stricts sous forme compacte, triés par barre (H avant L sur une même barre).
+
+    1D : retourne (index int64, type int8 PIVOT_H/PIVOT_L, value float64).
+    2D : panel (n_dates, n_tickers) ; la fenêtre se compte en barres de
+         chaque titre (`valid` = barres présentes). Retourne
+         (col int64, index int64 = ligne du panel, type int8, value float64),
+         trié par titre puis barre.
+    """
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+
+    if high.ndim == 1:
+        f_h, f_l = _pivot_flags(high, low, w, gold)
+        return _merge_pivots(np.flatnonzero(f_h), np.flatnonzero(f_l), high, low)
+
+    n_d, n_t = high.shape
+    if valid is None:
+        valid = np.ones((n_d, n_t), dtype=bool)
+
+    # compactage : k-ième barre présente de chaque titre en ligne k
+    cols, rows = np.nonzero(np.asarray(valid).T)
+    col_start = np.searchsorted(cols, cols, side='left')
+    k = np.arange(len(rows)) - col_start
+    counts = np.bincount(cols, minlength=n_t)
+    n_max = int(counts.max()) if n_t else 0
+
+    c_high = np.full((n_max, n_t), np.nan)
+    c_low = np.full((n_max, n_t), np.nan)
+    c_high[k, cols] = high[rows, cols]
+    c_low[k, cols] = low[rows, cols]
+
+    f_h, f_l = _pivot_flags(c_high, c_low, w, gold)
+    # la fenêtre doit tenir dans l'historique du titre (pas de bourrage NaN)
+    in_range = np.arange(n_max)[:, None] + w < counts[None, :]
+    f_h &= in_range
+    f_l &= in_range
+
+    first = np.zeros(n_t, dtype=np.int64)
+    first[1:] = np.cumsum(counts)[:-1]
+
+    out_cols, out_idx, out_type, out_val = [], [], [], []
+    for flags, kind, src in ((f_h, PIVOT_H, c_high), (f_l, PIVOT_L, c_low)):
+        kk, cc = np.nonzero(flags)
+        out_cols.append(cc)
+        out_idx.append(rows[first[cc] + kk])
+        out_type.append(np.full(len(kk), kind, dtype=np.int8))
+        out_val.append(src[kk, cc])
+
+    col = np.concatenate(out_cols).astype(np.int64)
+    idx = np.concatenate(out_idx).astype(np.int64)
+    typ = np.concatenate(out_type)
+    val = np.concatenate(out_val)
+    order = np.lexsort((typ == PIVOT_L, idx, col))
+    return col[order], idx[order], typ[order], val[order]
+
+
+def _merge_pivots(i_h, i_l, high, low):
+    idx = np.concatenate([i_h, i_l]).astype(np.int64)
+    typ = np.concatenate([
+        np.full(len(i_h), PIVOT_H, dtype=np.int8),
+        np.full(len(i_l), PIVOT_L, dtype=np.int8)
+    ])
+    val = np.concatenate([high[i_h], low[i_l]])
+    order = np.lexsort((typ == PIVOT_L, idx))
+    return idx[order], typ[order], val[order]
+
+
+def pivot_events(high, low, w=3):
+    """
+    Pivots stricts (format historique, liste de dicts) :
+      - H si aucun voisin (i-w..i+w, hors i) n'a high >= high[i]
+      - L si aucun voisin (i-w..i+w, hors i) n'a low  <= low[i]
+    """
+    idx, typ, val = pivot_arrays(high, low, w=w)
+    return [
+        {'pivot_i': int(i), 'type': 'H' if t == PIVOT_H else 'L', 'value': float(v)}
+        for i, t, v in zip(idx, typ, val)
+    ]
+
+
+# Codes de structure (int8) ; chaînes créées seulement à la frontière API
+STRUCT_ND = 0
+STRUCT_HH_HL = 1
+STRUCT_LABELS = ('ND', 'HH+HL', 'HH+LL', 'LH+HL', 'LH+LL')
+
+
+def _window_start(count, last_pivots):
+    # début de active[-last_pivots:] (sémantique exacte du slicing Python)
+    if last_pivots > 0:
+        return max(0, count - last_pivots)
+    if last_pivots == 0:
+        return 0
+    return min(count, -last_pivots)
+
+
+def structure_codes(high, low, w=3, last_pivots=15, valid=None, backend=None):
+    """
+    Structure de marché, codes int8 (STRUCT_LABELS[code]) :
+      - un pivot détecté à k devient visible à k+w
+      - à chaque barre, fenêtre des `last_pivots` derniers pivots visibles
+      - HH/LH sur les deux derniers H ; HL/LL sur les deux derniers L
+
+    Incrémental : on ne suit que les deux derniers H et L (rang dans la suite
+    des pivots visibles + valeur). Le label ne peut changer qu'aux barres où
+    un pivot devient visible ; entre deux, il est propagé. O(n + pivots).
+
+    2D : pivots détectés en une passe pour tout le panel (pivot_arrays),
+    puis étiquetage colonne par colonne ; codes 0 hors barres présentes.
+    backend : backend des noyaux séquentiels (voir kernels).
+    """
+    high = np.asarray(high, dtype=float)
+    if high.ndim == 1:
+        p_idx, p_type, p_val = pivot_arrays(high, low, w=w)
+        return _label_pivots(len(high), p_idx, p_type, p_val, w, last_pivots, backend)
+
+    if valid is None:
+        valid = np.ones(high.shape, dtype=bool)
+    valid = np.asarray(valid)
+
+    codes = np.zeros(high.shape, dtype=np.int8)
+    p_col, p_idx, p_type, p_val = pivot_arrays(high, low, w=w, valid=valid)
+    bounds = np.searchsorted(p_col, np.arange(high.shape[1] + 1))
+
+    for j in range(high.shape[1]):
+        rows = np.flatnonzero(valid[:, j])
+        lo, hi = bounds[j], bounds[j + 1]
+        # index de barre du titre (position dans ses lignes présentes)
+        k = np.searchsorted(rows, p_idx[lo:hi])
+        codes[rows, j] = _label_pivots(len(rows), k, p_type[lo:hi], p_val[lo:hi], w, last_pivots, backend)
+
+    return codes
+
+
+def _label_pivots(n, p_idx, p_type, p_val, w, last_pivots, backend=None):
+    # un pivot détecté à k devient visible à k+w ; boucle séquentielle dans kernels
+    p_bar = np.asarray(p_idx, dtype=np.int64) + w
+    return kernels.get('label_pivots', backend)(
+        int(n),
+        p_bar,
+        np.asarray(p_type, dtype=np.int8),
+        np.asarray(p_val, dtype=float),
+        int(last_pivots)
+    )
+
+
+# fenêtre initiale de structure_codes_at, en barres par pivot de last_pivots
+STRUCT_SPAN_BARS_PER_PIVOT = 12
+
+
+def structure_codes_at(high, low, need, w=3, last_pivots=15, valid=None, backend=None):
+    """
+    structure_codes évalué aux seules barres `need` (bool, même forme que
+    high) ; STRUCT_ND ailleurs. Identique à structure_codes sur ces barres.
+
+    Le code à la barre d ne dépend que des `last_pivots` derniers pivots
+    visibles (barre + w <= d). Chaque barre demandée est évaluée sur une
+    fenêtre locale [d - span, d] : les pivots détectés dans la fenêtre sont
+    un suffixe exact de la suite complète ; le résultat est exact dès que
+    ce suffixe compte last_pivots pivots ou que la fenêtre remonte au début
+    de l'historique. Sinon span est multiplié par 4. Quand les fenêtres
+    coûteraient plus que l'historique complet (barres demandées denses), ou
+    si last_pivots <= 0 / barres non compactes, repli sur structure_codes.
+    """
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    if high.ndim == 1:
+        return structure_codes_at(
+            high[:, None], low[:, None], np.asarray(need)[:, None], w, last_pivots, backend=backend
+        )[:, 0]
+
+    n_d = high.shape[0]
+    valid = np.ones(high.shape, dtype=bool) if valid is None else np.asarray(valid)
+    need = np.asarray(need, dtype=bool) & valid
+    codes = np.zeros(high.shape, dtype=np.int8)
+
+    d_bar, d_col = np.nonzero(need)
+    if not len(d_bar):
+        return codes
+
+    counts = valid.sum(axis=0)
+    compact = np.array_equal(valid, np.arange(n_d)[:, None] < counts[None, :])
+    budget = int(counts[np.unique(d_col)].sum())
+    span = STRUCT_SPAN_BARS_PER_PIVOT * max(last_pivots, 1)
+
+    while len(d_bar) and compact and last_pivots > 0 and len(d_bar) * (span + 1) <= budget:
+        win_codes, exact = _struct_codes_window(high, low, d_bar, d_col, w, last_pivots, span)
+        codes[d_bar[exact], d_col[exact]] = win_codes[exact]
+        d_bar, d_col = d_bar[~exact], d_col[~exact]
+        span *= 4
+
+    if len(d_bar):
+        cols = np.unique(d_col)
+        full = structure_codes(high[:, cols], low[:, cols], w=w, last_pivots=last_pivots,
+                               valid=valid[:, cols], backend=backend)
+        codes[d_bar, d_col] = full[d_bar, np.searchsorted(cols, d_col)]
+
+    return codes
+
+
+def _struct_codes_window(high, low, d_bar, d_col, w, last_pivots, span):
+    """
+    Codes aux barres (d_bar, d_col) depuis la fenêtre [d - span, d] de
+    chaque barre (une ligne par barre demandée). Retourne (codes, exact).
+    """
+    bars = d_bar[:, None] + np.arange(-span, 1)[None, :]
+    h = high[np.maximum(bars, 0), d_col[:, None]]
+    l = low[np.maximum(bars, 0), d_col[:, None]]
+
+    # pivots à fenêtre complète dans [d - span, d], visibles en d ; barre >= w
+    f_h, f_l = _pivot_flags(h.T, l.T, w)
+    f_h = f_h.T & (bars >= w)
+    f_l = f_l.T & (bars >= w)
+
+    # rang dans la suite des pivots de la fenêtre (H avant L sur une même barre)
+    per_bar = f_h.astype(np.int64) + f_l
+    cum = np.cumsum(per_bar, axis=1)
+    count = cum[:, -1]
+
+    pos = np.arange(bars.shape[1])
+    h_last = np.max(np.where(f_h, pos, -1), axis=1)
+    h_prev = np.max(np.where(f_h & (pos < h_last[:, None]), pos, -1), axis=1)
+    l_last = np.max(np.where(f_l, pos, -1), axis=1)
+    l_prev = np.max(np.where(f_l & (pos < l_last[:, None]), pos, -1), axis=1)
+
+    r = np.arange(len(d_bar))
+    start = np.maximum(0, count - last_pivots)
+    ok = (h_prev >= 0) & (l_prev >= 0)
+    ok &= (cum[r, h_prev] - per_bar[r, h_prev] >= start) & (cum[r, l_prev] - 1 >= start)
+
+    hh = h[r, h_last] > h[r, h_prev]
+    hl = l[r, l_last] > l[r, l_prev]
+    codes = np.where(ok, 1 + 2 * (~hh) + (~hl), STRUCT_ND).astype(np.int8)
+
+    exact = (count >= last_pivots) | (d_bar - span <= 0)
+    return codes, exact
+
+
+def structure_labels(high, low, w=3, last_pivots=15):
+    """Retourne (labels object, struct_ok bool) à partir de structure_codes."""
+    codes = structure_codes(high, low, w=w, last_pivots=last_pivots)
+    return np.array(STRUCT_LABELS, dtype=object)[codes], codes == STRUCT_HH_HL
+
+
+def squeeze_flag(high, low, close, p=20):
+    """2*std20(population) < 1.5*moyenne20(high-low). 1D ou 2D (barres en axe 0)."""
+    high = np.asarray(high, dtype=float)
+    std20 = _rolling_frame(close).rolling(p, min_periods=p).std(ddof=0).to_numpy()
+    atr20 = _rolling_frame(high - low).rolling(p, min_periods=p).mean().to_numpy()
+    with np.errstate(invalid='ignore'):
+        return (2.0 * std20) < (1.5 * atr20)
+
+
+def true_range(high, low, close):
+    """max(high-low, |high-prev_close|, |low-prev_close|), NaN ignorés (comme DataFrame.max). 1D ou 2D."""
+    prev_close = np.empty_like(close)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+    return np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+
+# ==== END indicators.py
@@ -0,0 +1,372 @@
+# ==== START kernels.py
+"""
+Noyaux séquentiels (barre par barre) sur tableaux NumPy, avec backend
+compilé optionnel.
+
+  - 'python' : implémentation de référence (boucles Python)
+  - 'numpy'  : variante vectorisée quand elle existe (@vectorized), sinon
+               la boucle de référence
+  - 'numba'  : boucles de référence compilées par numba.njit (si installé)
+  - 'auto'   : numba si disponible, sinon numpy
+
+Les noyaux n'utilisent que des scalaires et des tableaux NumPy (pas de
+None, pas de dict) : le même code source sert à 'python' et 'numba', avec
+les mêmes opérations float64 dans le même ordre ; les variantes
+vectorisées font les mêmes opérations élément par élément. Résultats
+identiques quel que soit le backend. Un backend 'numba' demandé sans numba
+installé retombe sur 'numpy'.
+
+Sélection : ALPHA4_CFG['ENGINE_BACKEND'] par run, sinon KERNEL_CFG['BACKEND']
+(variable d'environnement STOCKS_ENGINE_BACKEND).
+"""
+
+import os
+import threading
+
+import numpy as np
+
+KERNEL_CFG = {
+    'BACKEND': os.environ.get('STOCKS_ENGINE_BACKEND', 'auto'),
+}
+
+BACKENDS = ('auto', 'python', 'numpy', 'numba')
+
+_PYTHON = {}
+_VECTORIZED = {}
+_COMPILED = {}
+_COMPILE_LOCK = threading.Lock()
+_WARNED = set()
+_NUMBA = []
+
+
+def _numba():
+    """Module numba ou None ; importé au premier besoin (coût d'import hors démarrage à froid)."""
+    if not _NUMBA:
+        try:
+            import numba
+        except ImportError:  # pragma: no cover - dépendance optionnelle
+            numba = None
+        _NUMBA.append(numba)
+    return _NUMBA[0]
+
+
+def kernel(func):
+    """Enregistre un noyau (version Python de référence, compilée à la demande)."""
+    _PYTHON[func.__name__] = func
+    return func
+
+
+def vectorized(name):
+    """Enregistre la variante NumPy vectorisée du noyau `name` (backend 'numpy')."""
+    def register(func):
+        _VECTORIZED[name] = func
+        return func
+    return register
+
+
+def resolve_backend(backend=None):
+    """'python', 'numpy' ou 'numba' effectivement utilisé pour `backend` (None = défaut du module)."""
+    backend = backend or KERNEL_CFG['BACKEND']
+    if backend not in BACKENDS:
+        raise ValueError(f"ENGINE_BACKEND inconnu : {backend!r} (attendu : {', '.join(BACKENDS)})")
+
+    if backend in ('python', 'numpy'):
+        return backend
+    if _numba() is None:
+        if backend == 'numba' and 'numba' not in _WARNED:
+            _WARNED.add('numba')
+            print("[kernels] numba non installé : backend 'numpy' utilisé")
+        return 'numpy'
+    return 'numba'
+
+
+def get(name, backend=None):
+    """Implémentation du noyau `name` pour le backend demandé."""
+    backend = resolve_backend(backend)
+    if backend == 'python':
+        return _PYTHON[name]
+    if backend == 'numpy':
+        return _VECTORIZED.get(name, _PYTHON[name])
+
+    func = _COMPILED.get(name)
+    if func is None:
+        with _COMPILE_LOCK:
+            func = _COMPILED.get(name)
+            if func is None:
+                func = _COMPILED[name] = _numba().njit(cache=True, nogil=True)(_PYTHON[name])
+    return func
+
+
+def info():
+    return {
+        'default_backend': KERNEL_CFG['BACKEND'],
+        'resolved_backend': resolve_backend(),
+        'numba_version': getattr(_numba(), '__version__', None),
+        'kernels': sorted(_PYTHON),
+        'vectorized': sorted(_VECTORIZED),
+        'compiled': sorted(_COMPILED),
+    }
+
+
+# ===========================
+# Structure : visibilité des pivots
+# ===========================
+
+@kernel
+def label_pivots(n, p_bar, p_type, p_val, last_pivots):
+    """
+    Codes de structure (int8) à partir des pivots triés par barre de
+    visibilité p_bar (= barre du pivot + w). Voir indicators.structure_codes.
+    Rangs -1 = pivot absent.
+    """
+    codes = np.zeros(n, dtype=np.int8)
+
+    h_prev_rank, h_prev_val, h_last_rank, h_last_val = -1, 0.0, -1, 0.0
+    l_prev_rank, l_prev_val, l_last_rank, l_last_val = -1, 0.0, -1, 0.0
+    count = 0
+    code = 0
+    prev_bar = -1
+
+    for k in range(len(p_bar)):
+        i = p_bar[k]
+        if i >= n:
+            break
+
+        if prev_bar >= 0 and i != prev_bar:
+            codes[prev_bar:i] = code
+
+        if p_type[k] == 1:
+            h_prev_rank, h_prev_val = h_last_rank, h_last_val
+            h_last_rank, h_last_val = count, p_val[k]
+        else:
+            l_prev_rank, l_prev_val = l_last_rank, l_last_val
+            l_last_rank, l_last_val = count, p_val[k]
+        count += 1
+
+        # début de active[-last_pivots:] (sémantique du slicing Python)
+        if last_pivots > 0:
+            start = max(0, count - last_pivots)
+        elif last_pivots == 0:
+            start = 0
+        else:
+            start = min(count, -last_pivots)
+
+        if h_prev_rank < 0 or l_prev_rank < 0 or h_prev_rank < start or l_prev_rank < start:
+            code = 0
+        else:
+            hh = h_last_val > h_prev_val
+            hl = l_last_val > l_prev_val
+            code = 1 + 2 * (0 if hh else 1) + (0 if hl else 1)
+
+        prev_bar = i
+
+    if prev_bar >= 0:
+        codes[prev_bar:] = code
+
+    return codes
+
+
+# ===========================
+# Trade alpha4 : gestion barre par barre
+# ===========================
+
+EXIT_OPEN = 0
+EXIT_TP = 1
+EXIT_SL = 2
+EXIT_BE = 3
+EXIT_LOCK = 4
+
+LOCK_NONE = 0
+LOCK_1 = 1
+LOCK_2 = 2
+
+
+@kernel
+def walk_trade(high, low, close, start, e_px, tp_val, be_trig, be_delay, stop_l, fees,
+               use_lock, lock1_trigger, lock1_raw, lock2_trigger, lock2_raw):
+    """
+    Suit un trade entré au close de la barre start-1 jusqu'à sa sortie.
+
+    Par barre : MFE/MAE/closes extrêmes, BE déclenché sur la barre et appliqué
+    à partir de la suivante (après be_delay barres), profit locks (LOCK2
+    prioritaire, LOCK1 une seule fois), stop effectif = max(SL ou BE, lock),
+    sortie TP / stop (le stop l'emporte si les deux sont touchés).
+
+    Retourne (exit_i, exit_code, raw_exit, bars_held, be_hit, bars_to_be,
+    mfe, mae, max_close, min_close, lock_code) ; exit_i = -1 et
+    exit_code = EXIT_OPEN si le trade est encore ouvert en fin de série,
+    bars_to_be = -1 si le BE n'a pas été atteint.
+    """
+    bars_held = 0
+    be_hit = False
+    bars_to_be = -1
+    mfe = 0.0
+    mae = 0.0
+    max_close = 0.0
+    min_close = 0.0
+    lock_code = 0
+    lock_raw = 0.0
+
+    for i in range(start, len(close)):
+        bars_held += 1
+
+        h_perf = (high[i] - e_px) / e_px
+        l_perf = (low[i] - e_px) / e_px
+        c_perf = (close[i] - e_px) / e_px
+
+        # max()/min() Python : une valeur NaN ne remplace jamais l'extrême courant
+        if h_perf > mfe:
+            mfe = h_perf
+        if l_perf < mae:
+            mae = l_perf
+        if c_perf > max_close:
+            max_close = c_perf
+        if c_perf < min_close:
+            min_close = c_perf
+
+        be_triggered_this_bar = (not be_hit) and (h_perf >= be_trig) and (bars_held >= be_delay)
+
+        if use_lock:
+            if mfe >= lock2_trigger:
+                lock_raw = lock2_raw
+                lock_code = 2
+            elif mfe >= lock1_trigger:
+                if lock_code == 0:
+                    lock_raw = lock1_raw
+                    lock_code = 1
+
+        effective_sl = fees if be_hit else -stop_l
+        if lock_code != 0 and lock_raw > effective_sl:
+            effective_sl = lock_raw
+
+        hit_tp = h_perf >= tp_val
+        hit_sl = l_perf <= effective_sl
+
+        if hit_tp or hit_sl:
+            if hit_tp and not hit_sl:
+                return (i, 1, tp_val, bars_held, be_hit, bars_to_be,
+                        mfe, mae, max_close, min_close, lock_code)
+
+            if lock_code != 0 and effective_sl > fees:
+                exit_code = 4
+            elif be_hit:
+                exit_code = 3
+            else:
+                exit_code = 2
+            return (i, exit_code, effective_sl, bars_held, be_hit, bars_to_be,
+                    mfe, mae, max_close, min_close, lock_code)
+
+        if be_triggered_this_bar:
+            be_hit = True
+            if bars_to_be < 0:
+                bars_to_be = bars_held
+
+    return (-1, 0, 0.0, bars_held, be_hit, bars_to_be,
+            mfe, mae, max_close, min_close, lock_code)
+
+
+_FIRST_PASSAGE_HEAD = 32
+_FIRST_PASSAGE_MAX_CHUNK = 4096
+
+
+def _strict_extreme(val, best, greater):
+    # extrême courant mis à jour par > / < strict : une valeur NaN ne le remplace jamais
+    return float(val) if (val > best if greater else val < best) else best
+
+
+@vectorized('walk_trade')
+def walk_trade_first_passage(high, low, close, start, e_px, tp_val, be_trig, be_delay, stop_l, fees,
+                             use_lock, lock1_trigger, lock1_raw, lock2_trigger, lock2_raw):
+    """
+    walk_trade par premier passage. Les _FIRST_PASSAGE_HEAD premières
+    barres passent par la boucle de référence (sur des floats Python : la
+    plupart des trades sortent là) ; au-delà, tranches de taille croissante
+    où l'état du trade à chaque barre se déduit d'accumulations (BE = OU
+    cumulé des déclenchements des barres précédentes, lock = fonction du
+    MFE courant, monotone) et la sortie est la première barre où le TP ou
+    le stop effectif est touché. Pas de boucle Python par barre sur les
+    trades longs.
+    """
+    n = len(close)
+    head = min(n, start + _FIRST_PASSAGE_HEAD)
+    res = walk_trade(
+        high[start:head].tolist(), low[start:head].tolist(), close[start:head].tolist(), 0,
+        e_px, tp_val, be_trig, be_delay, stop_l, fees,
+        use_lock, lock1_trigger, lock1_raw, lock2_trigger, lock2_raw
+    )
+    if res[0] >= 0:
+        return (res[0] + start,) + res[1:]
+
+    bars_held, be_hit, bars_to_be, mfe, mae, max_close, min_close, lock_code = res[3:]
+
+    lo = head
+    size = 4 * _FIRST_PASSAGE_HEAD
+    with np.errstate(invalid='ignore', divide='ignore'):
+        while lo < n:
+            hi = min(n, lo + size)
+            h_perf = (high[lo:hi] - e_px) / e_px
+            l_perf = (low[lo:hi] - e_px) / e_px
+            held = np.arange(bars_held + 1, bars_held + 1 + hi - lo)
+
+            # BE : déclenché sur une barre, appliqué à partir de la suivante
+            trig = (h_perf >= be_trig) & (held >= be_delay)
+            be_state = np.empty(len(trig), dtype=bool)
+            be_state[0] = be_hit
+            np.logical_or(be_hit, np.logical_or.accumulate(trig[:-1]), out=be_state[1:])
+
+            effective_sl = np.where(be_state, fees, -stop_l)
+
+            codes = None
+            if use_lock:
+                mfe_run = np.fmax.accumulate(h_perf)
+                mfe_run = np.where(mfe_run > mfe, mfe_run, mfe)
+                codes = np.where(mfe_run >= lock2_trigger, 2, np.where(mfe_run >= lock1_trigger, 1, 0))
+                np.maximum(codes, lock_code, out=codes)
+                lock_raws = np.where(codes == 2, lock2_raw, lock1_raw)
+                effective_sl = np.where((codes != 0) & (lock_raws > effective_sl), lock_raws, effective_sl)
+
+            hit_tp = h_perf >= tp_val
+            hit_sl = l_perf <= effective_sl
+            hit = hit_tp | hit_sl
+
+            exited = bool(hit.any())
+            k = int(np.argmax(hit)) if exited else len(hit) - 1
+
+            # BE atteint : premier déclenchement sur une barre sans sortie
+            if bars_to_be < 0 and not be_hit:
+                first = np.flatnonzero(trig[:k] if exited else trig)
+                if len(first):
+                    bars_to_be = int(held[first[0]])
+
+            # extrêmes jusqu'à la barre k incluse
+            c_perf = (close[lo:lo + k + 1] - e_px) / e_px
+            mfe = _strict_extreme(np.fmax.reduce(h_perf[:k + 1]), mfe, True)
+            mae = _strict_extreme(np.fmin.reduce(l_perf[:k + 1]), mae, False)
+            max_close = _strict_extreme(np.fmax.reduce(c_perf), max_close, True)
+            min_close = _strict_extreme(np.fmin.reduce(c_perf), min_close, False)
+
+            bars_held = int(held[k])
+            be_hit = bool(be_state[k]) if exited else bool(be_hit or trig.any())
+            if codes is not None:
+                lock_code = int(codes[k])
+
+            if exited:
+                state = (bars_held, be_hit, bars_to_be, mfe, mae, max_close, min_close, lock_code)
+                sl = float(effective_sl[k])
+                if hit_tp[k] and not hit_sl[k]:
+                    return (lo + k, 1, tp_val) + state
+                if lock_code != 0 and sl > fees:
+                    exit_code = 4
+                elif be_hit:
+                    exit_code = 3
+                else:
+                    exit_code = 2
+                return (lo + k, exit_code, sl) + state
+
+            lo = hi
+            size = min(size * 4, _FIRST_PASSAGE_MAX_CHUNK)
+
+    return (-1, 0, 0.0, bars_held, be_hit, bars_to_be,
+            mfe, mae, max_close, min_close, lock_code)
+
+# ==== END kernels.py
@@ -1,17 +1,69 @@
-from flask import Flask, request, jsonify
-from google.cloud import bigquery
-import yfinance as yf
+import importlib
 import os
-import backtest_test
-import sigma
-import sigma2
+import sys
+import threading
+import time
+
+_T_MODULE_START = time.perf_counter()
+
+from flask import Flask, request, jsonify
+from refresh_scheduler import REFRESH_CFG
+
+# Démarrage à froid (Cloud Run) : pandas / yfinance / BigQuery / moteurs
+# sont importés au premier appel de l'endpoint qui en a besoin (lazy_module).
+STARTUP_CFG = {
+    'IMPORT_BUDGET_MS': int(os.environ.get('STOCKS_IMPORT_BUDGET_MS', 300)),   # budget import de main.py
+    'WARMUP': os.environ.get('STOCKS_WARMUP', '1') not in ('0', 'false', 'False', ''),
+    'WARMUP_MODULES': ('sigma2', 'sigma', 'backtest_test', 'yfinance'),
+}
+
+IMPORT_TIMES_MS = {}
+_WARMUP = {'started': False, 'done': False, 'error': None}
 
 app = Flask(__name__)
 
+
+def lazy_module(name):
+    """Importe le module au premier usage et mesure la durée de cet import."""
+    # import_module attend la fin d'un import en cours dans un autre thread
+    # (warm-up) : on ne récupère jamais un module à moitié initialisé.
+    first = name not in sys.modules
+    t0 = time.perf_counter()
+    mod = importlib.import_module(name)
+    if first:
+        IMPORT_TIMES_MS.setdefault(name, round((time.perf_counter() - t0) * 1000.0, 1))
+    return mod
+
+
+def warm_up():
+    """
+    Hook de warm-up : lance le rafraîchissement de l'état chaud
+    (sigma2.V4_WARM) puis importe les autres moteurs. Appelé en arrière-plan au démarrage
+    si STOCKS_WARMUP est actif ; peut aussi être appelé par un hook gunicorn.
+    """
+    _WARMUP['started'] = True
+    errors = []
+    try:
+        if REFRESH_CFG['ENABLED']:
+            lazy_module('sigma2').V4_WARM.start()
+    except Exception as e:
+        errors.append(f"V4_WARM: {type(e).__name__}: {e}")
+
+    for name in STARTUP_CFG['WARMUP_MODULES']:
+        try:
+            lazy_module(name)
+        except Exception as e:
+            errors.append(f"{name}: {type(e).__name__}: {e}")
+
+    if errors:
+        _WARMUP['error'] = '; '.join(errors)
+        print("WARMUP ERROR:", _WARMUP['error'])
+    _WARMUP['done'] = True
+
 @app.route("/run_test2", methods=["GET"])
 def run_test2():
     try:
-        result = sigma2.run_walkforward()
+        result = lazy_module('sigma2').run_walkforward()
         return jsonify(result)
     except Exception as e:
         return jsonify({"status":"error", "message": str(e)})
@@ -20,12 +72,12 @@ def run_test2():
 def run_test3():
     try:
         # 1. On part de ta configuration par défaut
-        config_finale = sigma2.ALPHA4_CFG.copy()
+        sigma2 = lazy_module('sigma2')
         
         # 2. On injecte les paramètres reçus de GAS s'ils existent
-        if request.is_json:
-            params_gas = request.get_json()
-            config_finale.update(params_gas)
+        # (exécution / chemins / projet restent ceux du serveur)
+        params_gas = request.get_json() if request.is_json else None
+        config_finale = sigma2.request_cfg(params_gas)
         
         # 3. On exécute avec la config mise à jour
         result = sigma2.alpha4(config_finale) # <--- On passe l'objet ici
@@ -36,10 +88,71 @@ def run_test3():
         return jsonify({"status": "error", "message": str(e)})
 
 
+@app.route("/alpha4_sweep", methods=["POST"])
+def alpha4_sweep():
+    # Sweep de grille en un appel (au lieu d'un /run_test3 par point) :
+    # {"grid": {"MIN_SCORE": [80, 86], "TP_TREND": [0.12, 0.135]}, "cfg": {...}, "metric": "gain_total", "top": 50}
+    try:
+        payload = request.get_json(force=True)
+        sigma2 = lazy_module('sigma2')
+        result = sigma2.alpha4_sweep(
+            payload['grid'],
+            cfg=sigma2.request_cfg(payload.get('cfg')),
+            metric=payload.get('metric', 'gain_total'),
+            ascending=bool(payload.get('ascending', False)),
+            top=payload.get('top')
+        )
+        return app.response_class(lazy_module('sharding').dumps(dict(result, status='ok')), mimetype='application/json')
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/alpha4_shard", methods=["POST"])
+def alpha4_shard():
+    # Map d'un shard pour un coordinateur alpha4 (SHARD_MODE='http')
+    try:
+        payload = request.get_json(force=True)
+        sigma2 = lazy_module('sigma2')
+        result = sigma2.alpha4_shard(sigma2.request_cfg(payload.get('cfg')), payload['tickers'])
+        return app.response_class(lazy_module('sharding').dumps(result), mimetype='application/json')
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/features", methods=["GET"])
+def features():
+    # Lecture du feature store alpha4 : ?tickers=A,B&columns=score,rsi&start=2024-01-01&end=2024-03-31&snapshot=...
+    try:
+        sigma2 = lazy_module('sigma2')
+        feature_store = lazy_module('feature_store')
+        cfg = sigma2.ALPHA4_CFG
+
+        def _list(name):
+            raw = request.args.get(name)
+            return [x.strip() for x in raw.split(',') if x.strip()] if raw else None
+
+        df = feature_store.read_features(
+            cfg['DB_SET'], cfg['TBL'],
+            tickers=_list('tickers'),
+            columns=_list('columns'),
+            start_date=request.args.get('start'),
+            end_date=request.args.get('end'),
+            snapshot=request.args.get('snapshot'),
+            config=request.args.get('config') or cfg,
+            store_dir=cfg.get('FEATURE_STORE_DIR')
+        )
+        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
+        table = {'columns': list(df.columns), 'rows': df.astype(object).where(df.notna(), None).values.tolist()}
+        return jsonify({"status": "ok", "rows": len(df), "features": table})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+
 @app.route("/run_test", methods=["GET"])
 def run_test():
     try:
-        result = backtest_test.run_vlab_backtest_full()
+        # ?ticker=ORA.PA (défaut VLAB_CFG['TICKER'])
+        result = lazy_module('backtest_test').run_vlab_backtest_full(ticker=request.args.get('ticker'))
         return jsonify(result)
     except Exception as e:
         return jsonify({"status":"error", "message": str(e)})
@@ -49,6 +162,38 @@ def run_test():
 def ping():
     return jsonify({"status": "ok"})
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # 503 tant que l'état chaud n'est pas construit (sonde de readiness) ;
+    # warm start désactivé : prêt d'emblée, les requêtes chargent leurs données
+    if not REFRESH_CFG['ENABLED']:
+        return jsonify({"status": "ready", "warm_state": "disabled"}), 200
+    warm_state = getattr(sys.modules.get('sigma2'), 'V4_WARM', None)
+    warm = warm_state.status() if warm_state is not None else {'ready': False}
+    return jsonify({"status": "ready" if warm['ready'] else "warming", "warm_state": warm}), (200 if warm['ready'] else 503)
+
+@app.route('/startup_stats', methods=['GET'])
+def startup_stats():
+    return jsonify({
+        "main_import_ms": MAIN_IMPORT_MS,
+        "import_budget_ms": STARTUP_CFG['IMPORT_BUDGET_MS'],
+        "within_budget": MAIN_IMPORT_MS <= STARTUP_CFG['IMPORT_BUDGET_MS'],
+        "lazy_imports_ms": IMPORT_TIMES_MS,
+        "warmup": _WARMUP
+    })
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    # caches déjà chargés uniquement (pas d'import lourd pour une sonde)
+    out = {}
+    store = sys.modules.get('market_store')
+    if store is not None:
+        out['history'] = store.HISTORY_CACHE.stats()
+    ind_cache = sys.modules.get('indicator_cache')
+    if ind_cache is not None:
+        out['indicators'] = ind_cache.stats()
+    return jsonify(out)
+
 @app.route('/test_bq', methods=['GET'])
 def test_bq():
     project_id = request.args.get('project')
@@ -59,7 +204,7 @@ def test_bq():
         return jsonify({"error": "project, dataset, table requis"}), 400
 
     try:
-        client = bigquery.Client(project=project_id)
+        client = lazy_module('market_store').get_client(project_id)
         query = f"SELECT * FROM `{dataset_id}.{table_id}` LIMIT 5"
         df = client.query(query).to_dataframe()
 
@@ -86,6 +231,7 @@ def get_stock_data():
         return jsonify({"error": "Ticker manquant"}), 400
 
     try:
+        yf = lazy_module('yfinance')
         stock = yf.Ticker(ticker_symbol)
         hist = stock.history(period="1d")
         
@@ -117,6 +263,7 @@ def get_batch_data():
     results = {}
 
     try:
+        yf = lazy_module('yfinance')
         # ---------------------------------------------------------
         # MODE SOLO (1 ticker) : Sécurisé via yf.Ticker
         # ---------------------------------------------------------
@@ -237,6 +384,7 @@ def get_historic_data():
         return jsonify({"error": "Ticker et date (YYYY-MM-DD) requis"}), 400
 
     try:
+        yf = lazy_module('yfinance')
         stock = yf.Ticker(ticker_symbol)
         # On récupère une petite fenêtre autour de la date pour être sûr d'avoir la donnée
         # (car le marché est fermé le week-end)
@@ -270,6 +418,7 @@ def get_range_data():
         return jsonify({"error": "Paramètres manquants : ticker, start, end"}), 400
 
     try:
+        yf = lazy_module('yfinance')
         stock = yf.Ticker(ticker_symbol)
         # Note : end_date dans yfinance est exclusif, on récupère donc jusqu'à la veille de end_date
         df = stock.history(start=start_date, end=end_date, interval="1d")
@@ -313,6 +462,7 @@ def get_batch_historic():
     results = {}
 
     try:
+        yf = lazy_module('yfinance')
         # threads=True pour garder ton BIT bas et ta vitesse haute
         data = yf.download(ticker_list, start=start_date, end=end_date, group_by='ticker', threads=True)
         
@@ -362,6 +512,7 @@ def get_index_safe_history():
         return jsonify({"error": "Paramètres 'ticker' et 'date' requis"}), 400
 
     try:
+        yf = lazy_module('yfinance')
         # 1. On définit la borne de fin (lendemain de la cible pour inclure la cible)
         from datetime import datetime, timedelta
         end_dt = datetime.strptime(target_date, '%Y-%m-%d') + timedelta(days=1)
@@ -404,6 +555,14 @@ def get_index_safe_history():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+MAIN_IMPORT_MS = round((time.perf_counter() - _T_MODULE_START) * 1000.0, 1)
+if MAIN_IMPORT_MS > STARTUP_CFG['IMPORT_BUDGET_MS']:
+    print(f"STARTUP WARNING: import de main.py {MAIN_IMPORT_MS} ms > budget {STARTUP_CFG['IMPORT_BUDGET_MS']} ms")
+
+if STARTUP_CFG['WARMUP']:
+    threading.Thread(target=warm_up, name='warmup', daemon=True).start()
+
+
 if __name__ == "__main__":
     # Cloud Run utilise le port 8080 par défaut
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,282 @@
+# ==== START market_panel.py
+"""
+Panel dense dates x tickers construit une seule fois par run.
+
+La table longue (Date, Ticker, High, Low, Close, Volume) est pivotée en
+tableaux 2D alignés sur l'axe global des dates (ordre Fortran : une colonne
+= un ticker, contiguë en mémoire) + un masque de présence.
+
+Les vues par ticker sont des tranches de colonne sans copie tant que le
+ticker n'a pas de trou dans l'axe global (cas courant) ; sinon les lignes
+présentes sont compressées.
+
+Un panel peut être publié sur disque (un .npy par tableau + manifest.json
+dans un répertoire versionné, désigné par un lien symbolique remplacé
+atomiquement ; idéalement sous /dev/shm) puis rattaché en lecture seule par d'autres
+workers gunicorn ou processus via np.load(mmap_mode='r') : pas de copie,
+pas de désérialisation, les pages sont partagées par le noyau.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from bars import Bars
+
+PANEL_FIELDS = ('High', 'Low', 'Close', 'Volume')
+PANEL_FORMAT_VERSION = 2
+
+_PANEL_MANIFEST = 'manifest.json'
+_INDEX_ARRAYS = ('bar_counts', 'first_row', 'last_row', 'dup_counts')
+
+
+class MarketPanel:
+
+    def __init__(self, dates, tickers, fields, valid, index_arrays=None, dup_counts=None):
+        """
+        dates        : np.ndarray datetime64[ns] trié (axe 0)
+        tickers      : liste triée de tickers (axe 1)
+        fields       : dict nom -> np.ndarray float64 (n_dates, n_tickers)
+        valid        : np.ndarray bool (n_dates, n_tickers), True si la barre existe
+        index_arrays : bar_counts / first_row / last_row / dup_counts déjà calculés (attach)
+        dup_counts   : np.ndarray int64 (n_tickers), doublons (Ticker, Date) écartés à l'ingestion
+        """
+        self.dates = dates
+        self.tickers = list(tickers)
+        self.fields = fields
+        self.valid = valid
+        self.path = None
+
+        self._col = {t: j for j, t in enumerate(self.tickers)}
+
+        if index_arrays is not None:
+            self.bar_counts = index_arrays['bar_counts']
+            self.first_row = index_arrays['first_row']
+            self.last_row = index_arrays['last_row']
+            self.dup_counts = index_arrays['dup_counts']
+        else:
+            n = len(dates)
+            has_any = valid.any(axis=0)
+            self.bar_counts = valid.sum(axis=0).astype(np.int64)
+            self.first_row = np.where(has_any, valid.argmax(axis=0), 0).astype(np.int64)
+            self.last_row = np.where(has_any, n - 1 - valid[::-1].argmax(axis=0), -1).astype(np.int64)
+            self.dup_counts = (
+                np.zeros(len(self.tickers), dtype=np.int64) if dup_counts is None
+                else np.asarray(dup_counts, dtype=np.int64)
+            )
+
+    # ---------------------------
+    # Construction
+    # ---------------------------
+
+    @classmethod
+    def from_long(cls, df: pd.DataFrame, fields=PANEL_FIELDS):
+        """
+        Pivot unique de la table longue. Les doublons (Ticker, Date)
+        gardent la dernière ligne, comme le dédoublonnage de alpha4 ; ils
+        sont comptés par ticker (dup_counts), avec ceux déjà écartés en amont
+        (attrs['duplicate_dates'] de market_store.normalize_history / read_table).
+        """
+        df = df[df['Ticker'].notna() & df['Date'].notna()]
+
+        dates, d_codes = np.unique(df['Date'].to_numpy(dtype='datetime64[ns]'), return_inverse=True)
+        tickers, t_codes = np.unique(df['Ticker'].astype(str).to_numpy(), return_inverse=True)
+
+        n_d, n_t = len(dates), len(tickers)
+        flat = d_codes.astype(np.int64) * n_t + t_codes
+        keep = ~pd.Series(flat).duplicated(keep='last').to_numpy()
+        dropped = t_codes[~keep]
+        d_codes, t_codes = d_codes[keep], t_codes[keep]
+
+        out = {}
+        for f in fields:
+            arr = np.full((n_d, n_t), np.nan, dtype=np.float64, order='F')
+            arr[d_codes, t_codes] = pd.to_numeric(df[f], errors='coerce').to_numpy(dtype=np.float64)[keep]
+            out[f] = arr
+
+        valid = np.zeros((n_d, n_t), dtype=bool, order='F')
+        valid[d_codes, t_codes] = True
+
+        dup_counts = np.bincount(dropped, minlength=n_t).astype(np.int64)
+        for t, days in df.attrs.get('duplicate_dates', {}).items():
+            j = np.searchsorted(tickers, t)
+            if j < n_t and tickers[j] == t:
+                dup_counts[j] += sum(days.values())
+
+        return cls(dates, tickers.tolist(), out, valid, dup_counts=dup_counts)
+
+    # ---------------------------
+    # Partage inter-processus (mmap)
+    # ---------------------------
+
+    def publish(self, path, meta=None):
+        """
+        Écrit le panel dans un répertoire versionné (path.v<horodatage>) puis
+        fait pointer path dessus : un lien symbolique remplacé par un seul
+        os.replace, atomique pour les lecteurs (attach voit l'ancienne ou la
+        nouvelle version, jamais un mélange). La version précédente est
+        gardée jusqu'à la publication suivante pour les attach en cours ;
+        les processus déjà rattachés gardent leur mapping valide.
+        Les publications concurrentes d'un même path doivent être sérialisées
+        par l'appelant (verrou de market_store.load_panel).
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        version = f"{path}.v{time.time_ns():020d}"
+        os.makedirs(version)
+
+        np.save(os.path.join(version, 'dates.npy'), self.dates)
+        np.save(os.path.join(version, 'valid.npy'), self.valid)
+        for f, arr in self.fields.items():
+            np.save(os.path.join(version, f'{f}.npy'), arr)
+        for name in _INDEX_ARRAYS:
+            np.save(os.path.join(version, f'{name}.npy'), getattr(self, name))
+
+        manifest = {
+            'format_version': PANEL_FORMAT_VERSION,
+            'created_at': time.time(),
+            'shape': list(self.shape),
+            'fields': list(self.fields),
+            'tickers': self.tickers,
+            'meta': meta or {},
+        }
+        with open(os.path.join(version, _PANEL_MANIFEST), 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh)
+
+        if os.path.isdir(path) and not os.path.islink(path):
+            # ancien format (répertoire publié directement)
+            shutil.rmtree(path, ignore_errors=True)
+
+        link = f"{path}.lnk{os.getpid()}.{threading.get_ident()}"
+        os.symlink(os.path.basename(version), link)
+        os.replace(link, path)
+
+        for old in MarketPanel._versions(path)[:-2]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    @staticmethod
+    def _versions(path):
+        """Répertoires versionnés de path, du plus ancien au plus récent."""
+        parent, base = os.path.split(os.path.abspath(path))
+        prefix = base + '.v'
+        if not os.path.isdir(parent):
+            return []
+        return [os.path.join(parent, n) for n in sorted(os.listdir(parent)) if n.startswith(prefix)]
+
+    @staticmethod
+    def remove(path):
+        """Supprime un panel publié (lien + versions) ; les processus rattachés gardent leur mmap."""
+        if os.path.islink(path):
+            os.unlink(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        for old in MarketPanel._versions(path):
+            shutil.rmtree(old, ignore_errors=True)
+
+    @staticmethod
+    def read_manifest(path):
+        try:
+            with open(os.path.join(path, _PANEL_MANIFEST), 'r', encoding='utf-8') as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('format_version') != PANEL_FORMAT_VERSION:
+            return None
+        return manifest
+
+    @classmethod
+    def attach(cls, path, retries=2):
+        """
+        Rattache un panel publié, en lecture seule et sans copie (np.memmap).
+        Le lien est résolu une fois : tous les tableaux viennent de la même
+        version ; si elle disparaît entre-temps (publications rapprochées),
+        on résout à nouveau.
+        """
+        for attempt in range(retries + 1):
+            real = os.path.realpath(path)
+            manifest = cls.read_manifest(real)
+            if manifest is None:
+                raise FileNotFoundError(f"Panel introuvable : {path}")
+
+            def _load(name):
+                return np.load(os.path.join(real, f'{name}.npy'), mmap_mode='r')
+
+            try:
+                panel = cls(
+                    _load('dates'),
+                    manifest['tickers'],
+                    {f: _load(f) for f in manifest['fields']},
+                    _load('valid'),
+                    index_arrays={name: _load(name) for name in _INDEX_ARRAYS},
+                )
+            except FileNotFoundError:
+                if attempt == retries:
+                    raise
+                continue
+            panel.path = path
+            return panel
+
+    # ---------------------------
+    # Accès
+    # ---------------------------
+
+    def __contains__(self, ticker):
+        return ticker in self._col
+
+    @property
+    def shape(self):
+        return self.valid.shape
+
+    @property
+    def nbytes(self):
+        return int(sum(a.nbytes for a in self.fields.values()) + self.valid.nbytes + self.dates.nbytes)
+
+    def col(self, ticker):
+        return self._col[ticker]
+
+    def bar_count(self, ticker):
+        j = self._col.get(ticker)
+        return int(self.bar_counts[j]) if j is not None else 0
+
+    def ticker_rows(self, ticker):
+        """
+        Lignes du panel occupées par le ticker : un slice si elles sont
+        contiguës (vues sans copie), sinon un tableau d'indices.
+        """
+        j = self._col[ticker]
+        lo, hi = int(self.first_row[j]), int(self.last_row[j]) + 1
+        if hi - lo == int(self.bar_counts[j]):
+            return slice(lo, hi)
+        return np.flatnonzero(self.valid[:, j])
+
+    def ticker_arrays(self, ticker, fields=PANEL_FIELDS):
+        """(dates, {champ: array}) pour un ticker, limité à ses barres présentes."""
+        j = self._col[ticker]
+        rows = self.ticker_rows(ticker)
+        return self.dates[rows], {f: self.fields[f][rows, j] for f in fields}
+
+    def ticker_frame(self, ticker, fields=PANEL_FIELDS) -> pd.DataFrame:
+        """DataFrame indexé par Date (même forme que l'ancien df[df.Ticker == t])."""
+        dates, arrays = self.ticker_arrays(ticker, fields)
+        d = pd.DataFrame(arrays, index=pd.DatetimeIndex(dates, name='Date'), copy=False)
+        d.attrs['Ticker'] = ticker
+        return d
+
+    def ticker_bars(self, ticker) -> Bars:
+        """Bars d'un ticker (vues du panel, déjà triées et dédoublonnées : pas de revalidation)."""
+        dates, a = self.ticker_arrays(ticker)
+        return Bars.from_arrays(dates, a['High'], a['Low'], a['Close'], a['Volume'], ticker=ticker,
+                                duplicates=int(self.dup_counts[self._col[ticker]]))
+
+    def ticker_series(self, ticker, field='Close') -> pd.Series:
+        if ticker not in self._col:
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([], name='Date'), name=field)
+        dates, arrays = self.ticker_arrays(ticker, (field,))
+        return pd.Series(arrays[field], index=pd.DatetimeIndex(dates, name='Date'), name=field, copy=False)
+
+# ==== END market_panel.py
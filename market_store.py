@@ -0,0 +1,665 @@
+# ==== START market_store.py
+"""
+Store local colonnaire de l'historique BigQuery.
+
+Un fichier Parquet par ticker, rangé par table source :
+
+    <STORE_DIR>/<DB_SET>.<TBL>/<ticker>.parquet
+    <STORE_DIR>/<DB_SET>.<TBL>/_manifest.json
+
+La synchronisation est incrémentale : on ne redemande à BigQuery que les
+lignes à partir de la dernière date déjà stockée (la dernière journée est
+relue pour absorber une barre corrigée après coup), puis chaque ticker est
+réconcilié avec un agrégat BigQuery (nombre de dates, première / dernière
+date) : tickers nouveaux, historiques complétés ou amputés en amont sont
+rechargés. Un rechargement complet périodique (FULL_RESYNC_INTERVAL_S)
+reprend les barres anciennes corrigées en place.
+
+Toutes les requêtes passent par build_history_query : projection sur les
+colonnes moteur, filtres (tickers, fenêtre de dates, historique minimum)
+poussés dans le SQL, lecture Arrow via la BigQuery Storage Read API.
+
+Les historiques chargés sont gardés en mémoire (HISTORY_CACHE, TTL + LRU
+borné en octets) : des appels rapprochés de /run_test* avec la même
+fenêtre partagent un seul chargement.
+
+load_panel publie en plus le panel pivoté (MarketPanel) sous
+SHARED_PANEL_DIR : les autres workers / processus s'y rattachent en mmap
+lecture seule au lieu de recharger et repivoter l'historique.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import pandas as pd
+from google.cloud import bigquery
+
+from file_utils import FileLock as _FileLock, write_atomic as _write_atomic
+from market_panel import MarketPanel
+from memo_cache import MemoCache
+
+STORE_CFG = {
+    'STORE_DIR': os.environ.get('STOCKS_STORE_DIR', '/tmp/stocks_store'),
+    'SYNC_MIN_INTERVAL_S': int(os.environ.get('STOCKS_SYNC_MIN_INTERVAL_S', 300)),
+    'FULL_RESYNC_INTERVAL_S': int(os.environ.get('STOCKS_FULL_RESYNC_S', 7 * 86400)),   # rechargement complet périodique
+    'CACHE_TTL_S': int(os.environ.get('STOCKS_CACHE_TTL_S', 300)),
+    'CACHE_MAX_MB': int(os.environ.get('STOCKS_CACHE_MAX_MB', 512)),
+    # Panels partagés entre workers (vide = désactivé)
+    'SHARED_PANEL_DIR': os.environ.get(
+        'STOCKS_SHARED_PANEL_DIR',
+        '/dev/shm/stocks_panels' if os.path.isdir('/dev/shm') else ''
+    ),
+}
+
+# Colonnes réellement utilisées par alpha4 / alpha_engine_v3 / run_vlab_backtest_full
+STORE_COLUMNS = ['Date', 'Ticker', 'High', 'Low', 'Close', 'Volume']
+NUMERIC_COLUMNS = ['High', 'Low', 'Close', 'Volume']
+
+_MANIFEST = '_manifest.json'
+
+_CLIENTS = {}
+_CLIENTS_GUARD = threading.Lock()
+
+HISTORY_CACHE = MemoCache(
+    max_bytes=STORE_CFG['CACHE_MAX_MB'] * 1024 * 1024,
+    ttl_s=STORE_CFG['CACHE_TTL_S'],
+    name='history'
+)
+
+
+# ===========================
+# Fonctions utilitaires
+# ===========================
+
+def get_client(project):
+    """Client BigQuery partagé par projet (thread-safe, réutilisé entre requêtes)."""
+    with _CLIENTS_GUARD:
+        client = _CLIENTS.get(project)
+        if client is None:
+            client = _CLIENTS[project] = bigquery.Client(project=project)
+        return client
+
+
+def normalize_history(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalisation commune : Date tz-naive, colonnes numériques,
+    dédoublonnage (Ticker, Date) en gardant la dernière ligne reçue.
+
+    Les doublons retirés restent comptés dans attrs['duplicate_dates']
+    ({ticker: {'YYYY-MM-DD': lignes en trop}}) : le rapport qualité
+    (Bars.quality) les voit même si les barres arrivent déjà propres.
+    """
+    df = df.copy()
+    df['Date'] = pd.to_datetime(df['Date']).dt.tz_localize(None)
+
+    for c in NUMERIC_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce').astype(float)
+
+    dup = df.duplicated(subset=['Ticker', 'Date'], keep='last').to_numpy()
+    out = df[~dup]
+    out.attrs['duplicate_dates'] = _duplicate_dates(df[dup])
+    return out
+
+
+def _duplicate_dates(rows: pd.DataFrame):
+    """{ticker: {'YYYY-MM-DD': n}} des lignes écartées comme doublons."""
+    out = {}
+    if not len(rows):
+        return out
+    counts = rows.groupby([rows['Ticker'].astype(str), rows['Date'].dt.strftime('%Y-%m-%d')]).size()
+    for (t, day), n in counts.items():
+        out.setdefault(t, {})[day] = int(n)
+    return out
+
+
+def duplicate_counts(df: pd.DataFrame, start_date=None):
+    """{ticker: doublons retirés} d'une table chargée (attrs['duplicate_dates']), limités à la fenêtre."""
+    start = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else None
+    return {
+        t: sum(n for day, n in days.items() if start is None or day >= start)
+        for t, days in df.attrs.get('duplicate_dates', {}).items()
+    }
+
+
+def _table_dir(dataset, table, store_dir=None):
+    return os.path.join(store_dir or STORE_CFG['STORE_DIR'], f"{dataset}.{table}")
+
+
+def _ticker_path(tdir, ticker):
+    return os.path.join(tdir, quote(str(ticker), safe='') + '.parquet')
+
+
+def _read_manifest(tdir):
+    path = os.path.join(tdir, _MANIFEST)
+    if not os.path.exists(path):
+        return {'last_date': None, 'synced_at': 0.0, 'tickers': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(tdir, manifest):
+    def _dump(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    _write_atomic(os.path.join(tdir, _MANIFEST), _dump)
+
+
+# ===========================
+# Requêtes BigQuery (projection + prédicats)
+# ===========================
+
+def build_history_query(dataset, table, tickers=None, start_date=None, min_rows=None,
+                        keep_tickers=(), columns=STORE_COLUMNS, order_by=None):
+    """
+    Construit la requête d'historique avec les filtres poussés côté BigQuery.
+
+    - tickers      : liste blanche (None = tous)
+    - start_date   : Date >= start_date
+    - min_rows     : ne garde que les tickers ayant au moins min_rows dates
+                     distinctes dans la fenêtre (sauf keep_tickers, ex. l'indice)
+
+    Pas d'ORDER BY par défaut : un résultat trié force un seul stream
+    Storage API, le tri est refait localement (order_by pour le mode streaming).
+
+    Retourne (sql, query_parameters).
+    """
+    src = f"`{dataset}.{table}`"
+    where = []
+    params = []
+
+    if start_date is not None:
+        where.append("Date >= @start_date")
+        params.append(bigquery.ScalarQueryParameter('start_date', 'DATE', pd.Timestamp(start_date).date()))
+
+    if tickers is not None:
+        where.append("Ticker IN UNNEST(@tickers)")
+        params.append(bigquery.ArrayQueryParameter('tickers', 'STRING', sorted(set(map(str, tickers)))))
+
+    if min_rows:
+        having = (
+            f"SELECT Ticker FROM {src}"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " GROUP BY Ticker HAVING COUNT(DISTINCT Date) >= @min_rows"
+        )
+        cond = f"Ticker IN ({having})"
+        if keep_tickers:
+            cond = f"(Ticker IN UNNEST(@keep_tickers) OR {cond})"
+            params.append(bigquery.ArrayQueryParameter('keep_tickers', 'STRING', sorted(set(map(str, keep_tickers)))))
+        params.append(bigquery.ScalarQueryParameter('min_rows', 'INT64', int(min_rows)))
+        where.append(cond)
+
+    sql = f"SELECT {', '.join(columns)} FROM {src}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+
+    return sql, params
+
+
+def _bqstorage_client():
+    """Client Storage Read API si la librairie est installée, sinon None (pages REST)."""
+    try:
+        from google.cloud import bigquery_storage
+    except ImportError:
+        return None
+    return bigquery_storage.BigQueryReadClient()
+
+
+def run_history_query(project, sql, params=()) -> pd.DataFrame:
+    """Exécute la requête et rapatrie le résultat en Arrow (Storage Read API si disponible)."""
+    client = get_client(project)
+    job_config = bigquery.QueryJobConfig(query_parameters=list(params))
+    table = client.query(sql, job_config=job_config).to_arrow(create_bqstorage_client=True)
+    return table.to_pandas()
+
+
+# ===========================
+# Synchronisation BigQuery -> store
+# ===========================
+
+def _store_rows(tdir, manifest, new_rows, replace=False):
+    """
+    Écrit les lignes reçues dans les fichiers par ticker et met à jour le
+    manifest. replace=True : l'historique reçu remplace celui du store
+    (ticker rechargé en entier) au lieu d'être fusionné.
+    """
+    new_rows = normalize_history(new_rows[STORE_COLUMNS])
+    new_dups = new_rows.attrs['duplicate_dates']
+    new_rows = new_rows[new_rows['Ticker'].notna() & new_rows['Date'].notna()]
+
+    for ticker, chunk in new_rows.groupby('Ticker', sort=False):
+        path = _ticker_path(tdir, ticker)
+        chunk = chunk.drop(columns=['Ticker'])
+
+        # un fichier hors manifest (ticker retiré puis revenu) n'est jamais fusionné
+        if not replace and str(ticker) in manifest['tickers'] and os.path.exists(path):
+            old = pd.read_parquet(path)
+            chunk = pd.concat([old, chunk], ignore_index=True)
+
+        chunk = (
+            chunk.drop_duplicates(subset=['Date'], keep='last')
+            .sort_values('Date', kind='stable')
+            .reset_index(drop=True)
+        )
+        _write_atomic(path, lambda tmp, c=chunk: c.to_parquet(tmp, index=False))
+
+        # doublons de la source par date (la dernière journée relue n'est pas recomptée)
+        dups = {} if replace else dict((manifest['tickers'].get(str(ticker)) or {}).get('duplicate_dates') or {})
+        dups.update(new_dups.get(str(ticker), {}))
+
+        manifest['tickers'][str(ticker)] = {
+            'rows': int(len(chunk)),
+            'first_date': chunk['Date'].iloc[0].strftime('%Y-%m-%d'),
+            'last_date': chunk['Date'].iloc[-1].strftime('%Y-%m-%d'),
+            'duplicate_dates': dups,
+        }
+
+    if len(new_rows):
+        max_date = new_rows['Date'].max().strftime('%Y-%m-%d')
+        if not manifest.get('last_date') or max_date > manifest['last_date']:
+            manifest['last_date'] = max_date
+
+
+def remote_ticker_stats(project, dataset, table, tickers=None, start_date=None, min_rows=None, keep_tickers=()):
+    """
+    {ticker: {'rows', 'first_date', 'last_date'}} calculé par BigQuery
+    (agrégat GROUP BY sur Ticker / Date seulement, aucun prix rapatrié).
+    """
+    sql, params = build_history_query(
+        dataset, table,
+        tickers=tickers,
+        start_date=start_date,
+        min_rows=min_rows,
+        keep_tickers=keep_tickers,
+        columns=['Ticker', 'Date']
+    )
+    sql = (
+        "SELECT Ticker, COUNT(DISTINCT Date) AS n_rows, MIN(Date) AS first_date, MAX(Date) AS last_date"
+        f" FROM ({sql}) WHERE Ticker IS NOT NULL AND Date IS NOT NULL GROUP BY Ticker"
+    )
+    out = {}
+    for row in run_history_query(project, sql, params).itertuples(index=False):
+        out[str(row.Ticker)] = {
+            'rows': int(row.n_rows),
+            'first_date': pd.Timestamp(row.first_date).strftime('%Y-%m-%d'),
+            'last_date': pd.Timestamp(row.last_date).strftime('%Y-%m-%d'),
+        }
+    return dict(sorted(out.items()))
+
+
+def _stale_tickers(manifest, remote):
+    """Tickers dont le store ne reflète plus la source (absents, complétés ou amputés en amont)."""
+    out = []
+    for t, r in remote.items():
+        m = manifest['tickers'].get(t)
+        if m is None or any(m.get(k) != r[k] for k in ('rows', 'first_date', 'last_date')):
+            out.append(t)
+    return out
+
+
+def sync_table(project, dataset, table, store_dir=None, force=False, full=False):
+    """
+    Met à jour le store local depuis BigQuery.
+
+    - force : ignore SYNC_MIN_INTERVAL_S
+    - full  : repart de zéro (rechargement complet de la table) ; imposé
+              tous les FULL_RESYNC_INTERVAL_S pour reprendre les barres
+              anciennes corrigées en place dans la source
+
+    Incrémental : lignes à partir de la dernière date stockée, puis
+    réconciliation par ticker avec les statistiques BigQuery (nombre de
+    dates, première / dernière date). Un ticker absent du store (nouveau,
+    avec son historique) ou dont l'historique a été complété ou amputé en
+    amont est rechargé en entier ; un ticker disparu de la source est retiré.
+
+    Retourne le manifest à jour.
+    """
+    tdir = _table_dir(dataset, table, store_dir)
+    os.makedirs(tdir, exist_ok=True)
+
+    with _FileLock(os.path.join(tdir, '.lock')):
+        manifest = _read_manifest(tdir)
+        now = time.time()
+        if now - float(manifest.get('full_synced_at', 0.0)) > STORE_CFG['FULL_RESYNC_INTERVAL_S']:
+            full = True
+        if full:
+            manifest = {'last_date': None, 'synced_at': 0.0, 'tickers': {}}
+
+        age = now - float(manifest.get('synced_at', 0.0))
+        if not force and manifest.get('last_date') and age < STORE_CFG['SYNC_MIN_INTERVAL_S']:
+            return manifest
+
+        sql, params = build_history_query(dataset, table, start_date=manifest.get('last_date'))
+        new_rows = run_history_query(project, sql, params)
+        if len(new_rows):
+            _store_rows(tdir, manifest, new_rows, replace=full)
+
+        if full:
+            manifest['full_synced_at'] = now
+        else:
+            remote = remote_ticker_stats(project, dataset, table)
+            stale = _stale_tickers(manifest, remote)
+            if stale:
+                sql, params = build_history_query(dataset, table, tickers=stale)
+                _store_rows(tdir, manifest, run_history_query(project, sql, params), replace=True)
+
+            for t in sorted(set(manifest['tickers']) - set(remote)):
+                del manifest['tickers'][t]
+            manifest['reconciled'] = stale
+
+        # fichiers des tickers retirés de la source (ou absents d'un rechargement complet)
+        kept = {os.path.basename(_ticker_path(tdir, t)) for t in manifest['tickers']}
+        for name in os.listdir(tdir):
+            if name.endswith('.parquet') and name not in kept:
+                os.remove(os.path.join(tdir, name))
+
+        manifest['synced_at'] = now
+        _write_manifest(tdir, manifest)
+
+    return manifest
+
+
+# ===========================
+# Lecture
+# ===========================
+
+def read_table(dataset, table, tickers=None, start_date=None, min_rows=None,
+               keep_tickers=(), columns=STORE_COLUMNS, store_dir=None) -> pd.DataFrame:
+    """
+    Lit le store local (format long), trié par Date, avec les mêmes filtres
+    que build_history_query. tickers=None -> tous les tickers présents.
+    Les doublons écartés à la synchronisation sont rendus dans
+    attrs['duplicate_dates'] (voir normalize_history).
+    """
+    tdir = _table_dir(dataset, table, store_dir)
+    manifest = _read_manifest(tdir)
+
+    names = sorted(manifest['tickers']) if tickers is None else [t for t in tickers if t in manifest['tickers']]
+    filters = [('Date', '>=', pd.Timestamp(start_date))] if start_date is not None else None
+    file_cols = [c for c in columns if c != 'Ticker']
+
+    start = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else None
+    frames = []
+    dups = {}
+    for t in names:
+        d = pd.read_parquet(_ticker_path(tdir, t), columns=file_cols, filters=filters)
+        if min_rows and t not in keep_tickers and len(d) < min_rows:
+            continue
+        if len(d):
+            d.insert(1, 'Ticker', t)
+            frames.append(d)
+            days = {
+                day: n for day, n in (manifest['tickers'][t].get('duplicate_dates') or {}).items()
+                if start is None or day >= start
+            }
+            if days:
+                dups[t] = days
+
+    if not frames:
+        return pd.DataFrame(columns=list(columns))
+
+    out = pd.concat(frames, ignore_index=True)
+    out = out.sort_values('Date', kind='stable').reset_index(drop=True)
+    out.attrs['duplicate_dates'] = dups
+    return out
+
+
+def stored_tickers(dataset, table, store_dir=None):
+    return sorted(_read_manifest(_table_dir(dataset, table, store_dir))['tickers'])
+
+
+def store_revision(project, dataset, table, store_dir=None, sync=True):
+    """
+    Version du contenu du store : dernière date + empreinte des statistiques
+    par ticker (change dès que des barres arrivent ou qu'un ticker est
+    rechargé). sync=True synchronise d'abord (au plus tous les SYNC_MIN_INTERVAL_S).
+    """
+    if sync:
+        manifest = sync_table(project, dataset, table, store_dir=store_dir)
+    else:
+        manifest = _read_manifest(_table_dir(dataset, table, store_dir))
+    blob = json.dumps(manifest['tickers'], sort_keys=True).encode('utf-8')
+    return f"{manifest.get('last_date')}-{hashlib.blake2b(blob, digest_size=8).hexdigest()}"
+
+
+def history_stats(project, dataset, table, tickers=None, start_date=None, min_rows=None,
+                  keep_tickers=(), use_store=True, store_dir=None):
+    """
+    {ticker: {'rows', 'first_date', 'last_date'}} dans la fenêtre, mêmes filtres
+    que load_history, sans charger les prix (colonne Date seule, un ticker à
+    la fois ; agrégat GROUP BY côté BigQuery). Sert aux poids des shards et
+    à la version des données en mode streaming.
+    """
+    out = {}
+
+    if use_store:
+        sync_table(project, dataset, table, store_dir=store_dir)
+        tdir = _table_dir(dataset, table, store_dir)
+        manifest = _read_manifest(tdir)
+        names = sorted(manifest['tickers']) if tickers is None else sorted(t for t in set(tickers) if t in manifest['tickers'])
+        filters = [('Date', '>=', pd.Timestamp(start_date))] if start_date is not None else None
+
+        for t in names:
+            dates = pd.read_parquet(_ticker_path(tdir, t), columns=['Date'], filters=filters)['Date']
+            if not len(dates) or (min_rows and t not in keep_tickers and len(dates) < min_rows):
+                continue
+            out[t] = {
+                'rows': int(len(dates)),
+                'first_date': dates.min().strftime('%Y-%m-%d'),
+                'last_date': dates.max().strftime('%Y-%m-%d'),
+            }
+        return out
+
+    return remote_ticker_stats(project, dataset, table, tickers=tickers, start_date=start_date,
+                               min_rows=min_rows, keep_tickers=keep_tickers)
+
+
+def _ticker_frame(ticker, rows: pd.DataFrame, duplicates=0) -> pd.DataFrame:
+    """Frame d'un ticker ; attrs['duplicate_dates'] : doublons déjà écartés + ceux retirés ici."""
+    d = (
+        rows.drop(columns=['Ticker'], errors='ignore')
+        .drop_duplicates(subset=['Date'], keep='last')
+        .set_index('Date')
+        .sort_index()
+    )
+    d.attrs['Ticker'] = ticker
+    d.attrs['duplicate_dates'] = int(duplicates) + len(rows) - len(d)
+    return d
+
+
+def iter_history_by_ticker(project, dataset, table, tickers=None, start_date=None, min_rows=None,
+                           keep_tickers=(), use_store=True, store_dir=None):
+    """
+    Mode streaming : produit (ticker, DataFrame indexé par Date) un ticker
+    à la fois, dans l'ordre alphabétique, sans jamais matérialiser la table
+    complète. Rien n'est mis en cache.
+
+    - store local : un fichier Parquet lu à la fois
+    - BigQuery    : ORDER BY Ticker, Date lu par lots Arrow ; un ticker est
+                    émis dès que le lot suivant passe au ticker suivant
+    """
+    if use_store:
+        sync_table(project, dataset, table, store_dir=store_dir)
+        names = stored_tickers(dataset, table, store_dir) if tickers is None else sorted(set(tickers))
+        for t in names:
+            d = read_table(dataset, table, tickers=[t], start_date=start_date, min_rows=min_rows,
+                           keep_tickers=keep_tickers, store_dir=store_dir)
+            if len(d):
+                yield t, _ticker_frame(t, d, duplicates=duplicate_counts(d).get(t, 0))
+        return
+
+    sql, params = build_history_query(
+        dataset, table,
+        tickers=tickers,
+        start_date=start_date,
+        min_rows=min_rows,
+        keep_tickers=keep_tickers,
+        order_by='Ticker, Date'
+    )
+    job_config = bigquery.QueryJobConfig(query_parameters=list(params))
+    rows = get_client(project).query(sql, job_config=job_config).result()
+
+    pending = None
+    dups = {}
+    for batch in rows.to_arrow_iterable(bqstorage_client=_bqstorage_client()):
+        chunk = normalize_history(batch.to_pandas())
+        for t, n in duplicate_counts(chunk).items():
+            dups[t] = dups.get(t, 0) + n
+        chunk = chunk[chunk['Ticker'].notna()]
+        if not len(chunk):
+            continue
+
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+
+        # toutes les lignes sauf celles du dernier ticker du lot sont complètes
+        last = chunk['Ticker'].iloc[-1]
+        is_last = (chunk['Ticker'] == last).to_numpy()
+        complete, pending = chunk[~is_last], chunk[is_last]
+
+        for t, rows_t in complete.groupby('Ticker', sort=False):
+            yield t, _ticker_frame(t, rows_t, duplicates=dups.pop(str(t), 0))
+
+    if pending is not None and len(pending):
+        t = pending['Ticker'].iloc[0]
+        yield t, _ticker_frame(t, pending, duplicates=dups.pop(str(t), 0))
+
+
+# ===========================
+# Point d'entrée des moteurs
+# ===========================
+
+def _history_key(project, dataset, table, tickers, start_date, min_rows, keep_tickers, use_store, store_dir):
+    return (
+        project, dataset, table,
+        tuple(sorted(set(tickers))) if tickers is not None else None,
+        pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else None,
+        int(min_rows) if min_rows else None,
+        tuple(sorted(set(keep_tickers))),
+        bool(use_store),
+        store_dir,
+    )
+
+
+def _load_history_uncached(project, dataset, table, tickers=None, start_date=None, min_rows=None,
+                           keep_tickers=(), use_store=True, store_dir=None) -> pd.DataFrame:
+    if use_store:
+        sync_table(project, dataset, table, store_dir=store_dir)
+        return read_table(
+            dataset, table,
+            tickers=tickers,
+            start_date=start_date,
+            min_rows=min_rows,
+            keep_tickers=keep_tickers,
+            store_dir=store_dir
+        )
+
+    sql, params = build_history_query(
+        dataset, table,
+        tickers=tickers,
+        start_date=start_date,
+        min_rows=min_rows,
+        keep_tickers=keep_tickers
+    )
+    df = normalize_history(run_history_query(project, sql, params))
+    dups = df.attrs['duplicate_dates']
+    df = df.sort_values('Date', kind='stable').reset_index(drop=True)
+    df.attrs['duplicate_dates'] = dups
+    return df
+
+
+def load_history(project, dataset, table, tickers=None, start_date=None, min_rows=None,
+                 keep_tickers=(), use_store=True, store_dir=None) -> pd.DataFrame:
+    """
+    Historique normalisé (format long) pour les moteurs de backtest.
+
+    use_store=True  : sync incrémentale puis lecture du store Parquet local
+    use_store=False : requête BigQuery directe (filtres poussés dans le SQL)
+
+    Le résultat est mis en cache (HISTORY_CACHE) par (table, tickers, fenêtre) :
+    ne pas le modifier en place.
+    """
+    args = (project, dataset, table, tickers, start_date, min_rows, keep_tickers, use_store, store_dir)
+    return HISTORY_CACHE.get_or_load(_history_key(*args), lambda: _load_history_uncached(*args))
+
+
+# ===========================
+# Panel partagé entre workers
+# ===========================
+
+def _attach_fresh_panel(path, max_age_s, not_before=None):
+    manifest = MarketPanel.read_manifest(path)
+    if manifest is None:
+        return None
+    created_at = float(manifest.get('created_at', 0.0))
+    if time.time() - created_at > max_age_s or (not_before is not None and created_at < not_before):
+        return None
+    return MarketPanel.attach(path)
+
+
+def _prune_shared_panels(root, max_age_s):
+    """Supprime les panels périmés (les processus encore rattachés gardent leur mmap)."""
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if '.' in name or not (os.path.isdir(path) or os.path.islink(path)):
+            continue
+        manifest = MarketPanel.read_manifest(path)
+        if manifest is None or time.time() - float(manifest.get('created_at', 0.0)) > max_age_s:
+            MarketPanel.remove(path)
+
+
+def load_panel(project, dataset, table, tickers=None, start_date=None, min_rows=None,
+               keep_tickers=(), use_store=True, store_dir=None, refresh=False) -> MarketPanel:
+    """
+    Panel dates x tickers (MarketPanel) pour la fenêtre demandée.
+
+    Si SHARED_PANEL_DIR est défini, le premier worker qui le construit le
+    publie en .npy ; les autres (workers gunicorn, processus du pool) s'y
+    rattachent en mmap lecture seule tant qu'il a moins de CACHE_TTL_S.
+
+    refresh=True ignore le cache mémoire et les panels publiés avant l'appel
+    (rafraîchissement planifié) ; un panel publié entre-temps par un autre
+    worker est réutilisé.
+    """
+    args = (project, dataset, table, tickers, start_date, min_rows, keep_tickers, use_store, store_dir)
+    key = _history_key(*args)
+    not_before = time.time() if refresh else None
+
+    if refresh:
+        HISTORY_CACHE.invalidate(lambda k: k == ('panel',) + key or k == key)
+        if use_store:
+            sync_table(project, dataset, table, store_dir=store_dir, force=True)
+
+    def _build():
+        root = STORE_CFG['SHARED_PANEL_DIR']
+        if not root:
+            return MarketPanel.from_long(_load_history_uncached(*args))
+
+        ttl = STORE_CFG['CACHE_TTL_S']
+        path = os.path.join(root, hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20])
+
+        panel = _attach_fresh_panel(path, ttl, not_before)
+        if panel is not None:
+            return panel
+
+        os.makedirs(root, exist_ok=True)
+        with _FileLock(path + '.lock'):
+            # un autre worker a pu le publier pendant l'attente du verrou
+            panel = _attach_fresh_panel(path, ttl, not_before)
+            if panel is None:
+                MarketPanel.from_long(_load_history_uncached(*args)).publish(path, meta={'key': repr(key)})
+                _prune_shared_panels(root, 2 * ttl)
+                panel = MarketPanel.attach(path)
+
+        return panel
+
+    return HISTORY_CACHE.get_or_load(('panel',) + key, _build)
+
+# ==== END market_store.py
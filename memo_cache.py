@@ -0,0 +1,196 @@
+# ==== START memo_cache.py
+"""
+Cache mémoire process-wide : TTL + LRU borné en octets + single-flight.
+
+Plusieurs threads gunicorn qui demandent la même clé en même temps
+partagent un seul chargement : le premier exécute loader(), les autres
+attendent son résultat (ou son exception).
+
+Les valeurs sont partagées entre requêtes : ne pas les modifier en place.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def estimate_nbytes(value):
+    """Taille mémoire approximative d'une valeur mise en cache."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        mem = value.memory_usage(deep=True)
+        return int(mem.sum()) if isinstance(value, pd.DataFrame) else int(mem)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values()) + sys.getsizeof(value)
+    return sys.getsizeof(value)
+
+
+class _Flight:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MemoCache:
+    """
+    max_bytes : budget mémoire total (éviction LRU au-delà)
+    ttl_s     : durée de vie d'une entrée (None = pas d'expiration)
+    """
+
+    def __init__(self, max_bytes, ttl_s=None, name='cache'):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = ttl_s
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._items = OrderedDict()     # key -> (expires_at, nbytes, value)
+        self._inflight = {}             # key -> _Flight
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.shared_loads = 0
+        self.evictions = 0
+
+    # ---------------------------
+    # Accès
+    # ---------------------------
+
+    def get(self, key, default=None, count=False):
+        """
+        count=True : un défaut compte comme miss, une valeur comme hit.
+        Un appelant qui consulte un niveau suivant (disque) passe plutôt
+        count=False puis appelle count() avec le résultat final.
+        """
+        _missing = object()
+        with self._lock:
+            value = self._get_locked(key, _missing)
+            if count:
+                self._count_locked(value is not _missing)
+        return default if value is _missing else value
+
+    def count(self, hit):
+        """Compte un accès résolu hors du cache (hit ou miss), sous le verrou."""
+        with self._lock:
+            self._count_locked(hit)
+
+    def _count_locked(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _get_locked(self, key, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+
+        expires_at, nbytes, value = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._items[key]
+            self._bytes -= nbytes
+            return default
+
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value, nbytes=None):
+        nbytes = estimate_nbytes(value) if nbytes is None else int(nbytes)
+        if nbytes > self.max_bytes:
+            return value
+
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else None
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._items[key] = (expires_at, nbytes, value)
+            self._bytes += nbytes
+
+            while self._bytes > self.max_bytes and self._items:
+                _, (_, old_bytes, _) = self._items.popitem(last=False)
+                self._bytes -= old_bytes
+                self.evictions += 1
+
+        return value
+
+    def get_or_load(self, key, loader):
+        """
+        Retourne la valeur en cache, sinon la charge une seule fois
+        même si plusieurs threads la demandent en parallèle.
+        """
+        _missing = object()
+
+        with self._lock:
+            value = self._get_locked(key, _missing)
+            if value is not _missing:
+                self.hits += 1
+                return value
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.misses += 1
+            else:
+                self.shared_loads += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self.put(key, loader())
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    # ---------------------------
+    # Maintenance
+    # ---------------------------
+
+    def invalidate(self, predicate=None):
+        """Supprime toutes les entrées (ou celles dont la clé vérifie predicate)."""
+        with self._lock:
+            for key in list(self._items):
+                if predicate is None or predicate(key):
+                    self._bytes -= self._items.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'entries': len(self._items),
+                'bytes': int(self._bytes),
+                'max_bytes': self.max_bytes,
+                'ttl_s': self.ttl_s,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared_loads': self.shared_loads,
+                'evictions': self.evictions,
+                'in_flight': len(self._inflight),
+            }
+
+# ==== END memo_cache.py
@@ -0,0 +1,735 @@
+# ==== START online_indicators.py
+"""
+État d'indicateurs incrémental : une nouvelle barre journalière coûte O(1).
+
+Chaque objet garde juste ce qu'il faut pour avancer d'une barre (sommes
+glissantes, tampon circulaire des dernières valeurs, fenêtre de pivots en
+attente, derniers pivots H/L) et produit exactement les mêmes valeurs que
+le calcul batch (indicators.py / feature_engine.v4_base_matrices) :
+
+  - les fenêtres glissantes reproduisent pas à pas les noyaux rolling de
+    pandas (somme de Kahan, moyenne avec garde de signe, variance de
+    Welford, repli « valeurs identiques ») : résultats bit-identiques ;
+  - la structure rejoue l'étiquetage incrémental de structure_codes ;
+  - la RS lit l'indice dans un IndexState partagé (dernières barres).
+
+Les états sont sérialisables (to_dict / from_dict, JSON-compatibles).
+Amorçage : V4TickerState.from_bars rejoue l'historique une fois ; ensuite
+update() à chaque nouvelle barre.
+
+Première étape, bibliothèque seule : aucun chemin de rafraîchissement
+(refresh_scheduler, market_store.sync_table) ne persiste ni n'avance encore
+ces états ; alpha4 recalcule ses indicateurs en batch. parity_check
+(et `python online_indicators.py`) vérifie l'égalité bit à bit avec
+feature_engine.v4_base_matrices, reprise JSON en cours d'historique comprise.
+
+Les noyaux rolling recopiés suivent la version de pandas épinglée dans
+requirements.txt (PANDAS_VERSION) : la parité est vérifiée au build de
+l'image (Dockerfile) et, si une autre version est installée, une fois par
+processus à la création du premier état (RuntimeError en cas d'écart).
+"""
+
+import bisect
+import json
+import math
+import sys
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import feature_engine
+import indicators
+from bars import Bars
+
+_NAN = float('nan')
+
+# version de pandas dont les noyaux rolling sont reproduits (requirements.txt)
+PANDAS_VERSION = '3.0.6'
+
+_PARITY = {'checked': False, 'error': None}
+_PARITY_GUARD = threading.RLock()
+
+
+def _div(a, b):
+    # division IEEE (comme numpy) : x/0 -> ±inf, 0/0 -> NaN
+    if b == 0:
+        if a == 0 or a != a:
+            return _NAN
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+def _fmax(a, b):
+    # np.fmax : NaN ignoré
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a >= b else b
+
+
+# ===========================
+# Fenêtres glissantes (noyaux rolling pandas, fenêtre fixe)
+# ===========================
+
+class _Rolling:
+    """
+    Base commune : tampon des `p` dernières valeurs et cycle
+    réinitialisation / retrait / ajout identique à pandas (fenêtre fixe,
+    bornes monotones : la valeur sortante est retirée avant l'ajout).
+    """
+
+    __slots__ = ('p', 'min_periods', 'buf', 'count', 'nobs', 'comp_add', 'comp_remove',
+                 'n_same', 'prev_value')
+
+    _STATE = ('count', 'nobs', 'comp_add', 'comp_remove', 'n_same', 'prev_value')
+
+    def __init__(self, p, min_periods=None):
+        self.p = int(p)
+        self.min_periods = self.p if min_periods is None else int(min_periods)
+        self.buf = deque(maxlen=self.p)
+        self.count = 0
+        self._reset(_NAN)
+
+    def _reset(self, first):
+        self.nobs = 0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.n_same = 0
+        self.prev_value = first
+
+    def _same(self, val):
+        # repli pandas : n valeurs consécutives identiques -> résultat exact
+        if val == self.prev_value:
+            self.n_same += 1
+        else:
+            self.n_same = 1
+        self.prev_value = val
+
+    def update(self, val):
+        val = float(val)
+        i = self.count
+        start = max(0, i + 1 - self.p)
+        if i == 0 or start >= i:
+            self._reset(val)
+        elif i >= self.p:
+            self._remove(self.buf[0])
+        self._add(val)
+
+        self.buf.append(val)
+        self.count += 1
+        return self._value()
+
+    def to_dict(self):
+        d = {k: getattr(self, k) for k in self._STATE}
+        d.update(p=self.p, min_periods=self.min_periods, buf=list(self.buf))
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        obj = cls(d['p'], d['min_periods'])
+        obj.buf.extend(float(v) for v in d['buf'])
+        for k in cls._STATE:
+            setattr(obj, k, d[k])
+        return obj
+
+
+class RollingSum(_Rolling):
+    """Series.rolling(p, min_periods).sum()"""
+
+    __slots__ = ('sum_x',)
+    _STATE = _Rolling._STATE + ('sum_x',)
+
+    def _reset(self, first):
+        super()._reset(first)
+        self.sum_x = 0.0
+
+    def _add(self, val):
+        if val != val:
+            return
+        self.nobs += 1
+        y = val - self.comp_add
+        t = self.sum_x + y
+        self.comp_add = t - self.sum_x - y
+        self.sum_x = t
+        self._same(val)
+
+    def _remove(self, val):
+        if val != val:
+            return
+        self.nobs -= 1
+        y = -val - self.comp_remove
+        t = self.sum_x + y
+        self.comp_remove = t - self.sum_x - y
+        self.sum_x = t
+
+    def _value(self):
+        if self.nobs == 0 == self.min_periods:
+            return 0.0
+        if self.nobs >= self.min_periods:
+            if self.n_same >= self.nobs:
+                return self.prev_value * self.nobs
+            return self.sum_x
+        return _NAN
+
+
+class RollingMean(_Rolling):
+    """Series.rolling(p, min_periods).mean()"""
+
+    __slots__ = ('sum_x', 'neg_ct')
+    _STATE = _Rolling._STATE + ('sum_x', 'neg_ct')
+
+    def _reset(self, first):
+        super()._reset(first)
+        self.sum_x = 0.0
+        self.neg_ct = 0
+
+    def _add(self, val):
+        if val != val:
+            return
+        self.nobs += 1
+        y = val - self.comp_add
+        t = self.sum_x + y
+        self.comp_add = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, val) < 0:
+            self.neg_ct += 1
+        self._same(val)
+
+    def _remove(self, val):
+        if val != val:
+            return
+        self.nobs -= 1
+        y = -val - self.comp_remove
+        t = self.sum_x + y
+        self.comp_remove = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, val) < 0:
+            self.neg_ct -= 1
+
+    def _value(self):
+        if self.nobs >= self.min_periods and self.nobs > 0:
+            result = self.sum_x / self.nobs
+            if self.n_same >= self.nobs:
+                return self.prev_value
+            if self.neg_ct == 0 and result < 0:
+                return 0.0
+            if self.neg_ct == self.nobs and result > 0:
+                return 0.0
+            return result
+        return _NAN
+
+
+# seuil pandas de perte de précision (somme des carrés qui s'effondre) : recalcul de la fenêtre
+_INV_COND_TOL = np.finfo(np.float64).eps * 1e3
+
+
+class RollingStd(_Rolling):
+    """
+    Series.rolling(p, min_periods).std(ddof) : Welford + Kahan comme pandas,
+    fenêtre recalculée quand la somme des carrés perd sa précision.
+    """
+
+    __slots__ = ('ddof', 'mean_x', 'ssqdm_x', 'unstable')
+    _STATE = _Rolling._STATE + ('mean_x', 'ssqdm_x', 'unstable')
+
+    def __init__(self, p, min_periods=None, ddof=1):
+        self.ddof = int(ddof)
+        super().__init__(p, min_periods)
+        self.min_periods = max(self.min_periods, 1)
+
+    def _reset(self, first):
+        super()._reset(first)
+        self.nobs = 0.0
+        self.mean_x = 0.0
+        self.ssqdm_x = 0.0
+        self.unstable = False
+
+    def _add(self, val):
+        if val != val:
+            return
+        prev_m2 = self.ssqdm_x
+        self.nobs += 1
+        prev_mean = self.mean_x - self.comp_add
+        y = val - self.comp_add
+        t = y - self.mean_x
+        self.comp_add = t + self.mean_x - y
+        self.mean_x = self.mean_x + t / self.nobs
+        self.ssqdm_x = self.ssqdm_x + (val - prev_mean) * (val - self.mean_x)
+        if prev_m2 * _INV_COND_TOL > self.ssqdm_x:
+            self.unstable = True
+
+    def _remove(self, val):
+        if val != val:
+            return
+        prev_m2 = self.ssqdm_x
+        self.nobs -= 1
+        if self.nobs:
+            prev_mean = self.mean_x - self.comp_remove
+            y = val - self.comp_remove
+            t = y - self.mean_x
+            self.comp_remove = t + self.mean_x - y
+            self.mean_x = self.mean_x - t / self.nobs
+            self.ssqdm_x = self.ssqdm_x - (val - prev_mean) * (val - self.mean_x)
+            if prev_m2 * _INV_COND_TOL > self.ssqdm_x:
+                self.unstable = True
+        else:
+            self.mean_x = 0.0
+            self.ssqdm_x = 0.0
+            self.unstable = False
+
+    def update(self, val):
+        out = super().update(val)
+        if not self.unstable:
+            return out
+        # recalcul sur la fenêtre courante (tampon), comme pandas
+        self._reset(_NAN)
+        for v in self.buf:
+            self._add(v)
+        self.unstable = False
+        return self._value()
+
+    def _value(self):
+        if self.nobs >= self.min_periods and self.nobs > self.ddof:
+            var = self.ssqdm_x / (self.nobs - self.ddof)
+            return 0.0 if var < 0 else math.sqrt(var)
+        return _NAN
+
+    def to_dict(self):
+        return dict(super().to_dict(), ddof=self.ddof)
+
+    @classmethod
+    def from_dict(cls, d):
+        obj = cls(d['p'], d['min_periods'], d['ddof'])
+        obj.buf.extend(float(v) for v in d['buf'])
+        for k in cls._STATE:
+            setattr(obj, k, d[k])
+        return obj
+
+# ===========================
+# Indice de référence (RS)
+# ===========================
+
+class IndexState:
+    """
+    Closes de l'indice (dates ns + valeurs), partagés par tous les tickers.
+    max_bars borne la mémoire (None = tout l'historique, pour l'amorçage) ;
+    il faut garder assez de barres pour que close[pos - lookback] reste
+    disponible quand un titre est en retard de quelques séances.
+    """
+
+    __slots__ = ('lookback', 'max_bars', 'count', 'dates', 'closes')
+
+    def __init__(self, lookback=indicators.RS_LOOKBACK, max_bars=None):
+        self.lookback = int(lookback)
+        self.max_bars = None if max_bars is None else max(int(max_bars), self.lookback + 1)
+        self.count = 0          # barres vues depuis le début (positions absolues)
+        self.dates = []         # int64 ns
+        self.closes = []
+
+    @classmethod
+    def from_series(cls, idx_close, lookback=indicators.RS_LOOKBACK, max_bars=None):
+        obj = cls(lookback, max_bars)
+        dates = idx_close.index.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        for d, c in zip(dates.tolist(), idx_close.to_numpy(dtype=float).tolist()):
+            obj.update(d, c)
+        return obj
+
+    def update(self, date, close):
+        self.dates.append(_ns(date))
+        self.closes.append(float(close))
+        self.count += 1
+        # purge amortie : on laisse le tampon doubler avant de couper
+        if self.max_bars is not None and len(self.dates) > 2 * self.max_bars:
+            del self.dates[:-self.max_bars]
+            del self.closes[:-self.max_bars]
+
+    def rs_pair(self, date):
+        """(close à la date, close `lookback` barres plus tôt) ou None si historique insuffisant."""
+        k = bisect.bisect_right(self.dates, _ns(date)) - 1
+        pos = self.count - len(self.dates) + k
+        if k < 0 or pos < self.lookback:
+            return None
+        if k < self.lookback:
+            raise ValueError("IndexState : historique de l'indice trop court (augmenter max_bars)")
+        return self.closes[k], self.closes[k - self.lookback]
+
+    def to_dict(self):
+        return {
+            'lookback': self.lookback, 'max_bars': self.max_bars, 'count': self.count,
+            'dates': list(self.dates), 'closes': list(self.closes),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        obj = cls(d['lookback'], d['max_bars'])
+        obj.count = d['count']
+        obj.dates = [int(v) for v in d['dates']]
+        obj.closes = [float(v) for v in d['closes']]
+        return obj
+
+
+def _ns(date):
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    return int(np.datetime64(date, 'ns').astype(np.int64))
+
+
+# ===========================
+# Structure de marché (pivots + étiquetage)
+# ===========================
+
+class StructureState:
+    """
+    Pivots stricts (noyau GAS) sur une fenêtre de 2w+1 barres : le pivot
+    candidat au centre devient visible à la barre courante ; étiquetage
+    incrémental identique à indicators.structure_codes.
+    """
+
+    __slots__ = ('w', 'last_pivots', 'highs', 'lows', 'n_pivots', 'last_h', 'last_l', 'code')
+
+    def __init__(self, w=3, last_pivots=15):
+        self.w = int(w)
+        self.last_pivots = int(last_pivots)
+        self.highs = deque(maxlen=2 * self.w + 1)
+        self.lows = deque(maxlen=2 * self.w + 1)
+        self.n_pivots = 0
+        self.last_h = [None, None]      # [rang, valeur] avant-dernier, dernier
+        self.last_l = [None, None]
+        self.code = indicators.STRUCT_ND
+
+    def update(self, high, low):
+        self.highs.append(float(high))
+        self.lows.append(float(low))
+        if len(self.highs) == self.highs.maxlen:
+            w = self.w
+            c_h, c_l = self.highs[w], self.lows[w]
+            # comparaisons False avec NaN : voisin NaN ignoré, centre NaN = pivot
+            if not any(v >= c_h for k, v in enumerate(self.highs) if k != w):
+                self._push(indicators.PIVOT_H, c_h)
+            if not any(v <= c_l for k, v in enumerate(self.lows) if k != w):
+                self._push(indicators.PIVOT_L, c_l)
+        return self.code
+
+    def _push(self, kind, value):
+        if kind == indicators.PIVOT_H:
+            self.last_h = [self.last_h[1], [self.n_pivots, value]]
+        else:
+            self.last_l = [self.last_l[1], [self.n_pivots, value]]
+        self.n_pivots += 1
+
+        start = indicators._window_start(self.n_pivots, self.last_pivots)
+        h, l = self.last_h, self.last_l
+        if h[0] is None or l[0] is None or h[0][0] < start or l[0][0] < start:
+            self.code = indicators.STRUCT_ND
+        else:
+            hh = h[1][1] > h[0][1]
+            hl = l[1][1] > l[0][1]
+            self.code = 1 + 2 * (not hh) + (not hl)
+
+    def to_dict(self):
+        return {
+            'w': self.w, 'last_pivots': self.last_pivots,
+            'highs': list(self.highs), 'lows': list(self.lows),
+            'n_pivots': self.n_pivots, 'last_h': self.last_h, 'last_l': self.last_l,
+            'code': self.code,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        obj = cls(d['w'], d['last_pivots'])
+        obj.highs.extend(float(v) for v in d['highs'])
+        obj.lows.extend(float(v) for v in d['lows'])
+        obj.n_pivots = d['n_pivots']
+        obj.last_h = [list(p) if p is not None else None for p in d['last_h']]
+        obj.last_l = [list(p) if p is not None else None for p in d['last_l']]
+        obj.code = d['code']
+        return obj
+
+
+# ===========================
+# État alpha4 d'un ticker
+# ===========================
+
+class V4TickerState:
+    """
+    Indicateurs de base alpha4 d'un ticker (mêmes noms et mêmes valeurs que
+    feature_engine.v4_base_matrices), avancés d'une barre par update().
+    Les filtres et le score s'obtiennent ensuite avec feature_engine.v4_combine.
+    """
+
+    __slots__ = ('ticker', 'params', 'n_bars', 'last_date', 'prev_close', 'closes_rs',
+                 'rs_sma', 'gains', 'losses', 'vol_mean', 'mm20', 'std20', 'range20',
+                 'price_sma', 'atr', 'atr_prev', 'structure')
+
+    _ROLLING = ('rs_sma', 'gains', 'losses', 'vol_mean', 'mm20', 'std20', 'range20', 'price_sma', 'atr')
+
+    def __init__(self, cfg, ticker=None):
+        self.ticker = ticker
+        self.params = {
+            'RS_LOOKBACK': indicators.RS_LOOKBACK,
+            'RS_SMA_P': int(cfg.get('RS_SMA_P', 20)),
+            'PRICE_SMA_P': int(cfg.get('PRICE_SMA_P', 200)),
+            'ATR_P': int(cfg['ATR_P']),
+            'PIVOT_W': int(cfg['PIVOT_W']),
+            'STRUCT_LAST_PIVOTS': int(cfg['STRUCT_LAST_PIVOTS']),
+        }
+        p = self.params
+        self.n_bars = 0
+        self.last_date = None
+        self.prev_close = _NAN
+        self.closes_rs = deque(maxlen=p['RS_LOOKBACK'])
+        self.rs_sma = RollingMean(p['RS_SMA_P'])
+        self.gains = RollingSum(14)
+        self.losses = RollingSum(14)
+        self.vol_mean = RollingMean(20)
+        self.mm20 = RollingMean(20)
+        self.std20 = RollingStd(20, ddof=0)
+        self.range20 = RollingMean(20)
+        self.price_sma = RollingMean(p['PRICE_SMA_P'])
+        self.atr = RollingMean(p['ATR_P'])
+        self.atr_prev = _NAN
+        self.structure = StructureState(p['PIVOT_W'], p['STRUCT_LAST_PIVOTS'])
+
+    @classmethod
+    def from_bars(cls, bars, index_state, cfg):
+        """Amorçage : rejoue tout l'historique (index_state doit couvrir ses dates)."""
+        ensure_parity()
+        obj = cls(cfg, ticker=bars.ticker)
+        for d, h, l, c, v in zip(bars.dates.astype(np.int64).tolist(), bars.high.tolist(),
+                                 bars.low.tolist(), bars.close.tolist(), bars.volume.tolist()):
+            obj.update(d, h, l, c, v, index_state)
+        return obj
+
+    def update(self, date, high, low, close, volume, index_state):
+        """Ajoute une barre (date strictement croissante) ; retourne les indicateurs de cette barre."""
+        date = _ns(date)
+        if self.last_date is not None and date <= self.last_date:
+            raise ValueError(f"{self.ticker} : barre du {np.datetime64(date, 'ns')} déjà intégrée")
+        high, low, close, volume = float(high), float(low), float(close), float(volume)
+        p = self.params
+
+        # --- RS vs indice ---
+        rs = 0.0
+        if len(self.closes_rs) == p['RS_LOOKBACK']:
+            pair = index_state.rs_pair(date)
+            s_prev = self.closes_rs[0]
+            if pair is not None:
+                i_curr, i_prev = pair
+                if (close == close and s_prev == s_prev and i_curr == i_curr and i_prev == i_prev
+                        and s_prev != 0 and i_prev != 0):
+                    rs = ((close - s_prev) / s_prev - (i_curr - i_prev) / i_prev) * 100.0
+        self.closes_rs.append(close)
+        rs_sma = self.rs_sma.update(rs)
+
+        # --- RSI (sommes des gains / pertes) ---
+        diff = close - self.prev_close
+        if diff != diff:
+            gain = loss = _NAN
+        else:
+            gain = 0.0 if diff < 0 else diff
+            loss = -(0.0 if diff > 0 else diff)
+        gains = self.gains.update(gain)
+        losses = self.losses.update(loss)
+        if losses == 0:
+            rsi = 100.0
+        elif losses != losses:
+            rsi = 0.0
+        else:
+            rsi = 100.0 - _div(100.0, 1.0 + _div(gains, losses))
+            if rsi != rsi:
+                rsi = 0.0
+
+        # --- volume, MM20, squeeze ---
+        vratio = _div(volume, self.vol_mean.update(volume))
+        if vratio != vratio:
+            vratio = 0.0
+
+        mm20 = self.mm20.update(close)
+        dist_m20 = _div(abs(close - mm20), mm20)
+        if dist_m20 != dist_m20:
+            dist_m20 = 1.0
+
+        std20 = self.std20.update(close)
+        range20 = self.range20.update(high - low)
+        sqz_flag = (2.0 * std20) < (1.5 * range20)
+
+        price_sma = self.price_sma.update(close)
+
+        # --- ATR décalé d'une barre ---
+        pc = self.prev_close
+        tr = _fmax(_fmax(high - low, abs(high - pc)), abs(low - pc))
+        atr_vec = 0.0 if self.atr_prev != self.atr_prev else self.atr_prev
+        self.atr_prev = self.atr.update(tr)
+
+        struct_code = self.structure.update(high, low)
+
+        self.prev_close = close
+        self.last_date = date
+        self.n_bars += 1
+
+        return {
+            'rs_line': rs,
+            'rs_sma': rs_sma,
+            'rsi': rsi,
+            'vratio': vratio,
+            'mm20': mm20,
+            'dist_m20': dist_m20,
+            'sqz_flag': sqz_flag,
+            'struct_code': struct_code,
+            'price_sma': price_sma,
+            'atr_vec': atr_vec,
+        }
+
+    def to_dict(self):
+        d = {
+            'ticker': self.ticker, 'params': dict(self.params), 'n_bars': self.n_bars,
+            'last_date': self.last_date, 'prev_close': self.prev_close,
+            'atr_prev': self.atr_prev, 'closes_rs': list(self.closes_rs),
+            'structure': self.structure.to_dict(),
+        }
+        for name in self._ROLLING:
+            d[name] = getattr(self, name).to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        ensure_parity()
+        p = d['params']
+        obj = cls({'RS_SMA_P': p['RS_SMA_P'], 'PRICE_SMA_P': p['PRICE_SMA_P'], 'ATR_P': p['ATR_P'],
+                   'PIVOT_W': p['PIVOT_W'], 'STRUCT_LAST_PIVOTS': p['STRUCT_LAST_PIVOTS']},
+                  ticker=d['ticker'])
+        if p['RS_LOOKBACK'] != obj.params['RS_LOOKBACK']:
+            raise ValueError(f"État {d['ticker']} : RS_LOOKBACK {p['RS_LOOKBACK']} != {obj.params['RS_LOOKBACK']}")
+        obj.n_bars = d['n_bars']
+        obj.last_date = d['last_date']
+        obj.prev_close = d['prev_close']
+        obj.atr_prev = d['atr_prev']
+        obj.closes_rs.extend(float(v) for v in d['closes_rs'])
+        obj.structure = StructureState.from_dict(d['structure'])
+        for name in cls._ROLLING:
+            setattr(obj, name, type(getattr(obj, name)).from_dict(d[name]))
+        return obj
+
+
+# ===========================
+# Contrôle de parité avec le calcul batch
+# ===========================
+
+V4_BASE_NAMES = ('rs_line', 'rs_sma', 'rsi', 'vratio', 'mm20', 'dist_m20', 'sqz_flag',
+                 'struct_code', 'price_sma', 'atr_vec')
+
+
+def parity_check(bars, idx_close, cfg, resume_at=None):
+    """
+    Compare V4TickerState (barre par barre, état repris depuis JSON à la
+    barre resume_at ; défaut mi-parcours) à feature_engine.v4_base_matrices.
+    Retourne {indicateur: nombre de barres différentes} (égalité bit à bit,
+    NaN == NaN) ; vide si tout est identique.
+    """
+    n = len(bars)
+    i_dates = idx_close.index.to_numpy(dtype='datetime64[ns]')
+    i_close = idx_close.to_numpy(dtype=float)
+
+    def col(x):
+        return np.asarray(x, dtype=float).reshape(-1, 1)
+
+    rs = indicators.rs_line(bars.dates, bars.close, i_dates, i_close)
+    batch = feature_engine.v4_base_matrices(
+        col(bars.high), col(bars.low), col(bars.close), col(bars.volume), col(rs),
+        np.array([n], dtype=np.int64), cfg, names=V4_BASE_NAMES
+    )
+
+    resume_at = n // 2 if resume_at is None else resume_at
+    index_state = IndexState.from_series(idx_close)
+    state = V4TickerState(cfg, ticker=bars.ticker)
+    online = {name: [] for name in V4_BASE_NAMES}
+    rows = zip(bars.dates.astype(np.int64).tolist(), bars.high.tolist(), bars.low.tolist(),
+               bars.close.tolist(), bars.volume.tolist())
+    for i, (d, h, l, c, v) in enumerate(rows):
+        if i == resume_at:
+            state = V4TickerState.from_dict(json.loads(json.dumps(state.to_dict())))
+        out = state.update(d, h, l, c, v, index_state)
+        for name in V4_BASE_NAMES:
+            online[name].append(out[name])
+
+    diffs = {}
+    for name in V4_BASE_NAMES:
+        a = np.asarray(batch[name][:, 0], dtype=float)
+        b = np.asarray(online[name], dtype=float)
+        same = (a.view(np.int64) == b.view(np.int64)) | (np.isnan(a) & np.isnan(b))
+        if not same.all():
+            diffs[name] = int((~same).sum())
+    return diffs
+
+
+def _random_history(rng, n_days=600):
+    """Historique synthétique : trous de cotation, NaN, volumes nuls, barres plates."""
+    days = pd.bdate_range('2018-01-01', periods=n_days)
+    idx_days = days[rng.random(n_days) > 0.02]
+    idx_close = pd.Series(4000 * np.exp(np.cumsum(rng.normal(0, 0.01, len(idx_days)))), index=idx_days)
+
+    days = days[rng.random(n_days) > 0.05]
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+    close[rng.integers(0, len(days), 3)] = close[rng.integers(0, len(days), 3)]
+    close[100:110] = close[100]
+    spread = np.abs(rng.normal(0, 0.01, len(days))) * close
+    df = pd.DataFrame({
+        'High': close + spread, 'Low': close - spread, 'Close': close,
+        'Volume': rng.integers(0, 10_000, len(days)).astype(float),
+    }, index=pd.DatetimeIndex(days, name='Date'))
+    for c in ('High', 'Low', 'Close', 'Volume'):
+        df.loc[df.index[rng.random(len(df)) < 0.01], c] = np.nan
+    return Bars.from_frame(df, ticker='RND'), idx_close
+
+
+def self_check(n_histories=30, seed=0):
+    """
+    parity_check sur n_histories historiques synthétiques (paramètres de
+    pivots / ATR tirés au hasard, reprise JSON à une barre au hasard).
+    Retourne {numéro d'historique: écarts} ; vide si tout est identique.
+    """
+    import sigma2
+
+    rng = np.random.default_rng(seed)
+    failed = {}
+    for k in range(n_histories):
+        bars, idx_close = _random_history(rng)
+        cfg = dict(sigma2.ALPHA4_CFG, PIVOT_W=int(rng.integers(2, 5)), ATR_P=int(rng.integers(5, 60)))
+        diffs = parity_check(bars, idx_close, cfg, resume_at=int(rng.integers(1, len(bars))))
+        if diffs:
+            failed[k] = diffs
+    return failed
+
+
+def ensure_parity():
+    """
+    Une fois par processus, si pandas n'est pas en PANDAS_VERSION : vérifie
+    la parité sur quelques historiques avant de créer des états.
+    """
+    with _PARITY_GUARD:
+        if not _PARITY['checked']:
+            # marqué avant : self_check crée lui-même des états (verrou réentrant)
+            _PARITY['checked'] = True
+            if pd.__version__ != PANDAS_VERSION:
+                failed = self_check(n_histories=5)
+                if failed:
+                    _PARITY['error'] = (
+                        f"online_indicators : parité batch rompue avec pandas {pd.__version__} "
+                        f"(noyaux de pandas {PANDAS_VERSION}) : {failed}"
+                    )
+        if _PARITY['error']:
+            raise RuntimeError(_PARITY['error'])
+
+
+if __name__ == '__main__':
+    n = 30
+    failed = self_check(n, seed=int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    for k, diffs in failed.items():
+        print(f"historique {k} : {diffs}")
+    print(f"parité online / batch (pandas {pd.__version__}) : {n - len(failed)}/{n} historiques identiques")
+    sys.exit(1 if failed else 0)
+
+# ==== END online_indicators.py
@@ -0,0 +1,170 @@
+# ==== START refresh_scheduler.py
+"""
+Rafraîchissement en arrière-plan de l'état « chaud » du service.
+
+Un BackgroundRefresher exécute une fonction de construction (build_fn) dans
+un thread démon : une fois au démarrage, puis chaque jour après la clôture
+(NIGHTLY_REFRESH_AT, heure locale TIMEZONE). La nouvelle valeur remplace
+l'ancienne d'un seul coup (simple affectation de référence) : une requête en
+cours garde la version qu'elle a lue, la suivante voit la nouvelle.
+
+ready passe à True après la première construction réussie ; un échec garde
+la version précédente et reprogramme un essai après RETRY_DELAY_S. Au-delà
+de MAX_AGE_S (rafraîchissement nocturne manqué), fresh() ne la renvoie plus :
+les requêtes rechargent leurs données comme sans état chaud.
+"""
+
+import datetime as dt
+import os
+import threading
+import time
+import traceback
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # pragma: no cover - Python < 3.9
+    ZoneInfo = None
+
+REFRESH_CFG = {
+    'ENABLED': os.environ.get('STOCKS_WARM_START', '1') not in ('0', 'false', 'False', ''),
+    'NIGHTLY_REFRESH_AT': os.environ.get('STOCKS_NIGHTLY_REFRESH_AT', '18:15'),   # après la clôture Euronext
+    'TIMEZONE': os.environ.get('STOCKS_REFRESH_TZ', 'Europe/Paris'),
+    'RETRY_DELAY_S': int(os.environ.get('STOCKS_REFRESH_RETRY_S', 300)),
+    'MAX_AGE_S': int(os.environ.get('STOCKS_WARM_MAX_AGE_S', 25 * 3600)),   # période (24 h) + marge de construction
+}
+
+
+def next_refresh_time(now=None, at=None, tz=None):
+    """Prochaine occurrence de l'heure `at` ('HH:MM') strictement après now (datetime aware)."""
+    at = at or REFRESH_CFG['NIGHTLY_REFRESH_AT']
+    tzinfo = ZoneInfo(tz or REFRESH_CFG['TIMEZONE']) if ZoneInfo else dt.timezone.utc
+    now = now or dt.datetime.now(tzinfo)
+
+    hh, mm = (int(x) for x in at.split(':'))
+    target = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
+    if target <= now:
+        target += dt.timedelta(days=1)
+    return target
+
+
+class BackgroundRefresher:
+
+    def __init__(self, name, build_fn):
+        """
+        name     : libellé (logs / statut)
+        build_fn : callable sans argument qui retourne la nouvelle valeur
+        """
+        self.name = name
+        self.build_fn = build_fn
+
+        self._value = None
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._build_lock = threading.Lock()
+        self._thread = None
+
+        self.version = 0
+        self.built_at = None
+        self._built_ts = None
+        self.build_seconds = None
+        self.next_run_at = None
+        self.last_error = None
+
+    # ---------------------------
+    # Accès
+    # ---------------------------
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def current(self):
+        """Dernière valeur construite (None tant que rien n'est prêt)."""
+        return self._value
+
+    def age_s(self):
+        """Âge de la valeur courante en secondes (None tant que rien n'est prêt)."""
+        return None if self._built_ts is None else time.time() - self._built_ts
+
+    def fresh(self, max_age_s=None):
+        """Valeur courante si elle a moins de max_age_s (défaut MAX_AGE_S), sinon None."""
+        age = self.age_s()
+        limit = REFRESH_CFG['MAX_AGE_S'] if max_age_s is None else max_age_s
+        return self._value if age is not None and age <= limit else None
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def status(self):
+        age = self.age_s()
+        return {
+            'name': self.name,
+            'ready': self.ready,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'version': self.version,
+            'built_at': self.built_at,
+            'age_s': round(age, 1) if age is not None else None,
+            'stale': age is not None and age > REFRESH_CFG['MAX_AGE_S'],
+            'build_seconds': self.build_seconds,
+            'next_run_at': self.next_run_at,
+            'last_error': self.last_error,
+        }
+
+    # ---------------------------
+    # Construction
+    # ---------------------------
+
+    def refresh_now(self):
+        """Construit une nouvelle version dans le thread appelant puis la publie."""
+        with self._build_lock:
+            t0 = time.perf_counter()
+            value = self.build_fn()
+            self._value = value
+            self.version += 1
+            self._built_ts = time.time()
+            self.built_at = dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds')
+            self.build_seconds = round(time.perf_counter() - t0, 3)
+            self.last_error = None
+            self._ready.set()
+            return value
+
+    def trigger(self):
+        """Demande un rafraîchissement immédiat au thread de fond."""
+        self._wake.set()
+
+    # ---------------------------
+    # Thread de fond
+    # ---------------------------
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'refresh-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_now()
+                delay = (next_refresh_time() - dt.datetime.now(dt.timezone.utc)).total_seconds()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[refresh:{self.name}] échec : {self.last_error}")
+                traceback.print_exc()
+                delay = REFRESH_CFG['RETRY_DELAY_S']
+
+            delay = max(1.0, delay)
+            self.next_run_at = (dt.datetime.now(dt.timezone.utc) + dt.timedelta(seconds=delay)).isoformat(timespec='seconds')
+            self._wake.wait(delay)
+            self._wake.clear()
+
+# ==== END refresh_scheduler.py
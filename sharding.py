@@ -0,0 +1,205 @@
+# ==== START sharding.py
+"""
+Exécution shardée (map-reduce) d'un moteur sur un univers de tickers.
+
+Le coordinateur découpe l'univers en N shards équilibrés (plan_shards),
+chaque shard est exécuté par une fonction « map » qui retourne un résultat
+compact sérialisable en JSON, puis le coordinateur fusionne (reduce).
+
+Exécuteurs en-process (EXECUTOR, map_ordered / plan_chunks) :
+  - 'serial'    : boucle simple
+  - 'threads'   : pool de threads (noyaux compilés nogil), ordre conservé
+  - 'processes' : univers découpé en lots pondérés par la longueur
+                  d'historique, les plus lourds soumis d'abord au pool
+
+Transports (map_shards) :
+  - 'processes' : processus locaux (ProcessPoolExecutor, contexte spawn)
+  - 'http'      : instances du service (POST JSON sur <url><path>)
+  - 'local'     : stand-in de test, exécution en-process mais avec le même
+                  aller-retour JSON que le transport HTTP
+"""
+
+import json
+import multiprocessing as mp
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SHARD_FORMAT_VERSION = 1
+SHARD_MODES = ('processes', 'http', 'local')
+EXECUTORS = ('serial', 'threads', 'processes')
+CHUNKS_PER_WORKER = 4
+
+
+# ===========================
+# Planification
+# ===========================
+
+def plan_shards(items, weights=None, n_shards=2):
+    """
+    Répartition gloutonne (plus gros poids d'abord vers le shard le moins
+    chargé). Chaque shard garde l'ordre d'origine de ses éléments ; les
+    shards vides sont retirés.
+    """
+    items = list(items)
+    n_shards = max(1, min(int(n_shards), len(items)))
+    weights = [1.0] * len(items) if weights is None else [float(w) for w in weights]
+
+    totals = [0.0] * n_shards
+    owner = [0] * len(items)
+    for i in sorted(range(len(items)), key=lambda k: -weights[k]):
+        s = totals.index(min(totals))
+        owner[i] = s
+        totals[s] += weights[i]
+
+    shards = [[] for _ in range(n_shards)]
+    for i, item in enumerate(items):
+        shards[owner[i]].append(item)
+    return [s for s in shards if s]
+
+
+def plan_chunks(items, weights=None, n_workers=1, chunks_per_worker=CHUNKS_PER_WORKER):
+    """
+    Lots pour un pool de n_workers : plus de lots que de workers (équilibrage
+    dynamique), retournés du plus lourd au plus léger pour que les longs
+    historiques partent en premier.
+    """
+    items = list(items)
+    weights = [1.0] * len(items) if weights is None else [float(w) for w in weights]
+    weight_of = dict(zip(items, weights))
+    chunks = plan_shards(items, weights, max(1, int(n_workers)) * max(1, int(chunks_per_worker)))
+    return sorted(chunks, key=lambda c: -sum(weight_of[i] for i in c))
+
+
+def resolve_workers(max_workers=None):
+    """MAX_WORKERS : None/0 = nombre de CPU."""
+    return max(1, int(max_workers or os.cpu_count() or 1))
+
+
+def check_executor(executor):
+    if executor not in EXECUTORS:
+        raise ValueError(f"EXECUTOR inconnu : {executor!r} (attendu : {', '.join(EXECUTORS)})")
+    return executor
+
+
+# ===========================
+# Format compact
+# ===========================
+
+def _json_default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, pd.Timestamp):
+        return o.isoformat()
+    raise TypeError(f"Type non sérialisable : {type(o).__name__}")
+
+
+def dumps(obj) -> bytes:
+    return json.dumps(obj, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    return json.loads(data)
+
+
+def encode_records(records):
+    """
+    Liste de dicts -> table {columns, rows}. Les lignes qui n'ont pas
+    exactement les colonnes de la première (même ordre) restent des dicts.
+    """
+    if not records:
+        return {'columns': [], 'rows': []}
+    columns = list(records[0])
+    rows = [
+        [r[c] for c in columns] if list(r) == columns else r
+        for r in records
+    ]
+    return {'columns': columns, 'rows': rows}
+
+
+def decode_records(table):
+    columns = table['columns']
+    return [r if isinstance(r, dict) else dict(zip(columns, r)) for r in table['rows']]
+
+
+# ===========================
+# Transports
+# ===========================
+
+def _run_local(fn, payloads):
+    return [loads(dumps(fn(**loads(dumps(p))))) for p in payloads]
+
+
+def _run_processes(fn, payloads, max_workers=None):
+    workers = max(1, min(len(payloads), int(max_workers or len(payloads))))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+        futures = [pool.submit(fn, **p) for p in payloads]
+        return [f.result() for f in futures]
+
+
+def _run_http(urls, path, payloads, timeout_s=None):
+    import requests
+
+    if not urls:
+        raise ValueError("SHARD_URLS vide : aucune instance pour le mode 'http'")
+
+    def _post(i, payload):
+        url = urls[i % len(urls)].rstrip('/') + path
+        resp = requests.post(url, data=dumps(payload), headers={'Content-Type': 'application/json'}, timeout=timeout_s)
+        resp.raise_for_status()
+        out = loads(resp.content)
+        if isinstance(out, dict) and out.get('status') == 'error':
+            raise RuntimeError(f"Shard {i} ({url}) : {out.get('message')}")
+        return out
+
+    with ThreadPoolExecutor(max_workers=len(payloads)) as pool:
+        futures = [pool.submit(_post, i, p) for i, p in enumerate(payloads)]
+        return [f.result() for f in futures]
+
+
+def map_ordered(fn, items, executor='serial', max_workers=None):
+    """
+    Générateur fn(item) dans l'ordre des items. 'threads' : au plus
+    2 x workers tâches en vol, les items sont consommés au fil de l'eau
+    (un itérateur paresseux reste borné en mémoire). Les autres exécuteurs
+    déroulent une boucle simple : les processus passent par plan_chunks +
+    map_shards, au niveau du moteur.
+    """
+    if check_executor(executor) != 'threads':
+        for item in items:
+            yield fn(item)
+        return
+
+    workers = resolve_workers(max_workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def map_shards(fn, payloads, mode='processes', urls=None, path=None, max_workers=None, timeout_s=None):
+    """
+    Exécute fn(**payload) pour chaque shard ; résultats dans l'ordre des payloads.
+    En mode 'http', fn n'est pas appelée localement : chaque payload est posté
+    sur une instance (tourniquet sur urls).
+    """
+    if mode not in SHARD_MODES:
+        raise ValueError(f"SHARD_MODE inconnu : {mode!r} (attendu : {', '.join(SHARD_MODES)})")
+    if not payloads:
+        return []
+    if mode == 'local':
+        return _run_local(fn, payloads)
+    if mode == 'http':
+        return _run_http(list(urls or []), path, payloads, timeout_s)
+    return _run_processes(fn, payloads, max_workers)
+
+# ==== END sharding.py
@@ -2,7 +2,10 @@
 import json
 import numpy as np
 import pandas as pd
-from google.cloud import bigquery
+
+import indicators
+import market_store
+from bars import Bars
 
 ALPHA_CFG = {
     'PROJECT': 'project-16c606d0-6527-4644-907',
@@ -27,6 +30,8 @@ ALPHA_CFG = {
     'PIVOT_W': 3,
     'STRUCT_LAST_PIVOTS': 15,
     'DEBUG_DATE': '2025-07-29',
+    'USE_LOCAL_STORE': True,
+    'STORE_DIR': None,
 }
 
 
@@ -41,40 +46,12 @@ def gas_rs_series(stock_close: pd.Series, idx_close: pd.Series) -> pd.Series:
     stock_close = pd.to_numeric(stock_close, errors='coerce').sort_index()
     idx_close = pd.to_numeric(idx_close, errors='coerce').sort_index()
 
-    s_dates = stock_close.index.to_numpy()
-    s_vals = stock_close.to_numpy(dtype=float)
-    i_dates = idx_close.index.to_numpy()
-    i_vals = idx_close.to_numpy(dtype=float)
-
-    out = np.zeros(len(stock_close), dtype=float)
-
-    for i in range(len(stock_close)):
-        if i < 62:
-            out[i] = 0.0
-            continue
-
-        current_dt = s_dates[i]
-        pos = np.searchsorted(i_dates, current_dt, side='right') - 1
-        if pos < 62:
-            out[i] = 0.0
-            continue
-
-        s_curr = s_vals[i]
-        s_prev = s_vals[i - 62]
-        i_curr = i_vals[pos]
-        i_prev = i_vals[pos - 62]
-
-        if (
-            np.isnan(s_curr) or np.isnan(s_prev) or s_prev == 0 or
-            np.isnan(i_curr) or np.isnan(i_prev) or i_prev == 0
-        ):
-            out[i] = 0.0
-            continue
-
-        stock_perf = (s_curr - s_prev) / s_prev
-        idx_perf = (i_curr - i_prev) / i_prev
-        out[i] = (stock_perf - idx_perf) * 100.0
-
+    out = indicators.rs_line(
+        stock_close.index.to_numpy(),
+        stock_close.to_numpy(dtype=float),
+        idx_close.index.to_numpy(),
+        idx_close.to_numpy(dtype=float)
+    )
     return pd.Series(out, index=stock_close.index, name='RS_Line')
 
 
@@ -83,18 +60,7 @@ def gas_rsi_series(close: pd.Series, p: int = 14) -> pd.Series:
     RSI façon GAS (somme gains/pertes sur p barres ; pertes==0 -> 100)
     """
     close = pd.to_numeric(close, errors='coerce')
-    diff = close.diff()
-    gains = diff.clip(lower=0).rolling(p, min_periods=p).sum()
-    losses = (-diff.clip(upper=0)).rolling(p, min_periods=p).sum()
-
-    rsi = pd.Series(np.nan, index=close.index, dtype=float)
-    zero_losses = losses == 0
-    normal_mask = (~zero_losses) & losses.notna()
-
-    rsi[zero_losses] = 100.0
-    rsi[normal_mask] = 100.0 - (100.0 / (1.0 + (gains[normal_mask] / losses[normal_mask])))
-
-    return rsi.fillna(0.0)
+    return pd.Series(indicators.rsi(close.to_numpy(dtype=float), p=p), index=close.index)
 
 
 def gas_pivots_events(df: pd.DataFrame, w: int = 3):
@@ -105,29 +71,7 @@ def gas_pivots_events(df: pd.DataFrame, w: int = 3):
     """
     highs = pd.to_numeric(df['High'], errors='coerce').to_numpy(dtype=float)
     lows  = pd.to_numeric(df['Low'],  errors='coerce').to_numpy(dtype=float)
-
-    pivots = []
-    n = len(df)
-
-    for i in range(w, n - w):
-        is_h = True
-        is_l = True
-        for j in range(i - w, i + w + 1):
-            if j == i:
-                continue
-            if highs[j] >= highs[i]:
-                is_h = False
-            if lows[j]  <= lows[i]:
-                is_l = False
-            if not is_h and not is_l:
-                break
-
-        if is_h:
-            pivots.append({'pivot_i': i, 'type': 'H', 'value': float(highs[i])})
-        if is_l:
-            pivots.append({'pivot_i': i, 'type': 'L', 'value': float(lows[i])})
-
-    return pivots
+    return indicators.pivot_events(highs, lows, w=w)
 
 
 def gas_structure_series(df: pd.DataFrame, w: int = 3, last_pivots: int = 15):
@@ -137,41 +81,13 @@ def gas_structure_series(df: pd.DataFrame, w: int = 3, last_pivots: int = 15):
       - à chaque date i, on prend les pivots visibles, on slice(-15)
       - HH/LH sur les deux derniers H ; HL/LL sur les deux derniers L
     """
-    df = df.sort_index().copy()
-    n = len(df)
-    all_pivots = gas_pivots_events(df, w=w)
-
-    visible_on = [[] for _ in range(n)]
-    for p in all_pivots:
-        vis_i = p['pivot_i'] + w
-        if vis_i < n:
-            visible_on[vis_i].append(p)
-
-    active_pivots = []
-    struct_label = np.array(['ND'] * n, dtype=object)
-    struct_ok = np.zeros(n, dtype=bool)
-
-    for i in range(n):
-        if visible_on[i]:
-            active_pivots.extend(visible_on[i])
-
-        p15 = active_pivots[-last_pivots:]
-        highs = [x for x in p15 if x['type'] == 'H']
-        lows  = [x for x in p15 if x['type'] == 'L']
-
-        if len(highs) < 2 or len(lows) < 2:
-            struct_label[i] = 'ND'
-            struct_ok[i] = False
-            continue
-
-        struct = (
-            ('HH' if highs[-1]['value'] > highs[-2]['value'] else 'LH')
-            + '+'
-            + ('HL' if lows[-1]['value'] > lows[-2]['value'] else 'LL')
-        )
-        struct_label[i] = struct
-        struct_ok[i] = ('HH' in struct and 'HL' in struct)
-
+    df = df.sort_index()
+    struct_label, struct_ok = indicators.structure_labels(
+        pd.to_numeric(df['High'], errors='coerce').to_numpy(dtype=float),
+        pd.to_numeric(df['Low'],  errors='coerce').to_numpy(dtype=float),
+        w=w,
+        last_pivots=last_pivots
+    )
     return (
         pd.Series(struct_label, index=df.index, name='Structure'),
         pd.Series(struct_ok, index=df.index, name='Structure_OK'),
@@ -182,58 +98,53 @@ def gas_squeeze_series(df: pd.DataFrame) -> pd.Series:
     """
     2*std20(population) < 1.5*avg20(high-low)
     """
-    close = pd.to_numeric(df['Close'], errors='coerce')
-    hl    = pd.to_numeric(df['High'],  errors='coerce') - pd.to_numeric(df['Low'], errors='coerce')
-    std20 = close.rolling(20, min_periods=20).std(ddof=0)
-    atr20 = hl.rolling(20, min_periods=20).mean()
-    return ((2.0 * std20) < (1.5 * atr20)).fillna(False)
+    close = pd.to_numeric(df['Close'], errors='coerce').to_numpy(dtype=float)
+    high  = pd.to_numeric(df['High'],  errors='coerce').to_numpy(dtype=float)
+    low   = pd.to_numeric(df['Low'],   errors='coerce').to_numpy(dtype=float)
+    return pd.Series(indicators.squeeze_flag(high, low, close), index=df.index)
 
 
 def atr_true_range_series(df: pd.DataFrame) -> pd.Series:
-    high = pd.to_numeric(df['High'], errors='coerce')
-    low  = pd.to_numeric(df['Low'],  errors='coerce')
-    prev_close = pd.to_numeric(df['Close'], errors='coerce').shift(1)
-    tr = pd.concat([
-        high - low,
-        (high - prev_close).abs(),
-        (low  - prev_close).abs(),
-    ], axis=1).max(axis=1)
-    return tr
+    high = pd.to_numeric(df['High'], errors='coerce').to_numpy(dtype=float)
+    low  = pd.to_numeric(df['Low'],  errors='coerce').to_numpy(dtype=float)
+    close = pd.to_numeric(df['Close'], errors='coerce').to_numpy(dtype=float)
+    return pd.Series(indicators.true_range(high, low, close), index=df.index)
 
 
 def alpha_engine_v3():
     # 1) DATA
-    client = bigquery.Client(project=ALPHA_CFG['PROJECT'])
-    query = f"""
-        SELECT *
-        FROM `{ALPHA_CFG['DB_SET']}.{ALPHA_CFG['TBL']}`
-        WHERE Ticker IN ('{ALPHA_CFG['STOCK']}', '{ALPHA_CFG['IDX']}')
-        ORDER BY Date ASC
-    """
-    raw_df = client.query(query).to_dataframe()
-    raw_df['Date'] = pd.to_datetime(raw_df['Date']).dt.tz_localize(None)
-
-    base_stock = raw_df[raw_df['Ticker'] == ALPHA_CFG['STOCK']].set_index('Date').copy()
-    base_idx   = raw_df[raw_df['Ticker'] == ALPHA_CFG['IDX']].set_index('Date').copy()
+    raw_df = market_store.load_history(
+        ALPHA_CFG['PROJECT'],
+        ALPHA_CFG['DB_SET'],
+        ALPHA_CFG['TBL'],
+        tickers=[ALPHA_CFG['STOCK'], ALPHA_CFG['IDX']],
+        use_store=ALPHA_CFG.get('USE_LOCAL_STORE', True),
+        store_dir=ALPHA_CFG.get('STORE_DIR'),
+    )
 
-    for df in [base_stock, base_idx]:
-        for c in ['Close', 'High', 'Low', 'Volume']:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors='coerce')
+    # Ingestion unique : barres validées (float64, triées, dédoublonnées)
+    stock_bars = Bars.from_frame(raw_df[raw_df['Ticker'] == ALPHA_CFG['STOCK']].set_index('Date'), ALPHA_CFG['STOCK'])
+    idx_bars   = Bars.from_frame(raw_df[raw_df['Ticker'] == ALPHA_CFG['IDX']].set_index('Date'), ALPHA_CFG['IDX'])
 
-    base_stock = base_stock.sort_index()
-    base_idx   = base_idx.sort_index()
+    base_stock = stock_bars.to_frame()
+    base_idx   = idx_bars.to_frame()
+    s_index    = stock_bars.index
 
     # 2) INDICATEURS
-    rs_line  = gas_rs_series(base_stock['Close'], base_idx['Close'])
-    rsi_gold = gas_rsi_series(base_stock['Close'], p=14)
+    rs_line  = pd.Series(
+        indicators.rs_line(stock_bars.dates, stock_bars.close, idx_bars.dates, idx_bars.close),
+        index=s_index, name='RS_Line'
+    )
+    rsi_gold = pd.Series(indicators.rsi(stock_bars.close, p=14), index=s_index)
     v_ratio  = (base_stock['Volume'] / base_stock['Volume'].rolling(20, min_periods=20).mean()).fillna(0.0)
     mm20     = base_stock['Close'].rolling(20, min_periods=20).mean()
     dist_mm20 = ((base_stock['Close'] - mm20).abs() / mm20).fillna(1.0)
-    is_sqz   = gas_squeeze_series(base_stock)
-    struct_label, struct_ok = gas_structure_series(
-        base_stock, w=ALPHA_CFG['PIVOT_W'], last_pivots=ALPHA_CFG['STRUCT_LAST_PIVOTS']
+    is_sqz   = pd.Series(indicators.squeeze_flag(stock_bars.high, stock_bars.low, stock_bars.close), index=s_index)
+    struct_label, struct_ok = indicators.structure_labels(
+        stock_bars.high, stock_bars.low, w=ALPHA_CFG['PIVOT_W'], last_pivots=ALPHA_CFG['STRUCT_LAST_PIVOTS']
     )
+    struct_label = pd.Series(struct_label, index=s_index, name='Structure')
+    struct_ok    = pd.Series(struct_ok, index=s_index, name='Structure_OK')
 
     # 3) SCORE
     s_val = pd.Series(0.0, index=base_stock.index)
@@ -252,7 +163,7 @@ def alpha_engine_v3():
     mkt_ok = (idx_close_on_stock_dates > idx_sma_on_stock_dates).fillna(False) if ALPHA_CFG['MKT_FILTER'] else \
              pd.Series(True, index=base_stock.index)
 
-    tr = atr_true_range_series(base_stock)
+    tr = pd.Series(indicators.true_range(stock_bars.high, stock_bars.low, stock_bars.close), index=s_index)
     atr_vec = tr.rolling(ALPHA_CFG['ATR_P'], min_periods=ALPHA_CFG['ATR_P']).mean().shift(1).fillna(0.0)
 
     # 5) DEBUG (sans try/except)
@@ -1,12 +1,24 @@
 # === v10 - 28032026
 # ==== START sigma2.py
 
+import itertools
 import math
+import os
+import re
+import time
 from collections import defaultdict
 import json
 import numpy as np
 import pandas as pd
-from google.cloud import bigquery
+
+import feature_engine
+import feature_store
+import indicators
+import kernels
+import market_store
+from bars import Bars
+import sharding
+from refresh_scheduler import BackgroundRefresher
 
 ALPHA4_CFG = {
     # --- Configuration Backend ---
@@ -14,10 +26,35 @@ ALPHA4_CFG = {
     'DB_SET': 'Trading',
     'TBL': 'CC_Historique_Cours_v2',
     'IDX': '^FCHI',
+    'BENCHMARK_MAP': {},                 # ticker -> indice de référence (ex. '^SBF120') ; défaut IDX
+
+    # --- Store local Parquet (sync incrémentale BigQuery) ---
+    'USE_LOCAL_STORE': True,
+    'STORE_DIR': None,                   # None = market_store.STORE_CFG['STORE_DIR']
 
     # --- Fenêtre d'analyse simple ---
     'USE_DAYS_BACK_FILTER': False,   # False = tout l'historique / True = filtre actif
     'DAYS_BACK_FROM_TODAY': 365,     # nombre de jours en arrière depuis aujourd'hui
+    'MIN_HISTORY_BARS': 100,         # tickers avec moins de barres ignorés (filtre poussé dans BigQuery)
+    'STREAMING_MODE': False,         # True = un ticker à la fois (mémoire bornée, grands univers)
+    'FEATURE_BLOCK_TICKERS': 64,     # indicateurs calculés par blocs de N tickers (matrices 2D)
+    'FEATURE_STORE': False,          # True = features du run écrites dans feature_store (snapshot + config_hash)
+    'FEATURE_STORE_DIR': None,       # None = feature_store.FEATURE_STORE_CFG['DIR']
+    'FEATURE_SNAPSHOT': None,        # fixé par le coordinateur pour ses shards / lots ; None = calculé par le run
+    'INDICATOR_CACHE': True,         # indicateurs mémorisés par (ticker, contenu, paramètres) : un run qui ne change que des seuils saute leur calcul
+    'ENGINE_BACKEND': None,          # noyaux barre par barre : 'auto' | 'python' | 'numpy' | 'numba' ; None = kernels.KERNEL_CFG['BACKEND']
+    'SCORE_PRUNING': True,           # structure calculée seulement où MIN_SCORE reste atteignable (résultats identiques ; sans effet avec FEATURE_STORE ou INDICATOR_CACHE : structure complète mise en cache)
+
+    # --- Exécution parallèle par ticker (dans un processus ou dans chaque shard) ---
+    'EXECUTOR': 'serial',            # 'serial' | 'threads' | 'processes' (lots pondérés par l'historique)
+    'MAX_WORKERS': None,             # None = nombre de CPU
+
+    # --- Exécution shardée (map-reduce, allocator exécuté une fois par le coordinateur) ---
+    # (réglages serveur : ALPHA4_SHARDS / ALPHA4_SHARD_MODE / ALPHA4_SHARD_URLS, jamais repris d'une requête HTTP)
+    'SHARDS': int(os.environ.get('ALPHA4_SHARDS', 0)),               # 0/1 = un seul processus ; N = univers découpé en N shards
+    'SHARD_MODE': os.environ.get('ALPHA4_SHARD_MODE', 'processes'),  # 'processes' | 'http' (SHARD_URLS) | 'local' (stand-in de test)
+    'SHARD_URLS': [u for u in os.environ.get('ALPHA4_SHARD_URLS', '').split(',') if u],  # instances du service exposant /alpha4_shard
+    'SHARD_TIMEOUT_S': 900,
 
     # --- Gestion portefeuille / cash ---
     'INITIAL_CASH': 50000.0,             # cash de départ
@@ -108,154 +145,45 @@ def v4_rs_line(stock_close: pd.Series, idx_close: pd.Series) -> pd.Series:
     stock_close = pd.to_numeric(stock_close, errors='coerce').sort_index()
     idx_close = pd.to_numeric(idx_close, errors='coerce').sort_index()
 
-    s_dates = stock_close.index.to_numpy()
-    s_vals = stock_close.to_numpy(dtype=float)
-    i_dates = idx_close.index.to_numpy()
-    i_vals = idx_close.to_numpy(dtype=float)
-
-    out = np.zeros(len(stock_close), dtype=float)
-
-    for i in range(len(stock_close)):
-        if i < 62:
-            out[i] = 0.0
-            continue
-
-        current_dt = s_dates[i]
-        pos = np.searchsorted(i_dates, current_dt, side='right') - 1
-
-        if pos < 62:
-            out[i] = 0.0
-            continue
-
-        s_curr = s_vals[i]
-        s_prev = s_vals[i - 62]
-        i_curr = i_vals[pos]
-        i_prev = i_vals[pos - 62]
-
-        if (
-            np.isnan(s_curr) or np.isnan(s_prev) or s_prev == 0 or
-            np.isnan(i_curr) or np.isnan(i_prev) or i_prev == 0
-        ):
-            out[i] = 0.0
-            continue
-
-        stock_perf = (s_curr - s_prev) / s_prev
-        idx_perf = (i_curr - i_prev) / i_prev
-        out[i] = (stock_perf - idx_perf) * 100.0
+    out = indicators.rs_line(
+        stock_close.index.to_numpy(),
+        stock_close.to_numpy(dtype=float),
+        idx_close.index.to_numpy(),
+        idx_close.to_numpy(dtype=float)
+    )
 
     return pd.Series(out, index=stock_close.index, name='RS_Line')
 
 
 def v4_rsi(close: pd.Series, p: int = 14) -> pd.Series:
     close = pd.to_numeric(close, errors='coerce')
-    diff = close.diff()
-    gains = diff.clip(lower=0).rolling(p, min_periods=p).sum()
-    losses = (-diff.clip(upper=0)).rolling(p, min_periods=p).sum()
-
-    rsi = pd.Series(np.nan, index=close.index, dtype=float)
-
-    zero_losses = (losses == 0)
-    normal_mask = (~zero_losses) & losses.notna()
-
-    rsi[zero_losses] = 100.0
-    rsi[normal_mask] = 100.0 - (100.0 / (1.0 + (gains[normal_mask] / losses[normal_mask])))
-
-    return rsi.fillna(0.0)
+    return pd.Series(indicators.rsi(close.to_numpy(dtype=float), p=p), index=close.index)
 
 
 def v4_pivot_events(df: pd.DataFrame, w: int = 3):
     highs = pd.to_numeric(df['High'], errors='coerce').to_numpy(dtype=float)
     lows = pd.to_numeric(df['Low'], errors='coerce').to_numpy(dtype=float)
-
-    pivots = []
-    n = len(df)
-
-    for i in range(w, n - w):
-        is_h = True
-        is_l = True
-
-        for j in range(i - w, i + w + 1):
-            if j == i:
-                continue
-            if highs[j] >= highs[i]:
-                is_h = False
-            if lows[j] <= lows[i]:
-                is_l = False
-            if not is_h and not is_l:
-                break
-
-        if is_h:
-            pivots.append({'pivot_i': i, 'type': 'H', 'value': float(highs[i])})
-        if is_l:
-            pivots.append({'pivot_i': i, 'type': 'L', 'value': float(lows[i])})
-
-    return pivots
+    return indicators.pivot_events(highs, lows, w=w)
 
 
 def v4_structure_labels(df: pd.DataFrame, w: int = 3, last_pivots: int = 15):
-    df = df.sort_index().copy()
-    n = len(df)
-
-    piv = v4_pivot_events(df, w=w)
-    visible_on = [[] for _ in range(n)]
-
-    for p in piv:
-        vis_i = p['pivot_i'] + w
-        if vis_i < n:
-            visible_on[vis_i].append(p)
-
-    active = []
-    struct_label = np.array(['ND'] * n, dtype=object)
-    struct_ok = np.zeros(n, dtype=bool)
-
-    for i in range(n):
-        if visible_on[i]:
-            active.extend(visible_on[i])
-
-        p_last = active[-last_pivots:]
-        h = [x for x in p_last if x['type'] == 'H']
-        l = [x for x in p_last if x['type'] == 'L']
-
-        if len(h) < 2 or len(l) < 2:
-            struct_label[i] = 'ND'
-            struct_ok[i] = False
-            continue
-
-        label = (
-            ('HH' if h[-1]['value'] > h[-2]['value'] else 'LH')
-            + '+'
-            + ('HL' if l[-1]['value'] > l[-2]['value'] else 'LL')
-        )
-
-        struct_label[i] = label
-        struct_ok[i] = ('HH' in label and 'HL' in label)
+    bars = Bars.from_frame(df)
+    struct_label, struct_ok = indicators.structure_labels(bars.high, bars.low, w=w, last_pivots=last_pivots)
 
     return (
-        pd.Series(struct_label, index=df.index, name='Structure'),
-        pd.Series(struct_ok, index=df.index, name='Structure_OK'),
+        pd.Series(struct_label, index=bars.index, name='Structure'),
+        pd.Series(struct_ok, index=bars.index, name='Structure_OK'),
     )
 
 
 def v4_squeeze_flag(df: pd.DataFrame) -> pd.Series:
-    close = pd.to_numeric(df['Close'], errors='coerce')
-    hl = pd.to_numeric(df['High'], errors='coerce') - pd.to_numeric(df['Low'], errors='coerce')
-    std20 = close.rolling(20, min_periods=20).std(ddof=0)
-    atr20 = hl.rolling(20, min_periods=20).mean()
-    return ((2.0 * std20) < (1.5 * atr20)).fillna(False)
+    bars = Bars.from_frame(df)
+    return pd.Series(indicators.squeeze_flag(bars.high, bars.low, bars.close), index=bars.index)
 
 
 def v4_true_range(df: pd.DataFrame) -> pd.Series:
-    high = pd.to_numeric(df['High'], errors='coerce')
-    low = pd.to_numeric(df['Low'], errors='coerce')
-    prev_close = pd.to_numeric(df['Close'], errors='coerce').shift(1)
-
-    tr = pd.concat([
-        high - low,
-        (high - prev_close).abs(),
-        (low - prev_close).abs(),
-    ], axis=1).max(axis=1)
-
-    return tr
+    bars = Bars.from_frame(df)
+    return pd.Series(indicators.true_range(bars.high, bars.low, bars.close), index=bars.index)
 
 
 # ===========================
@@ -286,6 +214,37 @@ def _safe_int(x, default=0):
         return default
 
 
+def _v4_warmup_bars(cfg):
+    """
+    Nombre de barres nécessaires avant que tous les indicateurs soient chauds.
+    """
+    bars = [
+        int(cfg['SMA_P']) + 4,                 # pente SMA indice = shift(4)
+        int(cfg['ATR_P']) + 1,                 # ATR décalé d'une barre
+        int(cfg.get('LOOKBACK', 63)),          # RS 62 barres
+        20,                                    # vratio / MM20 / squeeze
+    ]
+    if cfg.get('USE_PRICE_SMA_FILTER', False):
+        bars.append(int(cfg.get('PRICE_SMA_P', 200)))
+    if cfg.get('USE_RS_SMA_FILTER', False):
+        bars.append(63 + int(cfg.get('RS_SMA_P', 20)))
+    return max(bars)
+
+
+def _v4_history_start(cfg):
+    """
+    Début de la fenêtre chargée (None = tout l'historique).
+    Fenêtre = max(DAYS_BACK_FROM_TODAY, 365 jours, warm-up des indicateurs).
+    """
+    if not cfg.get('USE_DAYS_BACK_FILTER', False):
+        return None
+
+    days_back = int(cfg.get('DAYS_BACK_FROM_TODAY', 365))
+    warmup_days = int(math.ceil(_v4_warmup_bars(cfg) * 7 / 5)) + 15   # barres ouvrées -> jours calendaires (+ fériés)
+    days_back = max(days_back, 365, warmup_days)
+    return (pd.Timestamp.today().normalize() - pd.Timedelta(days=days_back)).strftime('%Y-%m-%d')
+
+
 def _sort_trade_candidates(candidates, cfg):
     mode = cfg.get('ENTRY_PRIORITY', 'score_then_volume')
 
@@ -429,325 +388,303 @@ def _close_trade_v4(tr, date, exit_px, exit_type, stock_df_attrs, idx_close_entr
 # Moteur par ticker
 # ===========================
 
-def _v4_run_ticker(stock_df: pd.DataFrame,
-                   idx_close: pd.Series,
-                   cfg: dict,
-                   idx_sma_on_stock_dates: pd.Series,
-                   idx_slope_on_stock_dates: pd.Series):
+class _V4Trade:
+    """
+    État compact d'un trade alpha4 : position et paramètres d'entrée,
+    puis résultats du noyau walk_trade. Le contexte d'entrée détaillé
+    (dict) n'est construit qu'à la clôture ou pour le rapport
+    (_v4_trade_context).
+    """
 
-    stock_df = stock_df.sort_index().copy()
+    __slots__ = (
+        'entry_i', 'e_px', 'slope', 'vol_pct', 'tp_val', 'be_trig', 'is_fast_be', 'is_strong',
+        'bars_held', 'be_hit', 'bars_to_be', 'mfe', 'mae', 'max_close', 'min_close', 'lock_code',
+    )
 
-    # --- Indicateurs ---
-    rs_line = v4_rs_line(stock_df['Close'], idx_close)
-    rsi = v4_rsi(stock_df['Close'], p=14)
+    def __init__(self, entry_i, e_px, slope, vol_pct, tp_val, be_trig, is_fast_be, is_strong):
+        self.entry_i = entry_i
+        self.e_px = e_px
+        self.slope = slope
+        self.vol_pct = vol_pct
+        self.tp_val = tp_val
+        self.be_trig = be_trig
+        self.is_fast_be = is_fast_be
+        self.is_strong = is_strong
+
+    def walk(self, walk_trade, bars, cfg, locks, cache=None):
+        """
+        Suit le trade à partir de la barre suivant l'entrée ; retourne (exit_i, exit_code, raw_exit).
+        cache : dict (arguments du noyau -> résultat) partagé entre runs du même
+        ticker (sweep) ; un même trade avec les mêmes sorties n'est suivi qu'une fois.
+        """
+        args = (
+            self.entry_i + 1, self.e_px, self.tp_val, self.be_trig,
+            int(cfg['BE_DELAY']), float(cfg['STOP_L']), float(cfg['FEES']),
+            *locks
+        )
+        out = cache.get(args) if cache is not None else None
+        if out is None:
+            out = walk_trade(bars.high, bars.low, bars.close, *args)
+            if cache is not None:
+                cache[args] = out
+        (
+            exit_i, exit_code, raw_exit, self.bars_held, self.be_hit, self.bars_to_be,
+            self.mfe, self.mae, self.max_close, self.min_close, self.lock_code
+        ) = out
+        return int(exit_i), int(exit_code), float(raw_exit)
 
-    vratio = (stock_df['Volume'] / stock_df['Volume'].rolling(20, min_periods=20).mean()).fillna(0.0)
 
-    mm20 = stock_df['Close'].rolling(20, min_periods=20).mean()
-    dist_m20 = ((stock_df['Close'] - mm20).abs() / mm20).fillna(1.0)
+_V4_LOCK_LEVELS = (None, 'LOCK1', 'LOCK2')
 
-    sqz_flag = v4_squeeze_flag(stock_df)
 
-    struct_label, struct_ok = v4_structure_labels(
-        stock_df,
-        w=cfg['PIVOT_W'],
-        last_pivots=cfg['STRUCT_LAST_PIVOTS']
+def _v4_lock_params(cfg):
+    """(use_lock, lock1_trigger, lock1_raw, lock2_trigger, lock2_raw) pour walk_trade."""
+    return (
+        bool(cfg.get('USE_PROFIT_LOCK', False)),
+        float(cfg.get('LOCK1_TRIGGER', 0.095)),
+        float(cfg.get('LOCK1_RAW', 0.0206)),
+        float(cfg.get('LOCK2_TRIGGER', 0.10)),
+        float(cfg.get('LOCK2_RAW', 0.0356)),
     )
 
-    # --- Filtre prix vs SMA long terme ---
-    price_sma_p = int(cfg.get('PRICE_SMA_P', 200))
-    price_sma = stock_df['Close'].rolling(price_sma_p, min_periods=price_sma_p).mean()
 
-    price_filter_ok = (
-        (stock_df['Close'] >= price_sma).fillna(False)
-        if cfg.get('USE_PRICE_SMA_FILTER', False)
-        else pd.Series(True, index=stock_df.index)
-    )
+def _v4_trade_context(tr, f, dates, close, cfg):
+    """Dict historique d'un trade (paramètres, suivi, contexte d'entrée) lu dans les features à tr.entry_i."""
+    i = tr.entry_i
+    slope = f['idx_slope'][i]
 
-    # --- RS momentum ---
-    rs_sma_p = int(cfg.get('RS_SMA_P', 20))
-    rs_sma = rs_line.rolling(window=rs_sma_p).mean()
+    tp_regime_source = 'TREND'
+    if tr.is_strong:
+        tp_regime_source = 'TREND_BOOST'
+    if slope < cfg['SLOPE_TRESH']:
+        tp_regime_source = 'RANGE'
 
-    if cfg.get('USE_RS_SMA_FILTER', False):
-        rs_momentum_ok = (rs_line > rs_sma)
-    else:
-        rs_momentum_ok = pd.Series(True, index=stock_df.index)
+    idx_entry_px = f['idx_close'][i]
+    idx_entry_sma = f['idx_sma'][i]
 
-    # --- Score ---
-    s_val = pd.Series(0.0, index=stock_df.index)
+    idx_gap_vs_sma_pct = None
+    if pd.notna(idx_entry_px) and pd.notna(idx_entry_sma) and idx_entry_sma != 0:
+        idx_gap_vs_sma_pct = ((float(idx_entry_px) / float(idx_entry_sma)) - 1.0) * 100.0
 
-    s_val += np.where(struct_ok, cfg['W_STRUCT'], 0)
-    s_val += np.where(sqz_flag, cfg['W_SQZ'], 0)
+    price_sma_entry = f['price_sma'][i]
+    price_vs_sma200_pct = None
+    if pd.notna(price_sma_entry) and price_sma_entry != 0:
+        price_vs_sma200_pct = ((float(close[i]) / float(price_sma_entry)) - 1.0) * 100.0
 
-    s_val += np.where(
-        vratio > 1.5,
-        cfg['W_VOL'],
-        np.where(vratio > 1.1, cfg['W_VOL'] / 2, 0)
-    )
+    rs_sma_entry = f['rs_sma'][i]
+    vratio_entry = f['vratio'][i]
+    lock_raw = (None, cfg.get('LOCK1_RAW', 0.0206), cfg.get('LOCK2_RAW', 0.0356))[tr.lock_code]
+
+    return {
+        'date': dates[i],
+        'e_px': tr.e_px,
+        'size': float(cfg['SIZE']),
+        'fees': float(cfg['FEES']),
+        'tp_val': float(tr.tp_val),
+        'be_trig': float(tr.be_trig),
+        'be_type': 'FAST' if tr.is_fast_be else 'SLOW',
+        'be_hit': bool(tr.be_hit),
+        'bars_held': int(tr.bars_held),
+
+        # --- Profit lock state ---
+        'profit_lock_raw': lock_raw,
+        'profit_lock_level': _V4_LOCK_LEVELS[tr.lock_code],
+
+        # --- Logging analytique existant ---
+        'mfe_pct': float(tr.mfe),
+        'mae_pct': float(tr.mae),
+        'max_close_pct': float(tr.max_close),
+        'min_close_pct': float(tr.min_close),
+        'bars_to_be': int(tr.bars_to_be) if tr.bars_to_be >= 0 else None,
+        'bars_to_tp': None,
+        'bars_to_sl': None,
 
-    s_val += np.where((rsi >= 50) & (rsi <= 70), cfg['W_RSI'], 0)
+        # ======================================================
+        # NOUVEAUX CHAMPS D'ANALYSE A L'ENTREE
+        # ======================================================
+        'Score_Entry': float(f['score'][i]),
+        'RS_Line_Entry': float(f['rs_line'][i]),
+        'RS_SMA_Entry': float(rs_sma_entry) if pd.notna(rs_sma_entry) else None,
+        'RS_Momentum_OK_Entry': bool(f['rs_momentum_ok'][i]),
+        'RSI_Entry': float(f['rsi'][i]),
+        'Volume_Ratio_Entry': float(vratio_entry) if pd.notna(vratio_entry) else None,
+        'Dist_M20_Entry_Pct': float(f['dist_m20'][i] * 100.0),
+        'Squeeze_Flag_Entry': bool(f['sqz_flag'][i]),
+        'Structure_Label_Entry': indicators.STRUCT_LABELS[f['struct_code'][i]],
+        'Structure_OK_Entry': bool(f['struct_ok'][i]),
+        'Price_Filter_OK_Entry': bool(f['price_filter_ok'][i]),
+        'Price_vs_SMA200_Entry_Pct': float(price_vs_sma200_pct) if price_vs_sma200_pct is not None else None,
+        'idx_entry_px': float(idx_entry_px) if pd.notna(idx_entry_px) else None,
+        'idx_entry_sma': float(idx_entry_sma) if pd.notna(idx_entry_sma) else None,
+        'idx_gap_vs_sma_entry_pct': float(idx_gap_vs_sma_pct) if idx_gap_vs_sma_pct is not None else None,
+        'idx_slope_entry_pct': float(slope * 100.0) if pd.notna(slope) else None,
+        'mkt_filter_ok_entry': bool(f['mkt_ok'][i]),
+        'vol_pct_entry': float(tr.vol_pct * 100.0),
+        'is_fast_be_entry': bool(tr.is_fast_be),
+        'is_strong_trend_entry': bool(tr.is_strong),
+        'TP_Regime_Source': tp_regime_source
+    }
 
-    s_val += np.where(
-        dist_m20 <= 0.01,
-        np.where(stock_df['Close'] >= mm20, cfg['W_DIST_M20'], cfg.get('PENALTY_MM20', -10)),
-        0
-    )
 
-    if cfg.get('FORCE_RS_POSITIVE', True):
-        mask_final = (rs_line > 0) & rs_momentum_ok
-        score = pd.Series(np.where(mask_final, s_val, 0), index=stock_df.index)
-    else:
-        score = pd.Series(np.where(rs_momentum_ok, s_val, 0), index=stock_df.index)
-
-    # --- Filtre marché ---
-    idx_close_on_stock_dates = idx_close.reindex(stock_df.index)
-    mkt_ok = (
-        (idx_close_on_stock_dates > idx_sma_on_stock_dates.reindex(stock_df.index)).fillna(False)
-        if cfg['MKT_FILTER']
-        else pd.Series(True, index=stock_df.index)
-    )
+def _v4_run_ticker(stock_df,
+                   bench,
+                   cfg: dict,
+                   features=None,
+                   walk_cache=None):
+    """
+    Simulation d'un ticker. bench : feature_engine.IndexFeatures de son
+    indice de référence. `features` : indicateurs déjà calculés par
+    feature_engine (tableaux alignés sur les barres du ticker) ; à défaut
+    ils sont calculés ici avec le même moteur. walk_cache : voir _V4Trade.walk.
+
+    Simulation par événements : les barres éligibles à l'entrée
+    (mkt_ok & price_filter_ok & score >= MIN_SCORE) sont repérées en une
+    passe vectorisée, la boucle saute de candidate en candidate ; chaque
+    trade (_V4Trade) est suivi jusqu'à sa sortie par le noyau walk_trade
+    (premier passage vectorisé ou boucle compilée selon ENGINE_BACKEND).
+    Le coût Python est proportionnel au nombre de trades, pas de barres.
+    """
+
+    # Ingestion unique (coercition / tri / dédoublonnage) ; no-op si on reçoit déjà des Bars
+    bars = Bars.from_frame(stock_df)
+
+    if features is None:
+        features = feature_engine.v4_ticker_features(bars, bench, cfg)
+    f = {name: np.asarray(v) for name, v in features.items()}
+
+    ticker_attrs = {'Ticker': bars.ticker if bars.ticker is not None else 'NA'}
+    dates = bars.index
+    close = bars.close
+
+    struct_ok = f['struct_ok']
+    atr_vec = f['atr_vec']
+    idx_slope = f['idx_slope']
+    idx_close = f['idx_close']
+
+    exclude_tp135_slow = cfg.get('EXCLUDE_TP135_SLOW', False)
 
-    # --- ATR ---
-    tr = v4_true_range(stock_df)
-    atr_vec = tr.rolling(cfg['ATR_P'], min_periods=cfg['ATR_P']).mean().shift(1).fillna(0.0)
+    walk_trade = kernels.get('walk_trade', cfg.get('ENGINE_BACKEND'))
+    locks = _v4_lock_params(cfg)
 
     ledger = []
     active_trade = None
 
-    start_i = max(
-        cfg['SMA_P'],
-        cfg.get('PRICE_SMA_P', 200) if cfg.get('USE_PRICE_SMA_FILTER', False) else 0
-    )
+    start_i = feature_engine.v4_first_entry_bar(cfg)
 
     skipped_tp135_slow = 0
 
+    # --- Barres candidates à l'entrée ---
+    with np.errstate(invalid='ignore'):
+        eligible = f['mkt_ok'] & f['price_filter_ok'] & (f['score'] >= cfg['MIN_SCORE'])
+    candidates = np.flatnonzero(eligible[start_i:]) + start_i
+
     # --- Boucle simulation ---
-    for date in stock_df.index[start_i:]:
-        row = stock_df.loc[date]
+    # Une entrée au close de la barre i est suivie par le noyau walk_trade
+    # à partir de i+1 ; la recherche d'entrée reprend à la première
+    # candidate après la barre de sortie.
+    k = 0
+    while k < len(candidates):
+        i = int(candidates[k])
+        k += 1
 
         # ======================================================
-        # Gestion du trade en cours
+        # Entrée
         # ======================================================
-        if active_trade is not None:
-            active_trade['bars_held'] += 1
-
-            h_perf = (row['High'] - active_trade['e_px']) / active_trade['e_px']
-            l_perf = (row['Low'] - active_trade['e_px']) / active_trade['e_px']
-            c_perf = (row['Close'] - active_trade['e_px']) / active_trade['e_px']
-
-            # --- Logging analytique continu ---
-            active_trade['mfe_pct'] = max(active_trade['mfe_pct'], float(h_perf))
-            active_trade['mae_pct'] = min(active_trade['mae_pct'], float(l_perf))
-            active_trade['max_close_pct'] = max(active_trade['max_close_pct'], float(c_perf))
-            active_trade['min_close_pct'] = min(active_trade['min_close_pct'], float(c_perf))
-
-            # BE déclenché sur la barre mais appliqué à partir de la suivante
-            be_eligible = active_trade['bars_held'] >= cfg['BE_DELAY']
-            be_triggered_this_bar = (
-                (not active_trade['be_hit'])
-                and (h_perf >= active_trade['be_trig'])
-                and be_eligible
-            )
+        slope = idx_slope[i]
+        c = close[i]
+        vol_pct = float(atr_vec[i] / c) if c != 0 else 0.0
 
-            # --- Profit Lock ---
-            if cfg.get('USE_PROFIT_LOCK', False):
-                if active_trade['mfe_pct'] >= cfg.get('LOCK2_TRIGGER', 0.10):
-                    active_trade['profit_lock_raw'] = cfg.get('LOCK2_RAW', 0.0356)
-                    active_trade['profit_lock_level'] = 'LOCK2'
-                elif active_trade['mfe_pct'] >= cfg.get('LOCK1_TRIGGER', 0.095):
-                    if active_trade['profit_lock_raw'] is None:
-                        active_trade['profit_lock_raw'] = cfg.get('LOCK1_RAW', 0.0206)
-                        active_trade['profit_lock_level'] = 'LOCK1'
-
-            # Stop effectif
-            effective_sl = cfg['FEES'] if active_trade['be_hit'] else -cfg['STOP_L']
-
-            # Si profit lock actif, il remonte le stop si plus protecteur
-            if active_trade.get('profit_lock_raw') is not None:
-                effective_sl = max(effective_sl, active_trade['profit_lock_raw'])
-
-            hit_tp = (h_perf >= active_trade['tp_val'])
-            hit_sl = (l_perf <= effective_sl)
-
-            if hit_tp or hit_sl:
-                raw_exit = effective_sl if hit_sl else active_trade['tp_val']
-
-                if hit_tp and not hit_sl:
-                    trade_type = 'TP'
-                    active_trade['bars_to_tp'] = active_trade['bars_held']
-                else:
-                    if active_trade.get('profit_lock_raw') is not None and effective_sl > cfg['FEES']:
-                        trade_type = active_trade.get('profit_lock_level', 'LOCK')
-                    else:
-                        trade_type = 'BE' if active_trade['be_hit'] else 'SL'
-                    active_trade['bars_to_sl'] = active_trade['bars_held']
-
-                # --- prix de sortie réel ---
-                exit_px_real = active_trade['e_px'] * (1.0 + raw_exit)
-
-                # --- benchmark à la sortie ---
-                idx_exit_px = idx_close.reindex(stock_df.index).loc[date] if date in idx_close.reindex(stock_df.index).index else None
-
-                trade = _close_trade_v4(
-                    tr=active_trade,
-                    date=date,
-                    exit_px=exit_px_real,
-                    exit_type=trade_type,
-                    stock_df_attrs=stock_df.attrs,
-                    idx_close_entry=active_trade.get('idx_entry_px'),
-                    idx_close_exit=float(idx_exit_px) if pd.notna(idx_exit_px) else None
-                )
-
-                ledger.append(trade)
-                active_trade = None
+        is_strong = bool((slope >= cfg['SLOPE_STRONG']) and bool(struct_ok[i]))
 
-            else:
-                if be_triggered_this_bar:
-                    active_trade['be_hit'] = True
-                    if active_trade['bars_to_be'] is None:
-                        active_trade['bars_to_be'] = active_trade['bars_held']
+        current_tp = cfg['TP_TREND']
+        if is_strong:
+            current_tp += cfg['TP_BOOST']
+        if slope < cfg['SLOPE_TRESH']:
+            current_tp = cfg['TP_RANGE']
 
-            continue
+        is_fast_be = bool(slope >= 0.004 and vol_pct < cfg['VOL_LIM'])
+        current_be_trig = cfg['BE_F'] if is_fast_be else cfg['BE_S']
 
         # ======================================================
-        # Entrée
+        # Filtre demandé : exclure TP13.5 + SLOW
         # ======================================================
-        if (
-            bool(mkt_ok.loc[date])
-            and bool(price_filter_ok.loc[date])
-            and float(score.loc[date]) >= cfg['MIN_SCORE']
-        ):
-            slope = idx_slope_on_stock_dates.reindex(stock_df.index).loc[date]
-            vol_pct = float(atr_vec.loc[date] / row['Close']) if row['Close'] != 0 else 0.0
-
-            is_strong = (slope >= cfg['SLOPE_STRONG']) and bool(struct_ok.loc[date])
-
-            current_tp = cfg['TP_TREND']
-            if is_strong:
-                current_tp += cfg['TP_BOOST']
-            if slope < cfg['SLOPE_TRESH']:
-                current_tp = cfg['TP_RANGE']
-
-            is_fast_be = (slope >= 0.004 and vol_pct < cfg['VOL_LIM'])
-            current_be_trig = cfg['BE_F'] if is_fast_be else cfg['BE_S']
-
-            # ======================================================
-            # Filtre demandé : exclure TP13.5 + SLOW
-            # ======================================================
-            if cfg.get('EXCLUDE_TP135_SLOW', False):
-                is_tp_135 = abs(current_tp - cfg['TP_TREND']) < 1e-12
-                is_slow = not is_fast_be
-                if is_tp_135 and is_slow:
-                    skipped_tp135_slow += 1
-                    continue
-
-            # --- enrichissement contexte d'entrée ---
-            tp_regime_source = 'TREND'
-            if is_strong:
-                tp_regime_source = 'TREND_BOOST'
-            if slope < cfg['SLOPE_TRESH']:
-                tp_regime_source = 'RANGE'
-
-            idx_entry_px = idx_close.reindex(stock_df.index).loc[date]
-            idx_entry_sma = idx_sma_on_stock_dates.reindex(stock_df.index).loc[date]
-
-            idx_gap_vs_sma_pct = None
-            if pd.notna(idx_entry_px) and pd.notna(idx_entry_sma) and idx_entry_sma != 0:
-                idx_gap_vs_sma_pct = ((float(idx_entry_px) / float(idx_entry_sma)) - 1.0) * 100.0
-
-            price_sma_entry = price_sma.loc[date] if date in price_sma.index else np.nan
-            price_vs_sma200_pct = None
-            if pd.notna(price_sma_entry) and price_sma_entry != 0:
-                price_vs_sma200_pct = ((float(row['Close']) / float(price_sma_entry)) - 1.0) * 100.0
-
-            rs_sma_entry = rs_sma.loc[date] if date in rs_sma.index else np.nan
-
-            active_trade = {
-                'date': date,
-                'e_px': float(row['Close']),
-                'size': float(cfg['SIZE']),
-                'fees': float(cfg['FEES']),
-                'tp_val': float(current_tp),
-                'be_trig': float(current_be_trig),
-                'be_type': 'FAST' if is_fast_be else 'SLOW',
-                'be_hit': False,
-                'bars_held': 0,
-
-                # --- Profit lock state ---
-                'profit_lock_raw': None,
-                'profit_lock_level': None,
-
-                # --- Logging analytique existant ---
-                'mfe_pct': 0.0,
-                'mae_pct': 0.0,
-                'max_close_pct': 0.0,
-                'min_close_pct': 0.0,
-                'bars_to_be': None,
-                'bars_to_tp': None,
-                'bars_to_sl': None,
-
-                # ======================================================
-                # NOUVEAUX CHAMPS D'ANALYSE A L'ENTREE
-                # ======================================================
-                'Score_Entry': float(score.loc[date]),
-                'RS_Line_Entry': float(rs_line.loc[date]),
-                'RS_SMA_Entry': float(rs_sma_entry) if pd.notna(rs_sma_entry) else None,
-                'RS_Momentum_OK_Entry': bool(rs_momentum_ok.loc[date]),
-                'RSI_Entry': float(rsi.loc[date]),
-                'Volume_Ratio_Entry': float(vratio.loc[date]) if pd.notna(vratio.loc[date]) else None,
-                'Dist_M20_Entry_Pct': float(dist_m20.loc[date] * 100.0),
-                'Squeeze_Flag_Entry': bool(sqz_flag.loc[date]),
-                'Structure_Label_Entry': struct_label.loc[date],
-                'Structure_OK_Entry': bool(struct_ok.loc[date]),
-                'Price_Filter_OK_Entry': bool(price_filter_ok.loc[date]),
-                'Price_vs_SMA200_Entry_Pct': float(price_vs_sma200_pct) if price_vs_sma200_pct is not None else None,
-                'idx_entry_px': float(idx_entry_px) if pd.notna(idx_entry_px) else None,
-                'idx_entry_sma': float(idx_entry_sma) if pd.notna(idx_entry_sma) else None,
-                'idx_gap_vs_sma_entry_pct': float(idx_gap_vs_sma_pct) if idx_gap_vs_sma_pct is not None else None,
-                'idx_slope_entry_pct': float(slope * 100.0) if pd.notna(slope) else None,
-                'mkt_filter_ok_entry': bool(mkt_ok.loc[date]),
-                'vol_pct_entry': float(vol_pct * 100.0),
-                'is_fast_be_entry': bool(is_fast_be),
-                'is_strong_trend_entry': bool(is_strong),
-                'TP_Regime_Source': tp_regime_source
-            }
+        if exclude_tp135_slow:
+            is_tp_135 = abs(current_tp - cfg['TP_TREND']) < 1e-12
+            if is_tp_135 and not is_fast_be:
+                skipped_tp135_slow += 1
+                continue
+
+        active_trade = _V4Trade(
+            i, float(c), slope, vol_pct, float(current_tp), float(current_be_trig), is_fast_be, is_strong
+        )
+        exit_i, exit_code, raw_exit = active_trade.walk(walk_trade, bars, cfg, locks, cache=walk_cache)
+
+        if exit_code == kernels.EXIT_OPEN:
+            break
+
+        tr = _v4_trade_context(active_trade, f, dates, close, cfg)
+        if exit_code == kernels.EXIT_TP:
+            trade_type = 'TP'
+            tr['bars_to_tp'] = tr['bars_held']
+        else:
+            if exit_code == kernels.EXIT_LOCK:
+                trade_type = tr['profit_lock_level']
+            else:
+                trade_type = 'BE' if exit_code == kernels.EXIT_BE else 'SL'
+            tr['bars_to_sl'] = tr['bars_held']
+
+        # --- benchmark à la sortie ---
+        idx_exit_px = idx_close[exit_i]
+
+        ledger.append(_close_trade_v4(
+            tr=tr,
+            date=dates[exit_i],
+            exit_px=tr['e_px'] * (1.0 + raw_exit),
+            exit_type=trade_type,
+            stock_df_attrs=ticker_attrs,
+            idx_close_entry=tr.get('idx_entry_px'),
+            idx_close_exit=float(idx_exit_px) if pd.notna(idx_exit_px) else None
+        ))
+        active_trade = None
+        k = int(np.searchsorted(candidates, exit_i, side='right'))
 
     # --- Trade en cours ---
     open_trade = None
     if active_trade is not None:
-        last_close = float(stock_df.iloc[-1]['Close'])
-        perf_actuelle = (last_close - active_trade['e_px']) / active_trade['e_px']
+        tr = _v4_trade_context(active_trade, f, dates, close, cfg)
+        last_close = float(close[-1])
+        perf_actuelle = (last_close - tr['e_px']) / tr['e_px']
 
         open_trade = {
-            'Ticker': stock_df.attrs.get('Ticker', 'NA'),
-            'Date_Achat': active_trade['date'].strftime('%Y-%m-%d'),
-            'Prix_Entree': round(active_trade['e_px'], 2),
+            'Ticker': ticker_attrs['Ticker'],
+            'Date_Achat': tr['date'].strftime('%Y-%m-%d'),
+            'Prix_Entree': round(tr['e_px'], 2),
             'Prix_Actuel': round(last_close, 2),
             'Perf_Latente_Pct': round(perf_actuelle * 100, 2),
-            'Objectif_TP_Pct': round(active_trade['tp_val'] * 100, 2),
-            'Seuil_BE_Pct': round(active_trade['be_trig'] * 100, 2),
-            'Configuration_BE': active_trade['be_type'],
-            'Statut_BE': 'SECURISE (BE)' if active_trade['be_hit'] else 'A RISQUE (SL)',
-            'Bars_Held': active_trade['bars_held'],
+            'Objectif_TP_Pct': round(tr['tp_val'] * 100, 2),
+            'Seuil_BE_Pct': round(tr['be_trig'] * 100, 2),
+            'Configuration_BE': tr['be_type'],
+            'Statut_BE': 'SECURISE (BE)' if tr['be_hit'] else 'A RISQUE (SL)',
+            'Bars_Held': tr['bars_held'],
 
             # --- Logging analytique ---
-            'MFE_Pct': round(active_trade['mfe_pct'] * 100, 2),
-            'MAE_Pct': round(active_trade['mae_pct'] * 100, 2),
-            'Max_Close_Pct': round(active_trade['max_close_pct'] * 100, 2),
-            'Min_Close_Pct': round(active_trade['min_close_pct'] * 100, 2),
-            'Bars_to_BE': active_trade['bars_to_be'],
+            'MFE_Pct': round(tr['mfe_pct'] * 100, 2),
+            'MAE_Pct': round(tr['mae_pct'] * 100, 2),
+            'Max_Close_Pct': round(tr['max_close_pct'] * 100, 2),
+            'Min_Close_Pct': round(tr['min_close_pct'] * 100, 2),
+            'Bars_to_BE': tr['bars_to_be'],
 
             # --- Profit lock ---
-            'Profit_Lock_Level': active_trade.get('profit_lock_level', None),
-            'Profit_Lock_Raw_Pct': round(active_trade['profit_lock_raw'] * 100, 2)
-            if active_trade.get('profit_lock_raw') is not None else None
+            'Profit_Lock_Level': tr.get('profit_lock_level', None),
+            'Profit_Lock_Raw_Pct': round(tr['profit_lock_raw'] * 100, 2)
+            if tr.get('profit_lock_raw') is not None else None
         }
 
-    df_ledger = pd.DataFrame(ledger)
+    gains = np.array([t['Gain'] for t in ledger], dtype=float)
     stats = {
-        'nb_trades': int(len(df_ledger)),
-        'gain_total': float(df_ledger['Gain'].sum()) if len(df_ledger) else 0.0,
-        'win_rate': float((df_ledger['Gain'] > 0).mean()) if len(df_ledger) else 0.0,
+        'nb_trades': int(len(gains)),
+        'gain_total': float(gains.sum()) if len(gains) else 0.0,
+        'win_rate': float((gains > 0).mean()) if len(gains) else 0.0,
         'skipped_tp135_slow': int(skipped_tp135_slow)
     }
 
@@ -991,81 +928,304 @@ def _apply_cash_allocator(candidate_trades, candidate_open_positions, cfg):
 # Moteur multi-tickers
 # ===========================
 
-def alpha4(cfg):
-    client = bigquery.Client(project=cfg['PROJECT'])
-
-    if cfg.get('USE_DAYS_BACK_FILTER', False):
-        days_back = int(cfg.get('DAYS_BACK_FROM_TODAY', 365))
-        days_back = max(days_back, 365)
-        start_date = (pd.Timestamp.today().normalize() - pd.Timedelta(days=days_back)).strftime('%Y-%m-%d')
-
-        query = f"""
-            SELECT *
-            FROM `{cfg['DB_SET']}.{cfg['TBL']}`
-            WHERE Date >= DATE('{start_date}')
-            ORDER BY Date ASC
-        """
-    else:
-        query = f"SELECT * FROM `{cfg['DB_SET']}.{cfg['TBL']}` ORDER BY Date ASC"
-
-    df = client.query(query).to_dataframe()
-    df['Date'] = pd.to_datetime(df['Date']).dt.tz_localize(None)
-
-    for c in ['Close', 'High', 'Low', 'Volume']:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-
-    # Déduplication sécurité
-    df = df.sort_values(['Ticker', 'Date'])
-    df = df.drop_duplicates(subset=['Ticker', 'Date'], keep='last').reset_index(drop=True)
-
-    idx_ticker = cfg['IDX']
-    base_idx = (
-        df[df['Ticker'] == idx_ticker]
-        .copy()
-        .drop_duplicates(subset=['Date'], keep='last')
-        .set_index('Date')
-        .sort_index()
+_V4_QUALITY_KEYS = ('nan_close', 'nan_high_low', 'zero_volume', 'duplicate_dates')
+
+
+def _v4_stream_frames(cfg, load_kwargs, benchmarks, universe):
+    """
+    Mode streaming : un ticker à la fois depuis market_store, les lignes
+    brutes sont relâchées dès que le ticker a été simulé.
+    `universe` est complété au fil de l'eau (pour les métadonnées).
+    """
+    stream_tickers = sorted(cfg['UNIVERSE']) if cfg['UNIVERSE'] else None
+
+    for t, d in market_store.iter_history_by_ticker(tickers=stream_tickers, **load_kwargs):
+        if t in benchmarks:
+            continue
+        universe.append(t)
+        yield t, Bars.from_frame(d, ticker=t), None
+
+
+def _v4_load_kwargs(cfg):
+    """Filtres poussés dans la requête : colonnes moteur, fenêtre, historique minimum."""
+    return dict(
+        project=cfg['PROJECT'],
+        dataset=cfg['DB_SET'],
+        table=cfg['TBL'],
+        start_date=_v4_history_start(cfg),
+        min_rows=int(cfg.get('MIN_HISTORY_BARS', 100)),
+        keep_tickers=_v4_benchmarks(cfg),
+        use_store=cfg.get('USE_LOCAL_STORE', True),
+        store_dir=cfg.get('STORE_DIR')
     )
 
-    idx_close = base_idx['Close']
-    idx_sma = idx_close.rolling(cfg['SMA_P'], min_periods=cfg['SMA_P']).mean()
-    idx_slope = ((idx_sma - idx_sma.shift(4)) / idx_sma.shift(4)).fillna(0)
 
-    universe = [t for t in sorted(df['Ticker'].dropna().unique()) if t != idx_ticker]
+def _v4_benchmarks(cfg):
+    """Indices de référence du run : IDX puis ceux de BENCHMARK_MAP (hors univers simulé)."""
+    out = [cfg['IDX']]
+    for b in (cfg.get('BENCHMARK_MAP') or {}).values():
+        if b not in out:
+            out.append(b)
+    return out
+
+
+def _v4_benchmark_of(cfg, ticker):
+    return (cfg.get('BENCHMARK_MAP') or {}).get(ticker, cfg['IDX'])
+
+
+def _v4_query_tickers(cfg):
+    return sorted(set(cfg['UNIVERSE']) | set(_v4_benchmarks(cfg))) if cfg['UNIVERSE'] else None
+
+
+def _v4_universe(cfg, panel):
+    benchmarks = set(_v4_benchmarks(cfg))
+    universe = [t for t in panel.tickers if t not in benchmarks]
     if cfg['UNIVERSE']:
         universe = [t for t in universe if t in cfg['UNIVERSE']]
+    return universe
 
-    all_candidate_trades = []
-    all_candidate_open_positions = []
-    per_ticker_stats = {}
 
-    for t in universe:
-        d = (
-            df[df['Ticker'] == t]
-            .copy()
-            .drop_duplicates(subset=['Ticker', 'Date'], keep='last')
-            .set_index('Date')
-            .sort_index()
+def _v4_index_features(panel_or_frame, cfg):
+    """
+    {indice: IndexFeatures} pour SMA_P, depuis un MarketPanel ou un DataFrame
+    long (streaming). Partagés via le cache de feature_engine : un même
+    indice n'est calculé qu'une fois par (indice, SMA_P, données).
+    """
+    sma_p = int(cfg['SMA_P'])
+    out = {}
+    for b in _v4_benchmarks(cfg):
+        if isinstance(panel_or_frame, pd.DataFrame):
+            d = panel_or_frame[panel_or_frame['Ticker'] == b]
+            close = d.set_index('Date')['Close']
+        else:
+            close = panel_or_frame.ticker_series(b, 'Close')
+        out[b] = feature_engine.index_features(close, sma_p, ticker=b)
+    return out
+
+
+# ===========================
+# État chaud (warm start)
+# ===========================
+
+def build_v4_warm_state(cfg=None):
+    """
+    Panel de la config par défaut, rechargé sans cache ; les features des
+    indices (SMA / pente pour SMA_P) sont préchargées dans le cache partagé.
+    Appelé par V4_WARM au démarrage et après la clôture. store_rev : version
+    du store dont le panel est issu (None sans store local).
+    """
+    cfg = cfg or ALPHA4_CFG
+    load_kwargs = _v4_load_kwargs(cfg)
+    tickers = _v4_query_tickers(cfg)
+
+    panel = market_store.load_panel(tickers=tickers, refresh=True, **load_kwargs)
+    store_rev = None
+    if load_kwargs['use_store']:
+        store_rev = market_store.store_revision(
+            load_kwargs['project'], load_kwargs['dataset'], load_kwargs['table'],
+            store_dir=load_kwargs['store_dir'], sync=False
         )
-        d.attrs['Ticker'] = t
+    for bench in _v4_index_features(panel, cfg).values():
+        bench.on_axis(panel.dates)
+
+    return {
+        'load_kwargs': load_kwargs,
+        'tickers': tickers,
+        'idx_ticker': cfg['IDX'],
+        'panel': panel,
+        'store_rev': store_rev,
+    }
+
+
+V4_WARM = BackgroundRefresher('alpha4', build_v4_warm_state)
+
+
+def _v4_warm_state_for(cfg, load_kwargs, tickers):
+    """
+    État chaud utilisable pour cette requête (même fenêtre, univers inclus,
+    moins de REFRESH_CFG['MAX_AGE_S'], store inchangé depuis sa construction),
+    sinon None : rechargement par market_store. Des barres arrivées dans le
+    store depuis (synchronisation au plus tous les SYNC_MIN_INTERVAL_S)
+    déclenchent aussi la reconstruction de l'état chaud.
+    """
+    warm = V4_WARM.fresh()
+    if warm is None or warm['idx_ticker'] != cfg['IDX'] or warm['load_kwargs'] != load_kwargs:
+        return None
+    if warm['tickers'] is not None and (tickers is None or not set(tickers) <= set(warm['tickers'])):
+        return None
+    if warm.get('store_rev') is not None:
+        rev = market_store.store_revision(
+            load_kwargs['project'], load_kwargs['dataset'], load_kwargs['table'],
+            store_dir=load_kwargs['store_dir']
+        )
+        if rev != warm['store_rev']:
+            V4_WARM.trigger()
+            return None
+    return warm
 
-        if len(d) < 100:
-            continue
 
-        stats, trades, open_trade = _v4_run_ticker(
-            d,
-            idx_close,
+def _v4_source(cfg, shard_tickers=None):
+    """
+    Données d'un run : ({indice: IndexFeatures}, universe, frames, snapshot).
+    frames produit (ticker, Bars, features) pour les tickers simulables
+    (features = None en streaming : calcul par ticker) ; shard_tickers
+    limite la simulation à une partie de l'univers (même panel, même clé de cache).
+    snapshot : version des données de tout l'univers pour le feature store
+    (FEATURE_SNAPSHOT fixé par le coordinateur, sinon calculé ici ; None si
+    FEATURE_STORE est désactivé).
+    """
+    min_history = int(cfg.get('MIN_HISTORY_BARS', 100))
+
+    tickers = _v4_query_tickers(cfg)
+    load_kwargs = _v4_load_kwargs(cfg)
+    benchmarks = _v4_benchmarks(cfg)
+    snapshot = cfg.get('FEATURE_SNAPSHOT') if cfg.get('FEATURE_STORE', False) else None
+
+    if cfg.get('STREAMING_MODE', False):
+        # Mémoire bornée par un ticker + la liste des candidats
+        if cfg.get('FEATURE_STORE', False) and snapshot is None:
+            snapshot = feature_store.history_snapshot(market_store.history_stats(tickers=tickers, **load_kwargs))
+
+        idx_df = market_store.load_history(tickers=benchmarks, **load_kwargs)
+        benches = _v4_index_features(idx_df, cfg)
+
+        stream_cfg = dict(cfg, UNIVERSE=shard_tickers) if shard_tickers is not None else cfg
+        universe = []
+        frames = _v4_stream_frames(stream_cfg, load_kwargs, set(benchmarks), universe)
+    else:
+        warm = _v4_warm_state_for(cfg, load_kwargs, tickers)
+        if warm is not None:
+            panel = warm['panel']
+        else:
+            panel = market_store.load_panel(tickers=tickers, **load_kwargs)
+        benches = _v4_index_features(panel, cfg)
+
+        universe = _v4_universe(cfg, panel)
+        if shard_tickers is not None:
+            shard = set(shard_tickers)
+            universe = [t for t in universe if t in shard]
+
+        if cfg.get('FEATURE_STORE', False) and snapshot is None:
+            snapshot = feature_store.panel_snapshot(panel)
+
+        # indicateurs calculés par blocs de tickers (matrices 2D)
+        simulated = [t for t in universe if panel.bar_count(t) >= min_history]
+        frames = feature_engine.iter_v4_panel_features(
+            panel,
+            simulated,
             cfg,
-            idx_sma.reindex(d.index),
-            idx_slope.reindex(d.index)
+            {t: benches[_v4_benchmark_of(cfg, t)] for t in simulated},
+            block=int(cfg.get('FEATURE_BLOCK_TICKERS', feature_engine.FEATURE_BLOCK_TICKERS))
+        )
+
+    return benches, universe, frames, snapshot
+
+
+def _v4_simulate(cfg, benches, t, bars, features, walk_cache=None):
+    """
+    Simulation d'un ticker -> record compact (stats, trades, position ouverte,
+    qualité). trades reste en table {columns, rows} (format des shards)
+    jusqu'à _v4_finalize : les candidats de tout l'univers ne sont jamais
+    tous en dicts pendant le scan.
+    """
+    bench = benches[_v4_benchmark_of(cfg, t)]
+    stats, trades, open_trade = _v4_run_ticker(bars, bench, cfg, features=features, walk_cache=walk_cache)
+    return {
+        'ticker': t,
+        'stats': stats,
+        'trades': sharding.encode_records(trades),
+        'open_trade': open_trade,
+        'quality': {k: bars.quality[k] for k in _V4_QUALITY_KEYS},
+        'flagged': bars.has_quality_issues()
+    }
+
+
+def _v4_scan(cfg, shard_tickers=None):
+    """
+    Map : simule chaque ticker indépendamment.
+    Retourne (universe, records) ; un record par ticker simulé, dans l'ordre de l'univers.
+    EXECUTOR='threads' : simulations sur un pool de threads, features calculées
+    par blocs dans le thread appelant ; 'processes' : voir _v4_scan_processes.
+    """
+    executor = sharding.check_executor(cfg.get('EXECUTOR') or 'serial')
+    if executor == 'processes':
+        return _v4_scan_processes(cfg, shard_tickers)
+
+    min_history = int(cfg.get('MIN_HISTORY_BARS', 100))
+    benches, universe, frames, snapshot = _v4_source(cfg, shard_tickers)
+
+    writer = None
+    if cfg.get('FEATURE_STORE', False):
+        writer = feature_store.FeatureWriter(
+            cfg['DB_SET'], cfg['TBL'], cfg, snapshot=snapshot, store_dir=cfg.get('FEATURE_STORE_DIR')
         )
 
-        per_ticker_stats[t] = stats
-        all_candidate_trades.extend(trades)
+    def _jobs():
+        for t, bars, features in frames:
+            if len(bars) < min_history:
+                continue
+            if writer is not None:
+                if features is None:
+                    features = feature_engine.v4_ticker_features(bars, benches[_v4_benchmark_of(cfg, t)], cfg)
+                writer.add(t, bars, features)
+            yield t, bars, features
+
+    records = list(sharding.map_ordered(
+        lambda job: _v4_simulate(cfg, benches, *job),
+        _jobs(),
+        executor=executor,
+        max_workers=cfg.get('MAX_WORKERS')
+    ))
+
+    if writer is not None:
+        writer.close()
+
+    return universe, records
 
-        if open_trade:
-            all_candidate_open_positions.append(open_trade)
+
+def _v4_scan_processes(cfg, shard_tickers=None):
+    """
+    EXECUTOR='processes' : lots de tickers pondérés par le nombre de barres
+    (CHUNKS_PER_WORKER lots par worker, les plus lourds d'abord) exécutés par
+    alpha4_shard sur un pool de processus. Chaque lot renvoie le format
+    compact des shards ; fusion dans l'ordre de l'univers.
+    """
+    universe, eligible, weights, snapshot = _v4_plan_universe(cfg, shard_tickers)
+    workers = sharding.resolve_workers(cfg.get('MAX_WORKERS'))
+    chunks = sharding.plan_chunks(eligible, weights, workers)
+
+    chunk_cfg = dict(cfg, EXECUTOR='serial', SHARDS=0, FEATURE_SNAPSHOT=snapshot)
+    results = sharding.map_shards(
+        alpha4_shard,
+        [{'cfg': chunk_cfg, 'tickers': c} for c in chunks],
+        mode='processes',
+        max_workers=workers
+    )
+    return universe, _v4_merge_shards(results, eligible)
+
+
+def _v4_finalize(cfg, universe, records):
+    """Reduce : agrège les records par ticker puis applique l'allocator une seule fois."""
+    all_candidate_trades = []
+    all_candidate_open_positions = []
+    per_ticker_stats = {}
+
+    quality_totals = defaultdict(int)
+    quality_flagged = []
+
+    for rec in records:
+        t = rec['ticker']
+
+        for k in _V4_QUALITY_KEYS:
+            quality_totals[k] += rec['quality'][k]
+        if rec['flagged']:
+            quality_flagged.append(t)
+
+        per_ticker_stats[t] = rec['stats']
+        all_candidate_trades.extend(sharding.decode_records(rec['trades']))
+
+        if rec['open_trade']:
+            all_candidate_open_positions.append(rec['open_trade'])
 
     if cfg.get('USE_CASH_ALLOCATOR', True):
         portfolio_trades, portfolio_open_positions, allocator_metadata = _apply_cash_allocator(
@@ -1099,7 +1259,8 @@ def alpha4(cfg):
             'total_skipped_tp135_slow': total_skipped,
             'use_days_back_filter': cfg.get('USE_DAYS_BACK_FILTER', False),
             'days_back_from_today': cfg.get('DAYS_BACK_FROM_TODAY', None) if cfg.get('USE_DAYS_BACK_FILTER', False) else None,
-            'use_cash_allocator': cfg.get('USE_CASH_ALLOCATOR', True)
+            'use_cash_allocator': cfg.get('USE_CASH_ALLOCATOR', True),
+            'data_quality': dict(quality_totals, tickers_flagged=quality_flagged)
         },
         'portfolio': {
             'gain_total': float(df_ledger[gain_col].sum()) if len(df_ledger) else 0.0,
@@ -1113,6 +1274,352 @@ def alpha4(cfg):
     }
 
 
+# ===========================
+# Exécution shardée (map-reduce)
+# ===========================
+
+def _v4_encode_shard(universe, records):
+    """Format compact d'un shard : colonnes par ticker + table unique des trades."""
+    # tables des records concaténées (lignes d'un autre jeu de colonnes : en dicts)
+    columns = next((rec['trades']['columns'] for rec in records if rec['trades']['columns']), [])
+    rows = []
+    for rec in records:
+        if rec['trades']['columns'] == columns:
+            rows.extend(rec['trades']['rows'])
+        else:
+            rows.extend(sharding.decode_records(rec['trades']))
+    return {
+        'format_version': sharding.SHARD_FORMAT_VERSION,
+        'universe': universe,
+        'tickers': [rec['ticker'] for rec in records],
+        'stats': [rec['stats'] for rec in records],
+        'trade_counts': [len(rec['trades']['rows']) for rec in records],
+        'trades': {'columns': columns, 'rows': rows},
+        'open_trades': [rec['open_trade'] for rec in records],
+        'quality': [[rec['quality'][k] for k in _V4_QUALITY_KEYS] for rec in records],
+        'flagged': [rec['flagged'] for rec in records],
+    }
+
+
+def _v4_decode_shard(payload):
+    if payload.get('format_version') != sharding.SHARD_FORMAT_VERSION:
+        raise ValueError(f"Format de shard incompatible : {payload.get('format_version')!r}")
+
+    columns, rows = payload['trades']['columns'], payload['trades']['rows']
+    records = []
+    pos = 0
+    for i, t in enumerate(payload['tickers']):
+        n = payload['trade_counts'][i]
+        records.append({
+            'ticker': t,
+            'stats': payload['stats'][i],
+            'trades': {'columns': columns, 'rows': rows[pos:pos + n]},
+            'open_trade': payload['open_trades'][i],
+            'quality': dict(zip(_V4_QUALITY_KEYS, payload['quality'][i])),
+            'flagged': payload['flagged'][i]
+        })
+        pos += n
+    return records
+
+
+def alpha4_shard(cfg, tickers):
+    """
+    Map d'un shard : simule `tickers` (sous-ensemble de l'univers de cfg)
+    et retourne le résultat compact, sérialisable en JSON.
+    """
+    cfg = dict(ALPHA4_CFG, **cfg)
+    universe, records = _v4_scan(cfg, shard_tickers=list(tickers))
+    return _v4_encode_shard(universe, records)
+
+
+# Paramètres serveur (exécution, chemins, projet) : lus dans ALPHA4_CFG /
+# l'environnement seulement, ignorés dans la configuration d'une requête
+_V4_SERVER_KEYS = frozenset({
+    'PROJECT', 'STORE_DIR', 'FEATURE_STORE_DIR',
+    'EXECUTOR', 'MAX_WORKERS', 'SHARDS', 'SHARD_MODE', 'SHARD_URLS', 'SHARD_TIMEOUT_S',
+})
+
+# Valeurs de requête reprises dans des chemins du store / des requêtes SQL
+_V4_REQUEST_FORMATS = {
+    'DB_SET': re.compile(r'[A-Za-z0-9_]+'),
+    'TBL': re.compile(r'[A-Za-z0-9_]+'),
+    'FEATURE_SNAPSHOT': re.compile(r'(\d{8}|empty)-[0-9a-f]{12}'),
+}
+
+
+def _v4_check_request(params):
+    for k, fmt in _V4_REQUEST_FORMATS.items():
+        v = params.get(k)
+        if v is not None and not (isinstance(v, str) and fmt.fullmatch(v)):
+            raise ValueError(f"Valeur invalide pour {k} : {v!r}")
+
+
+def request_cfg(overrides=None):
+    """
+    Configuration d'une requête HTTP (/run_test3, /alpha4_sweep,
+    /alpha4_shard) : ALPHA4_CFG + overrides, sans les paramètres serveur
+    (_V4_SERVER_KEYS, ignorés) ; DB_SET / TBL / FEATURE_SNAPSHOT validés.
+    """
+    overrides = {k: v for k, v in dict(overrides or {}).items() if k not in _V4_SERVER_KEYS}
+    _v4_check_request(overrides)
+    return dict(ALPHA4_CFG, **overrides)
+
+
+def _v4_plan_universe(cfg, shard_tickers=None):
+    """
+    Plan du coordinateur : univers (complet ou restreint à shard_tickers),
+    tickers simulables, nombre de barres par ticker (poids des shards) et
+    snapshot du feature store commun à tous les shards / lots (None si
+    FEATURE_STORE est désactivé).
+    En streaming, tout vient de market_store.history_stats : le panel
+    complet n'est jamais chargé.
+    """
+    min_history = int(cfg.get('MIN_HISTORY_BARS', 100))
+    load_kwargs = _v4_load_kwargs(cfg)
+    tickers = _v4_query_tickers(cfg)
+    feature_on = cfg.get('FEATURE_STORE', False)
+    snapshot = cfg.get('FEATURE_SNAPSHOT') if feature_on else None
+
+    if cfg.get('STREAMING_MODE', False):
+        stats = market_store.history_stats(tickers=tickers, **load_kwargs)
+        benchmarks = set(_v4_benchmarks(cfg))
+        universe = [t for t in stats if t not in benchmarks]
+        if cfg['UNIVERSE']:
+            universe = [t for t in universe if t in cfg['UNIVERSE']]
+        weights = {t: stats[t]['rows'] for t in universe}
+        if feature_on and snapshot is None:
+            snapshot = feature_store.history_snapshot(stats)
+    else:
+        warm = _v4_warm_state_for(cfg, load_kwargs, tickers)
+        panel = warm['panel'] if warm is not None else market_store.load_panel(tickers=tickers, **load_kwargs)
+        universe = _v4_universe(cfg, panel)
+        weights = {t: panel.bar_count(t) for t in universe}
+        if feature_on and snapshot is None:
+            snapshot = feature_store.panel_snapshot(panel)
+
+    if shard_tickers is not None:
+        keep = set(shard_tickers)
+        universe = [t for t in universe if t in keep]
+
+    eligible = [t for t in universe if weights[t] >= min_history]
+    return universe, eligible, [weights[t] for t in eligible], snapshot
+
+
+def _v4_merge_shards(results, eligible):
+    """Records des shards remis dans l'ordre de l'univers (indépendant de l'ordre d'exécution)."""
+    by_ticker = {}
+    for payload in results:
+        for rec in _v4_decode_shard(payload):
+            by_ticker[rec['ticker']] = rec
+    return [by_ticker[t] for t in eligible if t in by_ticker]
+
+
+def _v4_alpha4_sharded(cfg):
+    """
+    Coordinateur : découpe l'univers en SHARDS shards (équilibrés en nombre
+    de barres), exécute les shards puis fusionne dans l'ordre de l'univers
+    avant l'allocator (résultat identique au run mono-processus).
+    """
+    universe, eligible, weights, snapshot = _v4_plan_universe(cfg)
+    shards = sharding.plan_shards(eligible, weights, int(cfg['SHARDS']))
+
+    shard_cfg = dict(cfg, SHARDS=0, FEATURE_SNAPSHOT=snapshot)
+    payloads = [{'cfg': shard_cfg, 'tickers': s} for s in shards]
+
+    results = sharding.map_shards(
+        alpha4_shard,
+        payloads,
+        mode=cfg.get('SHARD_MODE', 'processes'),
+        urls=cfg.get('SHARD_URLS'),
+        path='/alpha4_shard',
+        max_workers=len(shards),
+        timeout_s=cfg.get('SHARD_TIMEOUT_S')
+    )
+
+    return _v4_finalize(cfg, universe, _v4_merge_shards(results, eligible))
+
+
+def alpha4(cfg):
+    if int(cfg.get('SHARDS', 0) or 0) > 1:
+        return _v4_alpha4_sharded(cfg)
+
+    universe, records = _v4_scan(cfg)
+    return _v4_finalize(cfg, universe, records)
+
+
+# ===========================
+# Sweep de paramètres (grille)
+# ===========================
+
+# Paramètres sans effet sur les données ni sur les indicateurs : les points
+# qui ne diffèrent que par ceux-ci partagent chargement et features.
+_V4_SWEEP_SIM_KEYS = frozenset({
+    'MIN_SCORE', 'EXCLUDE_TP135_SLOW',
+    'TP_TREND', 'TP_RANGE', 'TP_BOOST', 'SLOPE_TRESH', 'SLOPE_STRONG',
+    'BE_F', 'BE_S', 'BE_DELAY', 'VOL_LIM',
+    'USE_PROFIT_LOCK', 'LOCK1_TRIGGER', 'LOCK1_RAW', 'LOCK2_TRIGGER', 'LOCK2_RAW',
+    'STOP_L', 'FEES',
+    'INITIAL_CASH', 'USE_CASH_ALLOCATOR', 'POSITION_SIZE_MODE', 'SIZE', 'MIN_ORDER_EUR',
+    'MAX_OPEN_POSITIONS', 'MAX_TOTAL_EXPOSURE_PCT', 'MIN_CASH_BUFFER_PCT',
+    'MAX_NEW_ENTRIES_PER_DAY', 'ENTRY_PRIORITY',
+})
+
+# Paramètres d'exécution : réglés par le sweep, interdits dans la grille
+_V4_SWEEP_RUN_KEYS = frozenset({
+    'EXECUTOR', 'MAX_WORKERS', 'SHARDS', 'SHARD_MODE', 'SHARD_URLS', 'SHARD_TIMEOUT_S',
+    'STREAMING_MODE', 'FEATURE_STORE', 'FEATURE_STORE_DIR', 'FEATURE_SNAPSHOT', 'SCORE_PRUNING',
+})
+
+SWEEP_METRICS = (
+    'gain_total', 'nb_trades', 'win_rate', 'ending_cash', 'max_exposure_eur',
+    'rejected_entries_count', 'candidate_trades', 'open_positions',
+)
+
+
+def _v4_sweep_points(grid):
+    """dict param -> valeurs (produit cartésien, ordre des clés) ou liste de dicts (points explicites)."""
+    if isinstance(grid, dict):
+        keys = list(grid)
+        values = [v if isinstance(v, (list, tuple)) else [v] for v in grid.values()]
+        points = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    else:
+        points = [dict(p) for p in grid]
+
+    for p in points:
+        unknown = sorted(k for k in p if k not in ALPHA4_CFG)
+        if unknown:
+            raise ValueError(f"Paramètres inconnus dans la grille : {', '.join(unknown)}")
+        fixed = sorted(k for k in p if k in _V4_SWEEP_RUN_KEYS or k in _V4_SERVER_KEYS)
+        if fixed:
+            raise ValueError(f"Paramètres d'exécution interdits dans la grille : {', '.join(fixed)}")
+        _v4_check_request(p)
+    return points
+
+
+def _v4_sweep_group(point):
+    # clé des paramètres de données / indicateurs d'un point
+    return tuple(
+        (k, json.dumps(v, sort_keys=True, default=str))
+        for k, v in sorted(point.items()) if k not in _V4_SWEEP_SIM_KEYS
+    )
+
+
+def _v4_sweep_row(point, out):
+    portfolio = out['portfolio']
+    allocator = portfolio['allocator']
+    return dict(
+        point,
+        gain_total=portfolio['gain_total'],
+        nb_trades=portfolio['nb_trades'],
+        win_rate=portfolio['win_rate'],
+        ending_cash=allocator.get('ending_cash'),
+        max_exposure_eur=allocator.get('max_exposure_eur'),
+        rejected_entries_count=allocator.get('rejected_entries_count'),
+        candidate_trades=int(sum(st['nb_trades'] for st in portfolio['by_ticker'].values())),
+        open_positions=len(out['open_positions'])
+    )
+
+
+def alpha4_sweep_chunk(cfg, points):
+    """
+    Évalue `points` sur la configuration cfg ; une ligne (paramètres +
+    métriques) par point, dans l'ordre des points. Résultat de chaque point
+    identique à alpha4(dict(cfg, **point)).
+
+    Données et features chargées une fois par groupe de points partageant
+    les paramètres de données / indicateurs (features sans élagage : elles
+    servent à tous les MIN_SCORE). Les suivis de trades (walk_trade) sont
+    mémorisés par ticker entre les points : des points qui ne diffèrent
+    que par les sorties rejouent les trades communs sans les recalculer.
+    EXECUTOR='threads' : points d'un groupe sur un pool de threads.
+    """
+    base = dict(ALPHA4_CFG, **cfg)
+    base.update(SHARDS=0, STREAMING_MODE=False, FEATURE_STORE=False, SCORE_PRUNING=False)
+    executor = sharding.check_executor(base.get('EXECUTOR') or 'serial')
+    min_history = int(base.get('MIN_HISTORY_BARS', 100))
+
+    groups = {}
+    for n, point in enumerate(points):
+        groups.setdefault(_v4_sweep_group(point), []).append(n)
+
+    rows = [None] * len(points)
+    for members in groups.values():
+        benches, universe, frames, _ = _v4_source(dict(base, **points[members[0]]))
+        tickers = [(t, bars, features, {}) for t, bars, features in frames if len(bars) >= min_history]
+
+        def _run(n):
+            point_cfg = dict(base, **points[n])
+            records = [
+                _v4_simulate(point_cfg, benches, t, bars, features, walk_cache=cache)
+                for t, bars, features, cache in tickers
+            ]
+            return _v4_sweep_row(points[n], _v4_finalize(point_cfg, universe, records))
+
+        for n, row in zip(members, sharding.map_ordered(
+            _run, members, executor='threads' if executor == 'threads' else 'serial',
+            max_workers=base.get('MAX_WORKERS')
+        )):
+            rows[n] = row
+
+    return rows
+
+
+def alpha4_sweep(grid, cfg=None, metric='gain_total', ascending=False, top=None):
+    """
+    Sweep alpha4 sur une grille de paramètres (voir _v4_sweep_points).
+    cfg : configuration de base (défaut ALPHA4_CFG). EXECUTOR='processes' :
+    points regroupés par paramètres de données / indicateurs puis découpés
+    en un lot contigu par worker (chaque worker charge ses données une fois).
+
+    Retourne {'metric', 'n_points', 'n_groups', 'elapsed_s', 'results'} ;
+    results = table compacte {columns, rows} (rank, paramètres, métriques)
+    triée par metric (rang 1 = meilleur ; égalités dans l'ordre de la grille),
+    limitée aux `top` premières lignes.
+    """
+    t0 = time.perf_counter()
+    if metric not in SWEEP_METRICS:
+        raise ValueError(f"Métrique inconnue : {metric!r} (attendu : {', '.join(SWEEP_METRICS)})")
+
+    base = dict(ALPHA4_CFG, **(cfg or {}))
+    points = _v4_sweep_points(grid)
+    executor = sharding.check_executor(base.get('EXECUTOR') or 'serial')
+    order = sorted(range(len(points)), key=lambda n: _v4_sweep_group(points[n]))
+
+    if executor == 'processes' and len(points) > 1:
+        workers = min(sharding.resolve_workers(base.get('MAX_WORKERS')), len(points))
+        chunks = [c.tolist() for c in np.array_split(np.array(order, dtype=np.int64), workers) if len(c)]
+        chunk_cfg = dict(base, EXECUTOR='serial')
+        results = sharding.map_shards(
+            alpha4_sweep_chunk,
+            [{'cfg': chunk_cfg, 'points': [points[n] for n in c]} for c in chunks],
+            mode='processes',
+            max_workers=workers
+        )
+        rows = [None] * len(points)
+        for c, chunk_rows in zip(chunks, results):
+            for n, row in zip(c, chunk_rows):
+                rows[n] = row
+    else:
+        rows = alpha4_sweep_chunk(base, points)
+
+    def _rank_key(n):
+        v = rows[n][metric]
+        return (v is None, 0.0 if v is None else (v if ascending else -v))
+
+    ranked = [dict(rank=r + 1, **rows[n]) for r, n in enumerate(sorted(range(len(rows)), key=_rank_key))]
+    if top is not None:
+        ranked = ranked[:int(top)]
+
+    return {
+        'metric': metric,
+        'ascending': bool(ascending),
+        'n_points': len(points),
+        'n_groups': len({_v4_sweep_group(p) for p in points}),
+        'elapsed_s': round(time.perf_counter() - t0, 3),
+        'results': sharding.encode_records(ranked)
+    }
+
+
 if __name__ == '__main__':
     out = alpha4(ALPHA4_CFG)
     print(json.dumps(out, indent=2, ensure_ascii=False))